@@ -5,12 +5,18 @@ Evaluates agent outputs and computes quality / observability metrics.
 Current capabilities:
 - creative_intent_score for Visionizer's character_description
 - lesson_alignment_score for Quest Creator's quest JSON vs. lesson theme
+
+Illustrator consistency is scored locally from pixels (see tools/consistency_tool.py).
 """
 
 from typing import Any, Dict
 
 from google.adk.agents import LlmAgent
 
+from agents.schemas import CreativeIntentEvaluation, LessonAlignmentEvaluation
+from observability.costs import record_model_usage
+from pipeline.quota import acquire_model_quota
+
 
 # AgentOps instruction: score Visionizer's character_description
 agent_ops_instruction = """
@@ -61,8 +67,11 @@ RULES:
 agent_ops = LlmAgent(
     name="agent_ops",
     model="gemini-2.0-flash-exp",
+    before_model_callback=acquire_model_quota,
+    after_model_callback=record_model_usage,
     description="Observability agent that scores other agents' outputs (e.g., creative_intent_score for Visionizer)",
     instruction=agent_ops_instruction,
+    output_schema=CreativeIntentEvaluation,
     output_key="agent_ops_result",
 )
 
@@ -77,13 +86,12 @@ a numeric lesson_alignment_score between 0.0 and 1.0 (inclusive).
 INPUT YOU RECEIVE:
 - lesson: the target life lesson or theme (e.g., "kindness", "sharing", "online safety")
 - character_description: description of the child's character
-- quest_data: JSON object generated by Quest Creator, including quest_title, lesson, and 8 scenes
+- quest_data: JSON object generated by Quest Creator, including quest_title, lesson, character_name and 8 scenes
 
 Each scene includes:
 - scenario: what happens
 - question: what the character should do
 - option_a / option_b: correct and incorrect choices
-- image_prompt: prompt for illustration
 
 WHAT TO EVALUATE:
 When scoring lesson_alignment_score, consider:
@@ -122,69 +130,10 @@ RULES:
 agent_ops_quest = LlmAgent(
     name="agent_ops_quest",
     model="gemini-2.0-flash-exp",
+    before_model_callback=acquire_model_quota,
+    after_model_callback=record_model_usage,
     description="Observability agent that scores Quest Creator outputs with a lesson_alignment_score",
     instruction=quest_ops_instruction,
+    output_schema=LessonAlignmentEvaluation,
     output_key="agent_ops_quest_result",
 )
-
-
-# AgentOps instruction: score Illustrator character consistency for a specific scene
-illustrator_ops_instruction = """
-You are AgentOps, a reliability and quality reviewer for Storytopia's illustration pipeline.
-
-Your job in this mode is to evaluate how well a single SCENE ILLUSTRATION preserves the
-original character's visual identity and style.
-
-INPUT YOU RECEIVE (as plain text fields):
-- original_character_image_uri: URI for the original character image (the canonical design)
-- scene_image_uri: URI for the scene illustration image to judge (e.g., scene 3)
-
-ASSUME you can "see" both images. Compare them visually and conceptually as if you were
-a vision-language model with access to both images.
-
-WHAT TO EVALUATE:
-1. CHARACTER IDENTITY
-   - Does the character in the scene clearly look like the same character as in the original image?
-   - Are core identity traits preserved (species/type, body shape, key accessories)?
-
-2. VISUAL STYLE & FEATURES
-   - Are key visual traits preserved (colors, markings, clothing, accessories, hairstyle, etc.)?
-   - Does the drawing/illustration style feel consistent (storybook style, level of detail)?
-
-3. OVERALL CONSISTENCY
-   - Would a child recognize this as the SAME CHARACTER across both images?
-
-SCORING GUIDELINES (illustrator_consistency_score):
-- 0.90–1.00: Excellent. Character is clearly the same with highly consistent visual traits and style.
-- 0.70–0.89: Good. Mostly consistent, with only small deviations that do not confuse identity.
-- 0.40–0.69: Mixed. Some traits match, but notable differences in look or style.
-- 0.10–0.39: Weak. Character feels different or confusing; several key traits changed.
-- 0.00–0.09: Failed. Character clearly does not match the original at all.
-
-OUTPUT FORMAT (STRICT JSON):
-Return ONLY a JSON object with this exact structure:
-{
-  "illustrator_consistency_score": <float between 0 and 1>,
-  "reasoning": "short explanation of how well the scene preserves character identity and style (1–3 sentences)",
-  "agent_under_review": "illustrator",
-  "scene_number": <integer scene number you evaluated>
-}
-
-RULES:
-- The score MUST be a number between 0 and 1 (inclusive).
-- Use the provided URIs as if you visually inspected the images they point to.
-- Do NOT include any additional top-level fields.
-- Do NOT include markdown, code fences, or commentary outside the JSON object.
-"""
-
-
-agent_ops_illustrator = LlmAgent(
-    name="agent_ops_illustrator",
-    model="gemini-2.0-flash-exp",
-    description=(
-        "Observability agent that scores Illustrator outputs with an "
-        "illustrator_consistency_score comparing original vs. scene image"
-    ),
-    instruction=illustrator_ops_instruction,
-    output_key="agent_ops_illustrator_result",
-)
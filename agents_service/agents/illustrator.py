@@ -8,22 +8,198 @@ The agent:
 - Generates a detailed image for each of the 8 scenes
 - Ensures visual consistency with the child's character
 - Creates warm, colorful, child-friendly illustrations
+
+/create-quest uses SceneIllustrationQueue directly so scenes are rendered
+while the Quest-Creator is still streaming; the agent/tool flow below is
+kept for ADK runs that hand over a complete quest. Both submit their scenes
+to the process-wide image scheduler (pipeline.scheduler), which renders early
+scenes of every quest before late ones.
 """
 
 import os
-import json
 import sys
-from typing import Dict, List, Any
+import time
+import asyncio
+from concurrent.futures import Future, wait
+from typing import Any, Callable, Dict, List, Optional
 from google.adk.agents import LlmAgent
 
 sys.path.append('..')
-from tools.imagen_tool import generate_scene_image
+from tools.imagen_tool import generate_scene_asset
+from agents.schemas import IllustrationResult, Quest, SceneImage, parse_model
+from observability.costs import record_model_usage
+from observability.log import get_logger
+from observability.metrics import QUEUE_DEPTH
+from pipeline.quota import QuotaTimeout, acquire_model_quota
+from pipeline.scheduler import image_scheduler
+
+logger = get_logger("illustrator")
+
+
+def render_scene(scene_number: int, image_prompt: str, character_description: str) -> dict:
+    """
+    Renders one scene illustration with strict character consistency
+    
+    Args:
+        scene_number: 1-based scene number
+        image_prompt: The scene's image_prompt from the Quest-Creator
+        character_description: DETAILED character description for visual consistency
+    
+    Returns:
+        SceneImage dict; image_uri is "" and error is set when generation fails
+    
+    Raises:
+        QuotaTimeout: the Imagen quota is exhausted; the endpoint answers 429
+            instead of returning a quest of placeholders
+    """
+    try:
+        # The character description is merged into the prompt once (see pipeline/prompts.py)
+        asset = generate_scene_asset(
+            prompt=image_prompt,
+            character_description=character_description,
+            enforce_consistency=True
+        )
+        logger.info("Scene %d complete: %s", scene_number, asset["image_uri"])
+        return SceneImage(
+            scene_number=scene_number,
+            image_uri=asset["image_uri"],
+            srcset=asset["srcset"],
+            prompt_used=image_prompt
+        ).model_dump()
+    except QuotaTimeout:
+        raise
+    except Exception as e:
+        logger.warning("Scene %d failed: %s", scene_number, e)
+        # Placeholder for failed scene
+        return SceneImage(
+            scene_number=scene_number,
+            image_uri="",
+            prompt_used=image_prompt,
+            error=str(e)
+        ).model_dump()
+
+
+def apply_scene_images(scenes: List[Dict[str, Any]], scene_images: List[Dict[str, Any]]) -> int:
+    """
+    Sets image_uri and image_srcset on every quest scene from the illustration results
+    
+    Scenes without an image get "" (and an empty srcset) so the frontend can
+    load progressively.
+    
+    Args:
+        scenes: Quest scenes, updated in place
+        scene_images: SceneImage dicts ({"scene_number": 1, "image_uri": "..."})
+    
+    Returns:
+        Number of scenes that received a non-empty image_uri
+    """
+    images = {img["scene_number"]: img for img in scene_images}
+    images_applied = 0
+    for scene in scenes:
+        image = images.get(scene["scene_number"], {})
+        scene["image_uri"] = image.get("image_uri", "")
+        scene["image_srcset"] = image.get("srcset") or {}
+        if scene["image_uri"]:
+            images_applied += 1
+    return images_applied
+
+
+class SceneIllustrationQueue:
+    """
+    Submits one quest's scenes to the image scheduler as they arrive
+    
+    Used while the Quest-Creator is still streaming: each scene is submitted as
+    soon as it is parsed, so image generation overlaps text generation. Each
+    scene's deadline comes from the quest's start time and its scene number.
+    Pacing against the Imagen quota is left to the scheduler and pipeline.quota.
+    """
+    
+    def __init__(
+        self,
+        character_description: str,
+        started_at: Optional[float] = None,
+        on_rendered: Optional[Callable[[Dict[str, Any]], None]] = None,
+    ):
+        self.character_description = character_description
+        self.started_at = started_at if started_at is not None else time.monotonic()
+        # Called from the render thread with every successful SceneImage dict (e.g. to checkpoint it)
+        self.on_rendered = on_rendered
+        self._futures: Dict[int, Future] = {}
+        self.first_image_at: Optional[float] = None
+    
+    def submit(self, scene: Dict[str, Any], deadline: Optional[float] = None) -> Future:
+        """
+        Queues a scene for rendering; duplicates of a queued scene_number are ignored
+        
+        Args:
+            scene: Quest scene with scene_number and image_prompt
+            deadline: Monotonic deadline overriding the scene-number based one
+        """
+        scene_number = scene["scene_number"]
+        if scene_number not in self._futures:
+            if deadline is None:
+                deadline = image_scheduler.deadline_for(scene_number, self.started_at)
+            future = image_scheduler.submit(
+                self._render,
+                scene_number,
+                scene.get("image_prompt", ""),
+                deadline=deadline,
+                priority=str(scene_number),
+            )
+            # Pending = queued or rendering; cancelled scenes are released too
+            QUEUE_DEPTH.inc(queue="illustration")
+            future.add_done_callback(lambda _: QUEUE_DEPTH.dec(queue="illustration"))
+            self._futures[scene_number] = future
+        return self._futures[scene_number]
+    
+    def _render(self, scene_number: int, image_prompt: str) -> dict:
+        result = render_scene(scene_number, image_prompt, self.character_description)
+        if result["image_uri"]:
+            if self.first_image_at is None:
+                self.first_image_at = time.monotonic()
+            if self.on_rendered is not None:
+                try:
+                    self.on_rendered(result)
+                except Exception:
+                    logger.exception("on_rendered failed for scene %d", scene_number)
+        return result
+    
+    def cancel(self) -> None:
+        """Drops scenes that have not started rendering (e.g. the quest failed to parse)"""
+        for future in self._futures.values():
+            future.cancel()
+    
+    def __contains__(self, scene_number: int) -> bool:
+        return scene_number in self._futures
+    
+    async def gather(self) -> dict:
+        """
+        Waits for every queued scene and returns an IllustrationResult dict
+        
+        Raises:
+            QuotaTimeout: a scene could not get Imagen quota; scenes that have
+                not started rendering are cancelled
+        """
+        try:
+            results = await asyncio.gather(
+                *(asyncio.wrap_future(f) for f in self._futures.values())
+            )
+        except BaseException:
+            self.cancel()
+            raise
+        scene_images = sorted(results, key=lambda img: img["scene_number"])
+        return IllustrationResult(
+            success=True,
+            character_description=self.character_description,
+            scene_images=scene_images,
+            total_scenes=len(scene_images)
+        ).model_dump()
 
 
 def generate_all_scene_illustrations(quest_json: str, character_description: str) -> str:
     """
     Tool function: Generates all 8 scene illustrations for the quest
-    Generates first 4 scenes immediately, then waits 3 minutes before generating remaining 4
+    Scenes are rendered by the image scheduler in scene order
     
     Args:
         quest_json: JSON string of the quest data with 8 scenes
@@ -33,155 +209,43 @@ def generate_all_scene_illustrations(quest_json: str, character_description: str
         JSON string with image URIs for all 8 scenes
     """
     try:
-        import time
-        from json import JSONDecodeError
-        
-        print(f"[Illustrator Tool] Starting illustration generation...")
-        print(f"[Illustrator Tool] Character description: {character_description[:100]}...")
+        logger.info("Starting illustration generation", extra={"character_description": character_description[:100]})
         
-        # Parse quest data
-        if isinstance(quest_json, dict):
-            quest_data = quest_json
-        else:
-            try:
-                quest_data = json.loads(quest_json)
-            except JSONDecodeError:
-                # Fallback: extract the first JSON object from the string
-                try:
-                    s = str(quest_json)
-                    start = s.find("{")
-                    end = s.rfind("}")
-                    if start == -1 or end == -1:
-                        raise
-                    candidate = s[start : end + 1]
-                    quest_data = json.loads(candidate)
-                except Exception:
-                    # Preserve existing error behavior
-                    raise
+        # Validate quest data against the Quest schema (string or dict)
+        quest_data = parse_model(Quest, quest_json).model_dump()
         scenes = quest_data.get("scenes", [])
         
         if len(scenes) != 8:
-            return json.dumps({
-                "success": False,
-                "error": f"Expected 8 scenes, got {len(scenes)}"
-            })
-        
-        image_uris = []
-        
-        # Generate FIRST 4 scenes immediately
-        print(f"[Illustrator Tool] ⚡ BATCH 1: Generating scenes 1-4 (immediate)...")
-        for i, scene in enumerate(scenes[:4], 1):
-            print(f"[Illustrator Tool] Generating scene {i}/8...")
-            
-            # Get the image prompt from the scene
-            image_prompt = scene.get("image_prompt", "")
-            
-            # Enhance prompt with character description for consistency
-            enhanced_prompt = f"{image_prompt}\n\nCharacter consistency note: {character_description}"
-            
-            try:
-                # Generate the image with strict character consistency
-                image_uri = generate_scene_image(
-                    prompt=enhanced_prompt,
-                    character_description=character_description,
-                    enforce_consistency=True
-                )
-                
-                image_uris.append({
-                    "scene_number": i,
-                    "image_uri": image_uri,
-                    "prompt_used": image_prompt
-                })
-                
-                print(f"[Illustrator Tool] ✅ Scene {i} complete: {image_uri}")
-                
-                # Add delay between images to respect rate limits (30 RPM quota)
-                if i < 4:  # Don't wait after last image of batch
-                    delay = 5
-                    print(f"[Illustrator Tool] ⏳ Waiting {delay} seconds before next image (rate limit management)...")
-                    time.sleep(delay)
-                    
-            except Exception as e:
-                print(f"[Illustrator Tool] ⚠️ Scene {i} failed: {str(e)}")
-                # Add placeholder for failed scene
-                image_uris.append({
-                    "scene_number": i,
-                    "image_uri": "",
-                    "prompt_used": image_prompt,
-                    "error": str(e)
-                })
-        
-        print(f"[Illustrator Tool] ✅ First 4 scenes complete! User can start reading now.")
-        
-        # WAIT 20 seconds before generating remaining scenes (30 RPM quota allows faster generation)
-        wait_time = 20  # 20 seconds
-        print(f"[Illustrator Tool] ⏳ Waiting {wait_time} seconds before generating scenes 5-8...")
-        print(f"[Illustrator Tool] 💡 User can interact with first 4 scenes during this time!")
-        time.sleep(wait_time)
+            return IllustrationResult(
+                success=False,
+                error=f"Expected 8 scenes, got {len(scenes)}"
+            ).model_dump_json()
         
-        # Generate REMAINING 4 scenes
-        print(f"[Illustrator Tool] ⚡ BATCH 2: Generating scenes 5-8...")
-        for i, scene in enumerate(scenes[4:], 5):
-            print(f"[Illustrator Tool] Generating scene {i}/8...")
-            
-            # Get the image prompt from the scene
-            image_prompt = scene.get("image_prompt", "")
-            
-            # Enhance prompt with character description for consistency
-            enhanced_prompt = f"{image_prompt}\n\nCharacter consistency note: {character_description}"
-            
-            try:
-                # Generate the image with strict character consistency
-                image_uri = generate_scene_image(
-                    prompt=enhanced_prompt,
-                    character_description=character_description,
-                    enforce_consistency=True
-                )
-                
-                image_uris.append({
-                    "scene_number": i,
-                    "image_uri": image_uri,
-                    "prompt_used": image_prompt
-                })
-                
-                print(f"[Illustrator Tool] ✅ Scene {i} complete: {image_uri}")
-                
-                # Add delay between images to respect rate limits (30 RPM quota)
-                if i < 8:  # Don't wait after last image
-                    delay = 5
-                    print(f"[Illustrator Tool] ⏳ Waiting {delay} seconds before next image (rate limit management)...")
-                    time.sleep(delay)
-                    
-            except Exception as e:
-                print(f"[Illustrator Tool] ⚠️ Scene {i} failed: {str(e)}")
-                # Add placeholder for failed scene
-                image_uris.append({
-                    "scene_number": i,
-                    "image_uri": "",
-                    "prompt_used": image_prompt,
-                    "error": str(e)
-                })
+        # All 8 scenes go to the shared scheduler; it renders early scenes
+        # (of this and every other quest) before late ones
+        queue = SceneIllustrationQueue(character_description)
+        futures = [queue.submit(scene) for scene in scenes]
+        wait(futures)
+        image_uris = sorted((f.result() for f in futures), key=lambda img: img["scene_number"])
         
-        result = {
-            "success": True,
-            "character_description": character_description,
-            "scene_images": image_uris,
-            "total_scenes": len(image_uris)
-        }
+        result = IllustrationResult(
+            success=True,
+            character_description=character_description,
+            scene_images=image_uris,
+            total_scenes=len(image_uris)
+        )
         
-        print(f"[Illustrator Tool] 🎉 All 8 scenes generated successfully!")
-        return json.dumps(result)
+        logger.info("All 8 scenes generated")
+        return result.model_dump_json()
         
+    except QuotaTimeout:
+        raise
     except Exception as e:
-        import traceback
-        error_details = traceback.format_exc()
-        print(f"[Illustrator Tool] ERROR: {str(e)}")
-        print(f"[Illustrator Tool] Traceback: {error_details}")
-        return json.dumps({
-            "success": False,
-            "error": f"{type(e).__name__}: {str(e)}",
-            "traceback": error_details
-        })
+        logger.exception("Illustration generation failed")
+        return IllustrationResult(
+            success=False,
+            error=f"{type(e).__name__}: {str(e)}"
+        ).model_dump_json()
 
 
 # Illustrator Agent Configuration
@@ -212,6 +276,8 @@ YOU MUST CALL THE TOOL FUNCTION. The tool will generate REAL images using Imagen
 illustrator_agent = LlmAgent(
     name="illustrator",
     model="gemini-2.0-flash-exp",
+    before_model_callback=acquire_model_quota,
+    after_model_callback=record_model_usage,
     description="Generates 8 storybook-style scene illustrations using Imagen with character consistency",
     instruction=illustrator_instruction,
     tools=[generate_all_scene_illustrations],
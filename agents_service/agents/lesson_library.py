@@ -0,0 +1,307 @@
+"""
+Lesson Library
+Pre-generated quest skeletons per lesson and character archetype
+
+Most quests are requested for a handful of lessons (sharing, kindness, ...),
+yet each one used to be written from scratch by the Quest-Creator. The
+library stores one skeleton per (lesson, archetype): a complete quest written
+for the placeholder character "[CHARACTER]". /create-quest specializes a
+matching skeleton with the Quest-Specializer (a much cheaper call) and falls
+back to full generation for lessons that are not in the library.
+
+Build (one Quest-Creator run per skeleton, in a process pool):
+    python -m agents.lesson_library --workers 4
+    python -m agents.lesson_library --lesson bravery --lesson friendship --archetype animal
+
+Environment:
+    QUEST_LIBRARY_DIR      skeleton directory (default data/quest_library)
+    QUEST_LIBRARY_ENABLED  0 disables skeleton lookup in /create-quest
+"""
+
+import argparse
+import asyncio
+import json
+import multiprocessing
+import os
+import re
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from typing import Any, Dict, List, Optional
+
+from agents.schemas import Quest, parse_model
+from observability.log import get_logger
+from pipeline.prompts import PromptBuilder, compact_json
+
+logger = get_logger("lesson_library")
+
+SERVICE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+LESSONS_PATH = os.path.join(SERVICE_DIR, "data", "lessons.json")
+DEFAULT_LIBRARY_DIR = os.getenv("QUEST_LIBRARY_DIR", os.path.join(SERVICE_DIR, "data", "quest_library"))
+
+PLACEHOLDER_NAME = "[CHARACTER]"
+
+# Archetype -> (placeholder description used when building, keywords matched in character descriptions)
+ARCHETYPES: Dict[str, tuple] = {
+    "animal": (
+        "a small, friendly animal with soft fur and big curious eyes",
+        ("bunny", "rabbit", "cat", "kitten", "dog", "puppy", "bear", "fox", "mouse", "bird", "owl",
+         "duck", "frog", "turtle", "lion", "tiger", "elephant", "giraffe", "penguin", "fish", "pig",
+         "horse", "monkey", "panda", "koala", "squirrel", "hedgehog", "animal"),
+    ),
+    "creature": (
+        "a gentle magical creature with sparkly colors and a kind smile",
+        ("dragon", "unicorn", "monster", "fairy", "alien", "dinosaur", "mermaid", "creature",
+         "magical", "phoenix", "griffin", "slime", "ghost"),
+    ),
+    "robot": (
+        "a cheerful little robot with shiny panels and glowing eyes",
+        ("robot", "android", "machine", "cyborg", "bot"),
+    ),
+    "person": (
+        "a cheerful child with a big smile and colorful clothes",
+        ("girl", "boy", "kid", "child", "person", "princess", "prince", "hero", "superhero",
+         "astronaut", "knight", "wizard", "pirate"),
+    ),
+}
+# Used when no keyword matches
+DEFAULT_ARCHETYPE = "creature"
+
+
+def normalize_lesson(lesson: str) -> str:
+    """Lesson id or title -> slug ("Sharing My Toys" -> "sharing-my-toys")"""
+    return re.sub(r"[^a-z0-9]+", "-", lesson.lower()).strip("-")
+
+
+def classify_archetype(character_description: str) -> str:
+    """Picks the archetype whose keywords appear earliest in the description"""
+    text = character_description.lower()
+    best, best_pos = DEFAULT_ARCHETYPE, None
+    for archetype, (_, keywords) in ARCHETYPES.items():
+        for keyword in keywords:
+            match = re.search(rf"\b{re.escape(keyword)}", text)
+            if match and (best_pos is None or match.start() < best_pos):
+                best, best_pos = archetype, match.start()
+    return best
+
+
+def load_lessons() -> List[Dict[str, Any]]:
+    with open(LESSONS_PATH) as f:
+        return json.load(f)["lessons"]
+
+
+class LessonLibrary:
+    """Read-only view of the skeleton directory; skeletons are loaded once and kept in memory"""
+
+    def __init__(self, directory: str = DEFAULT_LIBRARY_DIR, enabled: bool = True):
+        self.directory = directory
+        self.enabled = enabled
+        self._skeletons: Optional[Dict[tuple, Dict[str, Any]]] = None
+        self._aliases: Dict[str, str] = {}
+        self.hits = 0
+        self.misses = 0
+
+    def _load(self) -> Dict[tuple, Dict[str, Any]]:
+        if self._skeletons is not None:
+            return self._skeletons
+        skeletons = {}
+        if os.path.isdir(self.directory):
+            for filename in sorted(os.listdir(self.directory)):
+                if not filename.endswith(".json"):
+                    continue
+                try:
+                    with open(os.path.join(self.directory, filename)) as f:
+                        entry = json.load(f)
+                    entry["quest"] = parse_model(Quest, entry["quest"]).model_dump()
+                except (OSError, KeyError, ValueError) as e:
+                    logger.warning("Skipping invalid skeleton %s: %s", filename, e)
+                    continue
+                skeletons[(entry["lesson_id"], entry["archetype"])] = entry
+        try:
+            # Titles ("Sharing My Toys") resolve to their lesson ids
+            self._aliases = {normalize_lesson(l["title"]): l["id"] for l in load_lessons()}
+        except (OSError, KeyError, ValueError):
+            self._aliases = {}
+        logger.info("Lesson library loaded: %d skeletons from %s", len(skeletons), self.directory)
+        self._skeletons = skeletons
+        return skeletons
+
+    def load(self) -> int:
+        """Loads the skeletons now instead of on the first lookup; returns how many there are"""
+        return len(self._load())
+
+    def lookup(self, lesson: str, character_description: str) -> Optional[Dict[str, Any]]:
+        """
+        Finds the skeleton for a lesson and the character's archetype
+
+        Returns:
+            Library entry ({"lesson_id", "archetype", "quest", ...}) or None
+        """
+        if not self.enabled:
+            return None
+        skeletons = self._load()
+        slug = normalize_lesson(lesson)
+        lesson_id = self._aliases.get(slug, slug)
+        archetype = classify_archetype(character_description)
+        entry = skeletons.get((lesson_id, archetype)) or skeletons.get((lesson_id, DEFAULT_ARCHETYPE))
+        if entry is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return entry
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "enabled": self.enabled,
+            "skeletons": len(self._skeletons) if self._skeletons is not None else None,
+            "hits": self.hits,
+            "misses": self.misses,
+        }
+
+
+lesson_library = LessonLibrary(enabled=os.getenv("QUEST_LIBRARY_ENABLED", "1") != "0")
+
+
+def specialization_input(skeleton: Dict[str, Any], character_name: str, character_description: str) -> str:
+    """User message for the Quest-Specializer (the skeleton is sent as compact JSON)"""
+    return (
+        PromptBuilder("quest_specializer")
+        .add(f"""
+Rewrite this quest skeleton for the real character.
+
+CHARACTER NAME: {character_name}
+CHARACTER DESCRIPTION: {character_description}
+""", dedupe=False)
+        .add(compact_json(skeleton["quest"]), prefix=f"SKELETON (placeholder character: {PLACEHOLDER_NAME}):\n", dedupe=False)
+        .build()
+    )
+
+
+# ---------------------------------------------------------------------------
+# Batch build
+# ---------------------------------------------------------------------------
+
+def skeleton_path(directory: str, lesson_id: str, archetype: str) -> str:
+    return os.path.join(directory, f"{lesson_id}__{archetype}.json")
+
+
+def _generate_skeleton(lesson: Dict[str, Any], archetype: str) -> Dict[str, Any]:
+    """Process-pool worker: one full Quest-Creator run for a placeholder character"""
+    from google.adk.runners import Runner
+    from google.adk.sessions import InMemorySessionService
+    from google.genai import types
+
+    from agents.quest_creator import quest_creator_agent
+    from tools.cassette import run_agent
+
+    description = ARCHETYPES[archetype][0]
+    concepts = ", ".join(lesson.get("key_concepts", []))
+    quest_input = f"""
+Create an interactive quest with these details:
+
+CHARACTER NAME: {PLACEHOLDER_NAME}
+CHARACTER DESCRIPTION: {PLACEHOLDER_NAME} is {description}
+LESSON: {lesson["title"]} ({lesson["description"]}; key concepts: {concepts})
+
+This quest is a reusable template. Write "{PLACEHOLDER_NAME}" wherever the character's name
+belongs, in ALL 8 scenes, and keep visual details generic enough for any {archetype} character.
+"""
+
+    async def run() -> str:
+        session_service = InMemorySessionService()
+        user_id = f"library_{lesson['id']}_{archetype}"
+        await session_service.create_session(app_name="storytopia_library", user_id=user_id, session_id=user_id)
+        runner = Runner(agent=quest_creator_agent, app_name="storytopia_library", session_service=session_service)
+        text = ""
+        async for event in run_agent(
+            runner,
+            user_id=user_id,
+            session_id=user_id,
+            new_message=types.Content(role="user", parts=[types.Part(text=quest_input)]),
+        ):
+            if event.content and event.content.parts:
+                for part in event.content.parts:
+                    if part.text:
+                        text = part.text
+        return text
+
+    started = time.monotonic()
+    quest = parse_model(Quest, asyncio.run(run())).model_dump()
+    return {
+        "lesson_id": lesson["id"],
+        "lesson_title": lesson["title"],
+        "archetype": archetype,
+        "generated_at": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "generation_seconds": round(time.monotonic() - started, 2),
+        "model": quest_creator_agent.model,
+        "quest": quest,
+    }
+
+
+def build_library(
+    lessons: List[Dict[str, Any]],
+    archetypes: List[str],
+    directory: str,
+    workers: int,
+    overwrite: bool = False,
+) -> Dict[str, int]:
+    """
+    Generates the missing skeletons in parallel and writes one JSON file per skeleton
+
+    Returns:
+        Counts of built, skipped and failed skeletons
+    """
+    os.makedirs(directory, exist_ok=True)
+    jobs = [
+        (lesson, archetype)
+        for lesson in lessons
+        for archetype in archetypes
+        if overwrite or not os.path.exists(skeleton_path(directory, lesson["id"], archetype))
+    ]
+    counts = {"built": 0, "skipped": len(lessons) * len(archetypes) - len(jobs), "failed": 0}
+    if not jobs:
+        return counts
+
+    # spawn: gRPC clients in the parent are not fork-safe
+    with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn")) as pool:
+        futures = {pool.submit(_generate_skeleton, lesson, archetype): (lesson["id"], archetype) for lesson, archetype in jobs}
+        for future in as_completed(futures):
+            lesson_id, archetype = futures[future]
+            try:
+                entry = future.result()
+            except Exception as e:
+                counts["failed"] += 1
+                logger.warning("Skeleton %s/%s failed: %s", lesson_id, archetype, e)
+                continue
+            path = skeleton_path(directory, lesson_id, archetype)
+            tmp = path + ".tmp"
+            with open(tmp, "w") as f:
+                json.dump(entry, f, indent=2, ensure_ascii=False)
+            os.replace(tmp, path)
+            counts["built"] += 1
+            logger.info("Skeleton %s/%s written (%.1fs)", lesson_id, archetype, entry["generation_seconds"])
+    return counts
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Build the pre-generated lesson quest library")
+    parser.add_argument("--lesson", action="append", help="Lesson id (repeatable; default: every lesson in data/lessons.json)")
+    parser.add_argument("--archetype", action="append", choices=sorted(ARCHETYPES), help="Archetype (repeatable; default: all)")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 2, help="Parallel Quest-Creator processes")
+    parser.add_argument("--output", default=DEFAULT_LIBRARY_DIR, help="Skeleton directory")
+    parser.add_argument("--overwrite", action="store_true", help="Regenerate skeletons that already exist")
+    args = parser.parse_args()
+
+    known = {lesson["id"]: lesson for lesson in load_lessons()}
+    if args.lesson:
+        # Lessons outside lessons.json (e.g. "bravery") get a minimal definition
+        lessons = [
+            known.get(normalize_lesson(l)) or {"id": normalize_lesson(l), "title": l, "description": l, "key_concepts": []}
+            for l in args.lesson
+        ]
+    else:
+        lessons = list(known.values())
+
+    counts = build_library(lessons, args.archetype or sorted(ARCHETYPES), args.output, args.workers, args.overwrite)
+    logger.info("Lesson library build done: %s", counts)
+    sys.exit(1 if counts["failed"] else 0)
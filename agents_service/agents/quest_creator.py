@@ -15,6 +15,10 @@ import json
 from typing import Dict, List, Any
 from google.adk.agents import LlmAgent
 
+from agents.schemas import Quest
+from observability.costs import record_model_usage
+from pipeline.quota import acquire_model_quota
+
 
 # Quest-Creator Agent Configuration
 quest_creator_instruction = """
@@ -113,7 +117,10 @@ Do NOT add any explanatory text before or after the JSON. Return ONLY the JSON o
 quest_creator_agent = LlmAgent(
     name="quest_creator",
     model="gemini-2.0-flash-exp",
+    before_model_callback=acquire_model_quota,
+    after_model_callback=record_model_usage,
     description="Creates 8-scene interactive quests teaching life lessons through the child's character",
     instruction=quest_creator_instruction,
+    output_schema=Quest,
     output_key="quest_data"
 )
@@ -0,0 +1,48 @@
+"""
+Quest-Specializer Agent
+Adapts a pre-generated quest skeleton to the child's character
+
+The skeleton (from the lesson library, see agents/lesson_library.py) already
+has the 8-scene story arc, questions and correct/incorrect options for the
+lesson. This agent only rewrites it around the child's character: names,
+visual traits and image prompts. That is much less work than writing a quest
+from scratch, so it runs on the smaller Flash-Lite model.
+"""
+
+from google.adk.agents import LlmAgent
+
+from agents.schemas import Quest
+from observability.costs import record_model_usage
+from pipeline.quota import GEMINI_LITE_MODEL, acquire_model_quota
+
+
+quest_specializer_instruction = """
+You are the Quest-Specializer. You receive a finished 8-scene children's quest written for a
+placeholder character, plus the real character's name and description. Rewrite the quest for
+the real character.
+
+RULES:
+1. Keep the story arc, the lesson, the number of scenes, scene_number values and which option
+   is correct EXACTLY as in the skeleton.
+2. Replace every placeholder character name ([CHARACTER]) with the real character name,
+   and every generic character reference with the real character's name or visual traits.
+3. Weave the character's specific visual details (colors, features, style) into the scenarios.
+4. Every image_prompt MUST include the FULL character description for visual consistency.
+5. Keep the warm, simple, age-appropriate (4-8) storybook language and the content safety
+   rules of the skeleton: no violence, weapons, scary content or adult themes.
+6. Set character_name and character_description to the real character's values and keep
+   quest_title in the form "<Character name>'s <Lesson> Adventure".
+
+Return ONLY the JSON object for the rewritten quest, with the same structure as the skeleton.
+"""
+
+quest_specializer_agent = LlmAgent(
+    name="quest_specializer",
+    model=GEMINI_LITE_MODEL,
+    before_model_callback=acquire_model_quota,
+    after_model_callback=record_model_usage,
+    description="Rewrites a cached lesson quest skeleton for the child's character",
+    instruction=quest_specializer_instruction,
+    output_schema=Quest,
+    output_key="quest_data",
+)
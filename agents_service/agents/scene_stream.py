@@ -0,0 +1,101 @@
+"""
+Scene Stream Parser
+Incremental JSON parser for the Quest-Creator's streamed output
+
+Gemini streams the quest JSON token by token. SceneStreamParser scans each
+chunk once, tracks string/escape state and nesting depth, and emits every
+object inside the top-level "scenes" array as soon as its closing brace
+arrives - so scene N can be illustrated while scene N+1 is still being written.
+"""
+
+from typing import List, Optional
+
+from agents.schemas import QuestScene, parse_model
+
+
+class SceneStreamParser:
+    """Emits validated scene dicts from a streamed quest JSON document"""
+
+    def __init__(self, array_key: str = "scenes"):
+        self.array_key = array_key
+        self._pos = 0             # absolute offset of the next character to scan
+        self._depth = 0           # combined {} / [] nesting depth
+        self._in_string = False
+        self._escape = False
+        self._string_start: Optional[int] = None
+        self._last_key: Optional[str] = None
+        self._array_depth: Optional[int] = None  # depth inside the scenes array
+        self._object_start: Optional[int] = None
+        self._text = ""
+        self.errors: List[str] = []
+
+    def feed(self, chunk: str) -> List[dict]:
+        """
+        Consumes the next chunk of streamed text
+
+        Returns:
+            Scenes completed by this chunk, validated against QuestScene
+        """
+        if not chunk:
+            return []
+        self._text += chunk
+        text = self._text
+        completed: List[dict] = []
+
+        for i in range(self._pos, len(text)):
+            ch = text[i]
+
+            if self._in_string:
+                if self._escape:
+                    self._escape = False
+                elif ch == "\\":
+                    self._escape = True
+                elif ch == '"':
+                    self._in_string = False
+                    if self._depth == 1 and self._string_start is not None:
+                        self._last_key = text[self._string_start + 1 : i]
+                continue
+
+            if ch == '"':
+                self._in_string = True
+                self._string_start = i
+            elif ch in "{[":
+                if (
+                    ch == "["
+                    and self._depth == 1
+                    and self._last_key == self.array_key
+                    and self._array_depth is None
+                ):
+                    self._array_depth = self._depth + 1
+                elif ch == "{" and self._array_depth is not None and self._depth == self._array_depth:
+                    self._object_start = i
+                self._depth += 1
+            elif ch in "}]":
+                self._depth -= 1
+                if (
+                    ch == "}"
+                    and self._object_start is not None
+                    and self._depth == self._array_depth
+                ):
+                    scene = self._emit(text[self._object_start : i + 1])
+                    if scene is not None:
+                        completed.append(scene)
+                    self._object_start = None
+                elif ch == "]" and self._array_depth is not None and self._depth == self._array_depth - 1:
+                    self._array_depth = -1  # scenes array closed; ignore anything after
+
+        self._pos = len(text)
+        return completed
+
+    def _emit(self, raw: str) -> Optional[dict]:
+        try:
+            return parse_model(QuestScene, raw).model_dump()
+        except ValueError as e:
+            # A malformed scene is picked up again from the final, fully validated quest
+            self.errors.append(str(e))
+            return None
+
+    @property
+    def text(self) -> str:
+        """Everything received so far"""
+        return self._text
@@ -0,0 +1,183 @@
+"""
+Agent Schemas
+Pydantic models for every structured payload exchanged with Gemini
+
+The same models are passed to Gemini as response schemas (so generation is
+constrained to valid JSON) and used to validate the result exactly once with
+pydantic-core's JSON parser.
+"""
+
+from typing import Any, Dict, List, Optional, Type, TypeVar, Union
+
+from pydantic import BaseModel, Field, ValidationError, field_validator
+
+ModelT = TypeVar("ModelT", bound=BaseModel)
+
+
+def _clamp_score(value: Any) -> Any:
+    """Clamp numeric scores into [0, 1] instead of rejecting slightly-off values"""
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return max(0.0, min(1.0, float(value)))
+    return value
+
+
+# ---------------------------------------------------------------------------
+# Visionizer
+# ---------------------------------------------------------------------------
+
+class DrawingAnalysis(BaseModel):
+    """Gemini Vision analysis of a child's drawing"""
+
+    character_type: str = Field(description="What type of character is drawn (e.g., person, animal, creature)")
+    character_description: str = Field(description="Detailed description of the character's appearance")
+    colors_used: List[str] = Field(default_factory=list, description="List of main colors")
+    artistic_style: str = Field(default="", description="Drawing style (e.g., crayon, pencil, marker)")
+    mood: str = Field(default="", description="Overall mood/feeling of the drawing")
+    age_appropriate: bool = Field(default=True, description="Whether the drawing is appropriate for children")
+    details: str = Field(default="", description="Any other notable details")
+
+
+class VisionizerResult(BaseModel):
+    """Result of the analyze_and_generate_character tool"""
+
+    success: bool
+    error: Optional[str] = None
+    original_drawing_uri: Optional[str] = None
+    analysis: Optional[DrawingAnalysis] = None
+    character_prompt: Optional[str] = None
+    generated_character_uri: str = ""
+    # Responsive WebP / JPEG variants: {"256w": uri, "512w": uri, ...}
+    generated_character_srcset: Dict[str, str] = Field(default_factory=dict)
+    character_type: str = ""
+    character_description: str = ""
+
+
+# ---------------------------------------------------------------------------
+# Quest-Creator
+# ---------------------------------------------------------------------------
+
+class QuestOption(BaseModel):
+    text: str
+    is_correct: bool
+    feedback: str
+
+
+class QuestScene(BaseModel):
+    scene_number: int = Field(description="Scene number, 1-8")
+    scenario: str = Field(description="1-2 sentences describing the situation with the character BY NAME")
+    question: str = Field(description="Simple question asking what the character should do")
+    option_a: QuestOption = Field(description="The correct, value-aligned choice")
+    option_b: QuestOption = Field(description="The obviously wrong/unkind choice")
+    image_prompt: str = Field(description="Detailed Imagen prompt including the character and scene details")
+
+
+class Quest(BaseModel):
+    quest_title: str
+    lesson: str
+    character_name: str
+    character_description: str
+    scenes: List[QuestScene] = Field(description="Exactly 8 scenes forming one story arc")
+
+
+# ---------------------------------------------------------------------------
+# Illustrator
+# ---------------------------------------------------------------------------
+
+class SceneImage(BaseModel):
+    scene_number: int
+    image_uri: str = ""
+    # Responsive WebP / JPEG variants: {"480w": uri, "960w": uri, ...}
+    srcset: Dict[str, str] = Field(default_factory=dict)
+    prompt_used: str = ""
+    error: Optional[str] = None
+
+
+class IllustrationResult(BaseModel):
+    """Result of the generate_all_scene_illustrations tool"""
+
+    success: bool
+    error: Optional[str] = None
+    character_description: Optional[str] = None
+    scene_images: List[SceneImage] = Field(default_factory=list)
+    total_scenes: int = 0
+
+
+# ---------------------------------------------------------------------------
+# AgentOps evaluations
+# ---------------------------------------------------------------------------
+
+class CreativeIntentEvaluation(BaseModel):
+    creative_intent_score: float = Field(ge=0.0, le=1.0)
+    reasoning: str = ""
+    agent_under_review: str = "visionizer"
+
+    @field_validator("creative_intent_score", mode="before")
+    @classmethod
+    def _clamp(cls, value: Any) -> Any:
+        return _clamp_score(value)
+
+
+class LessonAlignmentEvaluation(BaseModel):
+    lesson_alignment_score: float = Field(ge=0.0, le=1.0)
+    reasoning: str = ""
+    agent_under_review: str = "quest_creator"
+
+    @field_validator("lesson_alignment_score", mode="before")
+    @classmethod
+    def _clamp(cls, value: Any) -> Any:
+        return _clamp_score(value)
+
+
+# ---------------------------------------------------------------------------
+# Parsing
+# ---------------------------------------------------------------------------
+
+def _strip_fences(text: str) -> str:
+    """Drop a ```json fence if a model wrapped its output despite the schema"""
+    text = text.strip()
+    if text.startswith("```"):
+        text = text.split("\n", 1)[1] if "\n" in text else ""
+        if text.rstrip().endswith("```"):
+            text = text.rstrip()[:-3]
+    return text.strip()
+
+
+def parse_model(model: Type[ModelT], payload: Union[str, bytes, dict, Any]) -> ModelT:
+    """
+    Validates an LLM / tool payload into a schema model in a single pass
+
+    Args:
+        model: Target Pydantic model
+        payload: JSON text, a dict, or an ADK tool response ({"result": "<json>"})
+
+    Returns:
+        Validated model instance
+
+    Raises:
+        ValueError: If the payload does not match the schema
+    """
+    try:
+        if isinstance(payload, dict):
+            # ADK wraps non-dict tool return values as {"result": ...}
+            inner = payload.get("result", payload) if len(payload) == 1 else payload
+            if isinstance(inner, (str, bytes)):
+                return model.model_validate_json(inner)
+            return model.model_validate(inner)
+        if isinstance(payload, bytes):
+            payload = payload.decode("utf-8")
+        if isinstance(payload, str):
+            try:
+                return model.model_validate_json(payload)
+            except ValidationError as err:
+                # Only fall back when the JSON itself was malformed (e.g. fenced)
+                if not any(e["type"] == "json_invalid" for e in err.errors()):
+                    raise
+                return model.model_validate_json(_strip_fences(payload))
+        return model.model_validate(payload)
+    except ValidationError as err:
+        raise ValueError(f"{model.__name__} validation failed: {err}") from err
+
+
+def response_schema(model: Type[BaseModel]) -> dict:
+    """JSON schema for a model, in the form accepted by Vertex AI GenerationConfig"""
+    return model.model_json_schema()
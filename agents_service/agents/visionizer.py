@@ -9,7 +9,13 @@ from google.adk.agents import LlmAgent
 import sys
 sys.path.append('..')
 from tools.vision_tool import analyze_drawing, create_character_prompt
-from tools.imagen_tool import generate_character_image
+from tools.imagen_tool import generate_character_asset
+from agents.schemas import VisionizerResult
+from observability.costs import record_model_usage
+from observability.log import get_logger
+from pipeline.quota import QuotaTimeout, acquire_model_quota
+
+logger = get_logger("visionizer")
 
 
 def analyze_and_generate_character(image_uri: str) -> str:
@@ -22,63 +28,61 @@ def analyze_and_generate_character(image_uri: str) -> str:
     Returns:
         JSON string with results
     """
-    import json
-    import traceback
-    
     try:
-        print(f"[Visionizer Tool] Starting analysis for: {image_uri}")
+        logger.info("Starting analysis for: %s", image_uri)
         
         # Step 1: Analyze the drawing
-        print("[Visionizer Tool] Step 1: Analyzing drawing with Gemini Vision...")
         analysis = analyze_drawing(image_uri)
-        print(f"[Visionizer Tool] Analysis complete: {analysis}")
+        logger.debug("Analysis complete", extra={"analysis": analysis})
         
         # Check if age-appropriate
         if not analysis.get("age_appropriate", True):
-            return json.dumps({
-                "success": False,
-                "error": "Drawing contains inappropriate content",
-                "analysis": analysis
-            })
+            return VisionizerResult(
+                success=False,
+                error="Drawing contains inappropriate content",
+                analysis=analysis,
+            ).model_dump_json()
         
         # Step 2: Create character generation prompt
-        print("[Visionizer Tool] Step 2: Creating character prompt...")
         character_prompt = create_character_prompt(analysis)
-        print(f"[Visionizer Tool] Prompt created: {character_prompt[:100]}...")
+        logger.debug("Character prompt created", extra={"character_prompt": character_prompt})
         
         # Step 3: Generate character image
-        print("[Visionizer Tool] Step 3: Generating character with Imagen...")
-        character_image_uri = generate_character_image(character_prompt)
-        print(f"[Visionizer Tool] Character generated: {character_image_uri}")
+        character_asset = generate_character_asset(character_prompt)
+        character_image_uri = character_asset["image_uri"]
+        logger.info("Character generated: %s", character_image_uri)
         
-        result = {
-            "success": True,
-            "original_drawing_uri": image_uri,
-            "analysis": analysis,
-            "character_prompt": character_prompt,
-            "generated_character_uri": character_image_uri,
-            "character_type": analysis.get("character_type"),
-            "character_description": analysis.get("character_description")
-        }
+        result = VisionizerResult(
+            success=True,
+            original_drawing_uri=image_uri,
+            analysis=analysis,
+            character_prompt=character_prompt,
+            generated_character_uri=character_image_uri,
+            generated_character_srcset=character_asset["srcset"],
+            character_type=analysis.get("character_type") or "",
+            character_description=analysis.get("character_description") or "",
+        )
         
-        print(f"[Visionizer Tool] Success! Returning result")
-        return json.dumps(result)
+        return result.model_dump_json()
         
+    except QuotaTimeout:
+        # The endpoint answers 429 + Retry-After instead of blaming the drawing
+        raise
     except Exception as e:
-        error_details = traceback.format_exc()
-        print(f"[Visionizer Tool] ERROR: {str(e)}")
-        print(f"[Visionizer Tool] Traceback: {error_details}")
-        return json.dumps({
-            "success": False,
-            "error": str(e),  # Just the error message, no exception type prefix
-            "traceback": error_details
-        })
+        # Expected failure path (e.g. Imagen safety filter): no traceback needed
+        logger.warning("Visionizer tool failed: %s", e)
+        return VisionizerResult(
+            success=False,
+            error=str(e),  # Just the error message, no exception type prefix
+        ).model_dump_json()
 
 
 # Create the Visionizer agent using ADK LlmAgent
 visionizer_agent = LlmAgent(
     name="visionizer",
     model="gemini-2.0-flash-exp",
+    before_model_callback=acquire_model_quota,
+    after_model_callback=record_model_usage,
     description="Analyzes children's drawings and generates animated characters using Gemini Vision and Imagen",
     instruction="""
     You are the Visionizer agent in the Storytopia pipeline.
@@ -0,0 +1,2 @@
+# Benchmarks
+# Offline performance benchmarks for the agents service
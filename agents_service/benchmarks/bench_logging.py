@@ -0,0 +1,149 @@
+"""
+Logging Benchmark
+Measures the per-request logging overhead on the request path, before and after
+moving from print() to the queue-based structured logger
+
+The "print" scenario replays the baseline's per-quest output: ~40 status lines,
+the full illustration_data dump and a formatted traceback on an expected fallback.
+The "structured" scenario emits the equivalent records through observability.log.
+
+Usage:
+    python -m benchmarks.bench_logging --requests 500 [--output results.json]
+"""
+
+import argparse
+import json
+import logging
+import os
+import sys
+import threading
+import time
+import traceback
+
+from observability import log as obs_log
+
+
+def _illustration_data() -> dict:
+    return {
+        "success": True,
+        "character_description": "A cheerful pink bunny with sparkly star patterns " * 4,
+        "scene_images": [
+            {
+                "scene_number": i,
+                "image_uri": f"https://storage.googleapis.com/storytopia-media-2025/{i:032x}_scene.png",
+                "prompt_used": "A cheerful pink bunny with sparkly star patterns in a sunny park " * 6,
+            }
+            for i in range(1, 9)
+        ],
+    }
+
+
+def _fallback_error() -> Exception:
+    try:
+        raise ValueError("Failed to parse tool result")
+    except ValueError as e:
+        return e
+
+
+def print_request(data: dict, error: Exception) -> None:
+    """Baseline: synchronous print() calls made while serving one quest"""
+    for i in range(1, 9):
+        print(f"[Illustrator Tool] Generating scene {i}/8...")
+        print(f"[Illustrator Tool] ✅ Scene {i} complete: {data['scene_images'][i - 1]['image_uri']}")
+        print(f"[Illustrator Tool] ⏳ Waiting 5 seconds before next image (rate limit management)...")
+        print(f"[API] Tool function call detected: {data['scene_images'][i - 1]}")
+    print(f"[API] Quest response: {json.dumps(data)[:200]}...")
+    print(f"[API] Tool result attributes: {dir(error)}")
+    print(f"[API] Failed to parse tool result: {error}")
+    print(traceback.format_exception(type(error), error, error.__traceback__))
+    print(f"[API] Illustration data: {data}")
+    print(f"[API] Applied 8 images to scenes")
+    print(f"[API] Quest creation complete!")
+
+
+def structured_request(logger: logging.Logger, data: dict, error: Exception) -> None:
+    """Structured: the same events through the queue-based logger"""
+    for i in range(1, 9):
+        logger.debug("Generating scene %d/8", i)
+        logger.info("Scene %d complete: %s", i, data["scene_images"][i - 1]["image_uri"])
+        logger.debug("Waiting %ss before next image (rate limit management)", 5)
+    logger.debug("Quest response", extra={"response": data})
+    logger.warning("Failed to parse tool result: %s", error)
+    logger.debug("Illustration data", extra={"illustration_data": data})
+    logger.info("Applied %d images to scenes", 8)
+    logger.info("Quest creation complete")
+
+
+def _open_sink(kind: str):
+    """
+    Opens the output both scenarios write to
+    "pipe" mimics a container's stdout (a pipe drained by the log collector);
+    "devnull" isolates pure CPU cost
+    """
+    if kind == "devnull":
+        return open(os.devnull, "w")
+
+    read_fd, write_fd = os.pipe()
+
+    def drain():
+        with os.fdopen(read_fd, "rb") as reader:
+            while reader.read(65536):
+                pass
+
+    threading.Thread(target=drain, daemon=True).start()
+    return os.fdopen(write_fd, "w")
+
+
+def run(requests: int, sink: str = "pipe") -> dict:
+    data = _illustration_data()
+    error = _fallback_error()
+
+    sink_file = _open_sink(sink)
+    real_stdout = sys.stdout
+
+    sys.stdout = sink_file
+    try:
+        start = time.perf_counter()
+        for _ in range(requests):
+            print_request(data, error)
+        print_seconds = time.perf_counter() - start
+    finally:
+        sys.stdout = real_stdout
+
+    obs_log.configure_logging(stream=sink_file)
+    logger = obs_log.get_logger("bench")
+    start = time.perf_counter()
+    for _ in range(requests):
+        structured_request(logger, data, error)
+    structured_seconds = time.perf_counter() - start
+    # Drain the queue so the listener's work is not billed to the next run
+    obs_log.shutdown_logging()
+    sink_file.close()
+
+    return {
+        "benchmark": "logging",
+        "requests": requests,
+        "sink": sink,
+        "log_level": logging.getLevelName(logging.getLogger(obs_log.LOGGER_NAME).level),
+        "print_us_per_request": print_seconds / requests * 1e6,
+        "structured_us_per_request": structured_seconds / requests * 1e6,
+        "speedup": print_seconds / structured_seconds if structured_seconds else None,
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Per-request logging overhead: print() vs structured logger")
+    parser.add_argument("--requests", type=int, default=500, help="Simulated requests per scenario")
+    parser.add_argument("--sink", choices=["pipe", "devnull"], default="pipe", help="Where log output goes")
+    parser.add_argument("--output", help="Optional path for the JSON result")
+    args = parser.parse_args()
+
+    result = run(args.requests, args.sink)
+    print(json.dumps(result, indent=2))
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(result, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
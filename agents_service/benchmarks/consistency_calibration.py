@@ -0,0 +1,234 @@
+"""
+Consistency Calibration
+Fits the weights and pass threshold of tools/consistency_tool.py
+
+Builds matched and mismatched (character, scene) pairs from the images in the
+repository: the pencil characters (../pencils) and the sample drawings
+(traffic_generator/images) are pasted onto crops of the illustrated
+backgrounds (../frontend/public, ../Github-Banner.png) at random positions,
+sizes and orientations. A matched scene contains the character itself, a
+mismatched scene a different one on the same kind of background. colors_used
+is derived from the character's dominant named colors, like the Visionizer's.
+
+Reports the score components of both classes, PHASH_CHANCE (median
+best-window pHash similarity of mismatched pairs) and the weights / threshold
+with the best balanced accuracy (ties: fewer false passes). The composites
+paste the character pixel for pixel, which Imagen never does (pose and
+lighting change), so pHash looks far more reliable here than on real scenes;
+its weight is capped (--max-phash-weight).
+
+Usage:
+    python -m benchmarks.consistency_calibration [--pairs 120] [--seed 0] [--max-phash-weight 0.2]
+        [--output results/consistency.json]
+"""
+
+import argparse
+import glob
+import io
+import itertools
+import json
+import os
+import random
+import statistics
+from typing import Dict, List, Tuple
+
+import numpy as np
+from PIL import Image, ImageEnhance
+
+from tools import consistency_tool
+
+SERVICE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+REPO_DIR = os.path.dirname(SERVICE_DIR)
+
+CHARACTER_GLOBS = [
+    os.path.join(REPO_DIR, "pencils", "[0-9]*.png"),
+    os.path.join(SERVICE_DIR, "traffic_generator", "images", "*.png"),
+]
+BACKGROUNDS = [
+    os.path.join(REPO_DIR, "frontend", "public", "storytopia-bg.png"),
+    os.path.join(REPO_DIR, "frontend", "public", "Gemini.png"),
+    os.path.join(REPO_DIR, "Github-Banner.png"),
+]
+SCENE_SIZE = (704, 384)  # Imagen 16:9 scenes at half resolution
+
+
+def _encode(image: Image.Image) -> bytes:
+    buffer = io.BytesIO()
+    image.save(buffer, format="PNG")
+    return buffer.getvalue()
+
+
+def load_characters() -> List[Image.Image]:
+    """RGBA characters; opaque drawings get an alpha mask from their foreground"""
+    characters = []
+    for path in sorted(p for pattern in CHARACTER_GLOBS for p in glob.glob(pattern)):
+        image = Image.open(path).convert("RGBA")
+        if image.getextrema()[3][0] == 255:
+            crop, _ = consistency_tool.foreground(image.convert("RGB"))
+            rgb = np.asarray(crop, dtype=np.float32)
+            border = np.concatenate([rgb[0], rgb[-1], rgb[:, 0], rgb[:, -1]])
+            alpha = np.linalg.norm(rgb - np.median(border, axis=0), axis=-1) > consistency_tool.FOREGROUND_DISTANCE
+            image = crop.convert("RGBA")
+            image.putalpha(Image.fromarray((alpha * 255).astype(np.uint8)))
+        characters.append(image)
+    return characters
+
+
+def character_image(character: Image.Image) -> Image.Image:
+    """The character as the character generator returns it: centered on a plain white square"""
+    side = int(max(character.size) * 1.3)
+    canvas = Image.new("RGB", (side, side), (255, 255, 255))
+    canvas.paste(character, ((side - character.width) // 2, (side - character.height) // 2), character)
+    return canvas
+
+
+def scene_image(character: Image.Image, backgrounds: List[Image.Image], rng: random.Random) -> Image.Image:
+    background = rng.choice(backgrounds)
+    width = rng.randint(SCENE_SIZE[0], background.width)
+    height = round(width * SCENE_SIZE[1] / SCENE_SIZE[0])
+    if height > background.height:
+        height = background.height
+        width = round(height * SCENE_SIZE[0] / SCENE_SIZE[1])
+    x, y = rng.randint(0, background.width - width), rng.randint(0, background.height - height)
+    scene = background.crop((x, y, x + width, y + height)).resize(SCENE_SIZE, Image.BILINEAR)
+
+    scale = rng.uniform(0.3, 0.7) * SCENE_SIZE[1] / character.height
+    sprite = character.resize((max(1, round(character.width * scale)), max(1, round(character.height * scale))))
+    if rng.random() < 0.5:
+        sprite = sprite.transpose(Image.FLIP_LEFT_RIGHT)
+    px = rng.randint(0, max(0, SCENE_SIZE[0] - sprite.width))
+    py = rng.randint(0, max(0, SCENE_SIZE[1] - sprite.height))
+    scene.paste(sprite, (px, py), sprite)
+    return ImageEnhance.Brightness(scene).enhance(rng.uniform(0.85, 1.15))
+
+
+def named_colors(character: Image.Image, count: int = 3) -> List[str]:
+    """Dominant named colors of the character's opaque pixels"""
+    rgba = np.asarray(character.resize((64, 64)), dtype=np.float32).reshape(-1, 4)
+    pixels = rgba[rgba[:, 3] > 128, :3]
+    names = list(consistency_tool.NAMED_COLORS)
+    palette = np.asarray([consistency_tool.NAMED_COLORS[n] for n in names], dtype=np.float32)
+    nearest = np.linalg.norm(pixels[:, None, :] - palette[None, :, :], axis=-1).argmin(axis=1)
+    counts = np.bincount(nearest, minlength=len(names))
+    return [names[i] for i in counts.argsort()[::-1][:count] if counts[i]]
+
+
+def build_pairs(pairs: int, seed: int) -> List[Tuple[bool, Dict[str, float]]]:
+    """(matched, score components) for `pairs` matched and `pairs` mismatched scenes"""
+    rng = random.Random(seed)
+    characters = load_characters()
+    backgrounds = [Image.open(path).convert("RGB") for path in BACKGROUNDS if os.path.exists(path)]
+    results = []
+    for i in range(pairs * 2):
+        matched = i % 2 == 0
+        index = rng.randrange(len(characters))
+        other = index if matched else rng.choice([j for j in range(len(characters)) if j != index])
+        character = characters[index]
+        palette = consistency_tool.extract_palette(named_colors(character))
+        scores = consistency_tool.score_images(
+            _encode(character_image(character)),
+            [_encode(scene_image(characters[other], backgrounds, rng))],
+            palette,
+        )[0]
+        results.append((matched, scores))
+    return results
+
+
+def fit(results: List[Tuple[bool, Dict[str, float]]], max_phash_weight: float = 0.2) -> Dict[str, object]:
+    """Weights (0.1 steps, pHash at most max_phash_weight) and threshold (0.05 steps) with the best balanced accuracy"""
+    matched = [s for m, s in results if m]
+    mismatched = [s for m, s in results if not m]
+    best = None
+    steps = [round(0.1 * i, 1) for i in range(11)]
+    for histogram, palette in itertools.product(steps, steps):
+        phash = round(1.0 - histogram - palette, 1)
+        if phash < 0 or phash > max_phash_weight + 1e-9:
+            continue
+
+        def combined(s):
+            return histogram * s["histogram"] + palette * s["palette"] + phash * s["phash"]
+
+        pos = [combined(s) for s in matched]
+        neg = [combined(s) for s in mismatched]
+        for threshold in [round(0.05 * i, 2) for i in range(1, 20)]:
+            tpr = sum(v >= threshold for v in pos) / len(pos)
+            fpr = sum(v >= threshold for v in neg) / len(neg)
+            key = ((tpr + 1 - fpr) / 2, -fpr)
+            if best is None or key > best[0]:
+                best = (key, {"histogram": histogram, "palette": palette, "phash": phash}, threshold, tpr, fpr)
+    (accuracy, _), weights, threshold, tpr, fpr = best
+    return {
+        "weights": weights,
+        "threshold": threshold,
+        "balanced_accuracy": round(accuracy, 3),
+        "true_pass_rate": round(tpr, 3),
+        "false_pass_rate": round(fpr, 3),
+    }
+
+
+def describe(values: List[float]) -> Dict[str, float]:
+    ordered = sorted(values)
+    return {
+        "p10": round(ordered[len(ordered) // 10], 3),
+        "median": round(statistics.median(ordered), 3),
+        "p90": round(ordered[len(ordered) * 9 // 10], 3),
+    }
+
+
+def run(pairs: int = 120, seed: int = 0, max_phash_weight: float = 0.2) -> dict:
+    # Raw best-window pHash similarity first, to calibrate PHASH_CHANCE
+    configured_chance = consistency_tool.PHASH_CHANCE
+    consistency_tool.PHASH_CHANCE = 0.0
+    try:
+        raw = build_pairs(pairs, seed)
+    finally:
+        consistency_tool.PHASH_CHANCE = configured_chance
+    chance = statistics.median(s["phash"] for m, s in raw if not m)
+
+    consistency_tool.PHASH_CHANCE = chance
+    try:
+        results = build_pairs(pairs, seed)
+    finally:
+        consistency_tool.PHASH_CHANCE = configured_chance
+
+    components = {
+        label: {
+            name: describe([s[name] for m, s in results if m == want])
+            for name in ("histogram", "palette", "phash", "score")
+        }
+        for label, want in (("matched", True), ("mismatched", False))
+    }
+    current = [(m, s["score"] >= consistency_tool.PASS_THRESHOLD) for m, s in results]
+    return {
+        "pairs": pairs,
+        "seed": seed,
+        "phash_chance": round(chance, 3),
+        "components": components,
+        "configured": {
+            "weights": consistency_tool.WEIGHTS,
+            "threshold": consistency_tool.PASS_THRESHOLD,
+            "true_pass_rate": round(sum(p for m, p in current if m) / pairs, 3),
+            "false_pass_rate": round(sum(p for m, p in current if not m) / pairs, 3),
+        },
+        "recommended": fit(results, max_phash_weight),
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Calibrate the illustrator consistency scorer")
+    parser.add_argument("--pairs", type=int, default=120, help="Matched (and mismatched) pairs")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--max-phash-weight", type=float, default=0.2, help="Upper bound for the pHash weight")
+    parser.add_argument("--output", help="Optional path for the JSON result")
+    args = parser.parse_args()
+
+    report = run(args.pairs, args.seed, args.max_phash_weight)
+    print(json.dumps(report, indent=2))
+    if args.output:
+        os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,180 @@
+"""
+End-to-end Benchmarks
+Drives /generate-character, /create-quest and /text-to-speech through the ASGI
+app with every Google Cloud backend replaced by latency-configurable fakes
+
+Each scenario runs `--iterations` requests with `--concurrency` in flight and
+reports client-side latency plus the per-stage durations the service returns
+in its Server-Timing header.
+
+With `--cassette DIR` the backends are served from a recorded cassette (see
+tools/cassette.py) instead of the synthetic fakes; `--latency-scale` then
+scales the recorded latencies.
+
+Usage:
+    python -m benchmarks.e2e [--latency-scale 0.05] [--iterations 10] [--concurrency 2]
+                             [--scenario create_quest] [--cassette cassettes/]
+                             [--output results/e2e.json]
+"""
+
+import argparse
+import asyncio
+import base64
+import re
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+from unittest import mock
+from typing import Awaitable, Callable, Dict, List
+
+import httpx
+
+from benchmarks.fakes import DRAWING_ANALYSIS, FakeLatency, fake_backends, make_png
+from benchmarks.report import build_report, summarize, write_report
+
+_SERVER_TIMING = re.compile(r"([\w.-]+);dur=([\d.]+)")
+
+
+def _drawing_form() -> Dict[str, str]:
+    drawing = base64.b64encode(make_png((800, 600), seed=3)).decode("ascii")
+    return {"drawing_data": f"data:image/png;base64,{drawing}", "user_id": "bench"}
+
+
+def _quest_body(storage=None) -> dict:
+    # A stored character image so the consistency scorer runs as in production
+    # (in cassette mode the download falls back to a recorded one)
+    character_uri = "https://storage.googleapis.com/storytopia-media-2025/bench_character.png"
+    if storage is not None:
+        storage.objects[character_uri] = make_png((1024, 1024), seed=1)
+    return {
+        "character_description": DRAWING_ANALYSIS["character_description"],
+        "character_name": "Mila",
+        "lesson": "Sharing my toys",
+        "character_image_uri": character_uri,
+        "colors_used": DRAWING_ANALYSIS["colors_used"],
+    }
+
+
+SCENARIOS: Dict[str, Callable[[httpx.AsyncClient, dict], Awaitable[httpx.Response]]] = {
+    "generate_character": lambda client, ctx: client.post("/generate-character", data=ctx["drawing_form"]),
+    "generate_character_multipart": lambda client, ctx: client.post(
+        "/generate-character",
+        data={"user_id": "bench"},
+        files={"drawing": ("drawing.png", ctx["drawing_png"], "image/png")},
+    ),
+    "create_quest": lambda client, ctx: client.post("/create-quest", json=ctx["quest_body"]),
+    "text_to_speech": lambda client, ctx: client.post(
+        "/text-to-speech",
+        json={"text": "Mila the Star Bunny is playing with her sparkly blue ball in the park.", "voice_name": "Kore"},
+    ),
+}
+
+
+async def _run_scenario(client: httpx.AsyncClient, name: str, ctx: dict, iterations: int, concurrency: int) -> dict:
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies: List[float] = []
+    stages: Dict[str, List[float]] = defaultdict(list)
+    statuses: Dict[int, int] = defaultdict(int)
+
+    async def one():
+        async with semaphore:
+            start = time.perf_counter()
+            response = await SCENARIOS[name](client, ctx)
+            latencies.append(time.perf_counter() - start)
+            statuses[response.status_code] += 1
+            for stage, dur in _SERVER_TIMING.findall(response.headers.get("server-timing", "")):
+                stages[stage].append(float(dur) / 1000)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(one() for _ in range(iterations)))
+    wall = time.perf_counter() - start
+
+    return {
+        **summarize(latencies),
+        "throughput_rps": iterations / wall if wall else None,
+        "status_codes": dict(statuses),
+        "server_timing": {stage: summarize(values) for stage, values in sorted(stages.items())},
+    }
+
+
+@contextmanager
+def cassette_backends(directory: str, latency_scale: float):
+    """
+    Serves every backend from a recorded cassette, with scaled latencies
+
+    The benchmark's payloads differ from the recorded ones, so unmatched calls
+    fall back to the recordings of that call in order.
+    """
+    import tools.cassette as cassette_module
+
+    replay = cassette_module.Cassette("replay", directory, latency_scale=latency_scale)
+    with mock.patch.object(cassette_module, "cassette", replay):
+        yield {}
+
+
+async def run_async(
+    latency_scale: float,
+    iterations: int,
+    concurrency: int,
+    scenarios: List[str],
+    cassette: str = None,
+) -> dict:
+    import main
+
+    latency = FakeLatency().scaled(latency_scale)
+    backends = cassette_backends(cassette, latency_scale) if cassette else fake_backends(latency)
+    with backends as fakes:
+        ctx = {
+            "drawing_form": _drawing_form(),
+            "drawing_png": make_png((800, 600), seed=3),
+            "quest_body": _quest_body(fakes.get("storage")),
+        }
+        transport = httpx.ASGITransport(app=main.app)
+        async with main.app.router.lifespan_context(main.app):
+            async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=None) as client:
+                results = {}
+                for name in scenarios:
+                    results[name] = await _run_scenario(client, name, ctx, iterations, concurrency)
+
+    config = {
+        "iterations": iterations,
+        "concurrency": concurrency,
+        "scenarios": scenarios,
+        "latency_scale": latency_scale,
+        "latency": None if cassette else latency.to_dict(),
+        "cassette": cassette,
+    }
+    return build_report("e2e", config, results)
+
+
+def run(
+    latency_scale: float = 0.05,
+    iterations: int = 10,
+    concurrency: int = 2,
+    scenarios: List[str] = None,
+    cassette: str = None,
+) -> dict:
+    return asyncio.run(run_async(
+        latency_scale, iterations, concurrency, scenarios or list(SCENARIOS), cassette
+    ))
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="End-to-end pipeline benchmarks against in-process fakes")
+    parser.add_argument("--latency-scale", type=float, default=0.05,
+                        help="Multiplier for the default fake latencies (1.0 = production-like)")
+    parser.add_argument("--iterations", type=int, default=10, help="Requests per scenario")
+    parser.add_argument("--concurrency", type=int, default=2, help="Requests in flight per scenario")
+    parser.add_argument("--scenario", action="append", choices=list(SCENARIOS),
+                        help="Scenario to run (repeatable; default all)")
+    parser.add_argument("--cassette", help="Replay backends from this cassette directory instead of fakes")
+    parser.add_argument("--output", help="Optional path for the JSON result")
+    args = parser.parse_args()
+    write_report(
+        run(args.latency_scale, args.iterations, args.concurrency, args.scenario, args.cassette),
+        args.output,
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,300 @@
+"""
+Benchmark Fakes
+In-process stand-ins for Vertex AI, Imagen, Cloud TTS, GCS and the ADK Runner
+
+The fakes replace only the outermost client objects, so the service code under
+test (retry loops, stage timers, uploads, schema validation, consistency
+scoring) runs unchanged. Every fake sleeps for a configurable latency.
+
+Usage:
+    with fake_backends(FakeLatency().scaled(0.05)):
+        ...drive main.app...
+"""
+
+import asyncio
+import io
+import json
+import os
+import re
+import time
+from contextlib import ExitStack, contextmanager
+from dataclasses import asdict, dataclass, fields
+from typing import Any, Dict, Iterator
+from unittest import mock
+
+from google.genai import types
+from PIL import Image
+
+EXAMPLES_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "examples")
+
+
+@dataclass
+class FakeLatency:
+    """Per-call latencies in seconds (defaults approximate production p50s)"""
+
+    gcs_upload: float = 0.15
+    gcs_download: float = 0.08
+    vision: float = 2.5
+    imagen: float = 6.0
+    tts: float = 1.5
+    llm_chunk: float = 0.05   # delay between streamed Quest-Creator chunks
+    llm_judge: float = 1.5    # AgentOps evaluation turn
+    llm_tool_turn: float = 0.8  # Visionizer turn before / after its tool call
+
+    def scaled(self, factor: float) -> "FakeLatency":
+        """Copy with every latency multiplied by `factor`"""
+        return FakeLatency(**{f.name: getattr(self, f.name) * factor for f in fields(self)})
+
+    def to_dict(self) -> Dict[str, float]:
+        return asdict(self)
+
+
+# ---------------------------------------------------------------------------
+# Payloads
+# ---------------------------------------------------------------------------
+
+def load_example_quest() -> dict:
+    with open(os.path.join(EXAMPLES_DIR, "quest_example.json")) as f:
+        return json.load(f)
+
+
+def make_png(size=(1024, 1024), seed: int = 0) -> bytes:
+    """Deterministic pink/gold test image with enough structure for pHash"""
+    width, height = size
+    image = Image.new("RGB", size, (250, 220, 230))
+    pixels = image.load()
+    for y in range(0, height, 8):
+        for x in range(0, width, 8):
+            if (x // 64 + y // 64 + seed) % 3 == 0:
+                color = (240, 128, 170)
+            elif (x * y + seed) % 7 == 0:
+                color = (250, 200, 60)
+            else:
+                continue
+            for dy in range(8):
+                for dx in range(8):
+                    pixels[x + dx, y + dy] = color
+    buffer = io.BytesIO()
+    image.save(buffer, format="PNG")
+    return buffer.getvalue()
+
+
+DRAWING_ANALYSIS = {
+    "character_type": "bunny",
+    "character_description": "A cheerful pink bunny with sparkly star patterns, big curious eyes, and a friendly smile",
+    "colors_used": ["pink", "yellow", "white"],
+    "artistic_style": "crayon",
+    "mood": "happy",
+    "age_appropriate": True,
+    "details": "Holding a blue ball",
+}
+
+
+# ---------------------------------------------------------------------------
+# Google Cloud clients
+# ---------------------------------------------------------------------------
+
+class FakeStorage:
+    """GCS client, bucket and blob in one; uploaded objects are kept in memory"""
+
+    def __init__(self, latency: FakeLatency):
+        self.latency = latency
+        self.objects: Dict[str, bytes] = {}
+        self.default_object = make_png((256, 256))
+
+    def bucket(self, name: str) -> "_FakeBucket":
+        return _FakeBucket(self, name)
+
+
+class _FakeBucket:
+    def __init__(self, storage: FakeStorage, name: str):
+        self.storage = storage
+        self.name = name
+
+    def blob(self, blob_name: str) -> "_FakeBlob":
+        return _FakeBlob(self, blob_name)
+
+
+class _FakeBlob:
+    def __init__(self, bucket: _FakeBucket, name: str):
+        self.bucket = bucket
+        self.name = name
+
+    @property
+    def public_url(self) -> str:
+        return f"https://storage.googleapis.com/{self.bucket.name}/{self.name}"
+
+    def exists(self) -> bool:
+        time.sleep(self.bucket.storage.latency.gcs_download)
+        return self.public_url in self.bucket.storage.objects
+
+    def upload_from_string(self, data: bytes, content_type: str = None, **kwargs) -> None:
+        time.sleep(self.bucket.storage.latency.gcs_upload)
+        self.bucket.storage.objects[self.public_url] = bytes(data)
+
+    def upload_from_file(self, file_obj, content_type: str = None, rewind: bool = False, **kwargs) -> None:
+        if rewind:
+            file_obj.seek(0)
+        self.upload_from_string(file_obj.read(), content_type=content_type)
+
+    def download_as_bytes(self) -> bytes:
+        time.sleep(self.bucket.storage.latency.gcs_download)
+        return self.bucket.storage.objects.get(self.public_url, self.bucket.storage.default_object)
+
+
+class FakeGeminiVision:
+    """vertexai GenerativeModel returning a schema-valid DrawingAnalysis"""
+
+    def __init__(self, latency: FakeLatency):
+        self.latency = latency
+
+    def generate_content(self, contents, generation_config=None):
+        time.sleep(self.latency.vision)
+        usage = types.GenerateContentResponseUsageMetadata(prompt_token_count=1350, candidates_token_count=160)
+        return mock.Mock(text=json.dumps(DRAWING_ANALYSIS), usage_metadata=usage)
+
+
+class FakeImagen:
+    """ImageGenerationModel returning pre-encoded PNGs"""
+
+    def __init__(self, latency: FakeLatency):
+        self.latency = latency
+        self.character = make_png((1024, 1024), seed=1)
+        self.scene = make_png((1408, 768), seed=2)
+
+    def generate_images(self, prompt: str, aspect_ratio: str = "1:1", **kwargs):
+        time.sleep(self.latency.imagen)
+        image_bytes = self.character if aspect_ratio == "1:1" else self.scene
+        return mock.Mock(images=[mock.Mock(_image_bytes=image_bytes)])
+
+
+class FakeTTSClient:
+    """TextToSpeechClient returning a fixed-size MP3 payload"""
+
+    def __init__(self, latency: FakeLatency):
+        self.latency = latency
+        self.audio = b"\xff\xfb\x90\x00" * 4096
+
+    def synthesize_speech(self, input=None, voice=None, audio_config=None):
+        time.sleep(self.latency.tts)
+        return mock.Mock(audio_content=self.audio)
+
+
+# ---------------------------------------------------------------------------
+# ADK Runner
+# ---------------------------------------------------------------------------
+
+class _Event:
+    def __init__(self, part: types.Part, partial: bool = False):
+        self.content = types.Content(role="model", parts=[part])
+        self.partial = partial
+
+
+class FakeRunner:
+    """
+    ADK Runner replacement dispatching on the agent name
+
+    - visionizer: calls the real tool function (which hits the fake clients)
+    - quest_creator / quest_specializer: stream the example quest in ~200 character chunks
+    - agent_ops / agent_ops_quest: return a schema-valid evaluation
+    """
+
+    latency = FakeLatency()
+    quest = None
+
+    def __init__(self, agent, app_name=None, session_service=None, **kwargs):
+        self.agent = agent
+
+    async def _model_response(self, prompt: str, output: str) -> None:
+        """Runs the agent's after_model_callback like ADK would, with ~4 characters per token"""
+        from google.adk.models.llm_response import LlmResponse
+
+        callback = getattr(self.agent, "after_model_callback", None)
+        if callback is not None:
+            usage = types.GenerateContentResponseUsageMetadata(
+                prompt_token_count=len(prompt) // 4, candidates_token_count=len(output) // 4,
+            )
+            await callback(mock.Mock(agent_name=self.agent.name), LlmResponse(model_version=self.agent.model, usage_metadata=usage))
+
+    async def run_async(self, user_id=None, session_id=None, new_message=None, run_config=None):
+        text = "".join(part.text or "" for part in new_message.parts)
+
+        if self.agent.name == "visionizer":
+            await asyncio.sleep(self.latency.llm_tool_turn)
+            uri = re.search(r"https://\S+", text).group(0)
+            tool = self.agent.tools[0]
+            await self._model_response(text, f"{tool.__name__}({uri})")
+            result = await asyncio.to_thread(tool, uri)
+            yield _Event(types.Part(function_response=types.FunctionResponse(
+                name=tool.__name__, response={"result": result},
+            )))
+            await asyncio.sleep(self.latency.llm_tool_turn)
+            await self._model_response(text + result, result)
+            yield _Event(types.Part(text=result))
+
+        elif self.agent.name in ("quest_creator", "quest_specializer"):
+            quest_text = json.dumps(self.quest or load_example_quest())
+            for i in range(0, len(quest_text), 200):
+                await asyncio.sleep(self.latency.llm_chunk)
+                yield _Event(types.Part(text=quest_text[i:i + 200]), partial=True)
+            await self._model_response(text, quest_text)
+            yield _Event(types.Part(text=quest_text))
+
+        elif self.agent.name == "agent_ops":
+            await asyncio.sleep(self.latency.llm_judge)
+            verdict = json.dumps({
+                "creative_intent_score": 0.8, "reasoning": "benchmark", "agent_under_review": "visionizer",
+            })
+            await self._model_response(text, verdict)
+            yield _Event(types.Part(text=verdict))
+
+        elif self.agent.name == "agent_ops_quest":
+            await asyncio.sleep(self.latency.llm_judge)
+            verdict = json.dumps({
+                "lesson_alignment_score": 0.9, "reasoning": "benchmark", "agent_under_review": "quest_creator",
+            })
+            await self._model_response(text, verdict)
+            yield _Event(types.Part(text=verdict))
+
+        else:
+            raise ValueError(f"FakeRunner has no script for agent {self.agent.name!r}")
+
+
+# ---------------------------------------------------------------------------
+# Installation
+# ---------------------------------------------------------------------------
+
+@contextmanager
+def fake_backends(latency: FakeLatency) -> Iterator[Dict[str, Any]]:
+    """
+    Patches every external client used by main.app for the duration of the block
+
+    Yields:
+        The fake instances, keyed by backend name
+    """
+    import main
+    from pipeline.quota import quota
+    import tools.imagen_tool as imagen_tool
+    import tools.storage_tool as storage_tool
+    import tools.tts_tool as tts_tool
+    import tools.vision_tool as vision_tool
+
+    storage = FakeStorage(latency)
+    vision = FakeGeminiVision(latency)
+    imagen = FakeImagen(latency)
+    tts = FakeTTSClient(latency)
+    runner = type("ScriptedRunner", (FakeRunner,), {"latency": latency})
+
+    with ExitStack() as stack:
+        patch = lambda target, name, value: stack.enter_context(mock.patch.object(target, name, value))
+        patch(main, "Runner", runner)
+        patch(storage_tool, "get_storage_client", lambda: storage)
+        patch(vision_tool, "_vertex_initialized", True)
+        patch(vision_tool, "GenerativeModel", lambda *args, **kwargs: vision)
+        patch(imagen_tool, "_initialized", True)
+        patch(imagen_tool.ImageGenerationModel, "from_pretrained", lambda *args, **kwargs: imagen)
+        patch(tts_tool, "_tts_client", tts)
+        # Fake backends have no quota; the shared buckets would only add real waits
+        patch(quota, "_backend_factory", None)
+        patch(quota, "_backend", None)
+        yield {"storage": storage, "vision": vision, "imagen": imagen, "tts": tts, "runner": runner}
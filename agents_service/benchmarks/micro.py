@@ -0,0 +1,187 @@
+"""
+Micro-benchmarks
+Per-call cost of the CPU-bound helpers on the request path
+
+- parse_model: validating the Quest-Creator / AgentOps output (raw JSON,
+  ```json-fenced text and ADK {"result": ...} tool payloads)
+- SceneStreamParser: incremental parsing of the streamed quest
+- apply_scene_images: merging illustration results into the quest scenes
+- upload_base64_to_gcs / upload_stream_to_gcs: base64 form vs. chunked
+  multipart upload of a canvas drawing, time and tracemalloc peak memory
+  (GCS itself is faked with zero latency)
+- response: /create-quest response serialization (stdlib json vs orjson),
+  gzip / brotli compression and the fields=-scenes.image_prompt projection;
+  payload sizes are reported in the config
+
+Usage:
+    python -m benchmarks.micro [--repeat 7] [--output results/micro.json]
+"""
+
+import argparse
+import base64
+import copy
+import io
+import json
+import time
+import tracemalloc
+from typing import Callable, Dict
+
+from agents.illustrator import apply_scene_images
+from agents.scene_stream import SceneStreamParser
+from agents.schemas import LessonAlignmentEvaluation, Quest, parse_model
+from benchmarks.fakes import FakeLatency, fake_backends, load_example_quest, make_png
+from benchmarks.report import build_report, summarize, write_report
+from pipeline import responses
+from pipeline.responses import FastJSONResponse, compress, project
+
+
+def measure(fn: Callable[[], object], repeat: int = 7, min_time: float = 0.05) -> Dict[str, float]:
+    """
+    Times `fn` in batches sized to run for at least `min_time` seconds
+
+    Returns:
+        summarize() of the per-call time of each batch, plus the batch size
+    """
+    number = 1
+    while True:
+        start = time.perf_counter()
+        for _ in range(number):
+            fn()
+        elapsed = time.perf_counter() - start
+        if elapsed >= min_time or number >= 1 << 20:
+            break
+        number *= 2
+
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for _ in range(number):
+            fn()
+        samples.append((time.perf_counter() - start) / number)
+    return {**summarize(samples), "calls_per_sample": number}
+
+
+def peak_memory(fn: Callable[[], object]) -> int:
+    """Peak bytes allocated by Python while running fn once (tracemalloc)"""
+    tracemalloc.start()
+    try:
+        fn()
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def run(repeat: int = 7) -> dict:
+    quest = load_example_quest()
+    quest_text = json.dumps(quest)
+    fenced_text = f"```json\n{json.dumps(quest, indent=2)}\n```"
+    tool_payload = {"result": quest_text}
+    judge_text = json.dumps({"lesson_alignment_score": 0.9, "reasoning": "Scenes match the lesson."})
+
+    chunks = [quest_text[i:i + 200] for i in range(0, len(quest_text), 200)]
+
+    def stream_scenes():
+        parser = SceneStreamParser()
+        for chunk in chunks:
+            parser.feed(chunk)
+
+    scene_images = [
+        {"scene_number": s["scene_number"], "image_uri": f"https://storage.googleapis.com/b/scene{s['scene_number']}.png"}
+        for s in quest["scenes"]
+    ]
+
+    def merge_scenes():
+        apply_scene_images(copy.deepcopy(quest["scenes"]), scene_images)
+
+    results = {
+        "parse_model.quest_json": measure(lambda: parse_model(Quest, quest_text), repeat),
+        "parse_model.quest_fenced": measure(lambda: parse_model(Quest, fenced_text), repeat),
+        "parse_model.quest_tool_payload": measure(lambda: parse_model(Quest, tool_payload), repeat),
+        "parse_model.lesson_alignment": measure(lambda: parse_model(LessonAlignmentEvaluation, judge_text), repeat),
+        "scene_stream.feed_quest": measure(stream_scenes, repeat),
+        "scene_merge.deepcopy_baseline": measure(lambda: copy.deepcopy(quest["scenes"]), repeat),
+        "scene_merge.apply_scene_images": measure(merge_scenes, repeat),
+    }
+
+    png = make_png((800, 600), seed=3)
+    drawing = "data:image/png;base64," + base64.b64encode(png).decode("ascii")
+    with fake_backends(FakeLatency().scaled(0.0)) as fakes:
+        import tools.storage_tool as storage_tool
+        from tools.storage_tool import upload_base64_to_gcs, upload_stream_to_gcs
+
+        def fresh_upload(fn: Callable[[], object]) -> Callable[[], object]:
+            # Content-addressed uploads of the same bytes are deduplicated; forget them first
+            def call():
+                storage_tool._known_objects.clear()
+                fakes["storage"].objects.clear()
+                return fn()
+            return call
+
+        results["upload_base64_to_gcs.canvas_800x600"] = measure(
+            fresh_upload(lambda: upload_base64_to_gcs(drawing, "drawing_bench.png")), repeat
+        )
+        results["upload_stream_to_gcs.canvas_800x600"] = measure(
+            fresh_upload(lambda: upload_stream_to_gcs(io.BytesIO(png), "drawing_bench.png")), repeat
+        )
+        # The fake blob buffers the stream it uploads; the real client sends it in chunks
+        memory = {
+            "upload_base64_to_gcs": peak_memory(fresh_upload(lambda: upload_base64_to_gcs(drawing, "drawing_bench.png"))),
+            "upload_stream_to_gcs": peak_memory(fresh_upload(lambda: upload_stream_to_gcs(io.BytesIO(png), "drawing_bench.png"))),
+        }
+
+    # /create-quest response as the API returns it (after illustration)
+    response = {
+        "status": "success",
+        "quest_title": quest["quest_title"],
+        "lesson": quest.get("lesson", "sharing"),
+        "character_name": quest["character_name"],
+        "scenes": [
+            {
+                **scene,
+                "image_uri": f"https://storage.googleapis.com/b/assets/{scene['scene_number']:064d}.png",
+                "image_srcset": {
+                    f"{w}w": f"https://storage.googleapis.com/b/assets/{scene['scene_number']:063d}{i}.webp"
+                    for i, w in enumerate((480, 960, 1408))
+                },
+            }
+            for scene in quest["scenes"]
+        ],
+        "total_scenes": len(quest["scenes"]),
+    }
+    projection = "-scenes.image_prompt"
+    render = FastJSONResponse(None).render
+    body = render(response)
+    projected_body = render(project(response, projection))
+    encodings = ["gzip"] + (["br"] if responses.brotli is not None else [])
+
+    results["response.json_dumps"] = measure(lambda: json.dumps(response).encode(), repeat)
+    results["response.orjson"] = measure(lambda: render(response), repeat)
+    results["response.project_orjson"] = measure(lambda: render(project(response, projection)), repeat)
+    for encoding in encodings:
+        results[f"response.{encoding}"] = measure(lambda: compress(body, encoding), repeat)
+    response_bytes = {"identity": len(body), "projected": len(projected_body)}
+    for encoding in encodings:
+        response_bytes[encoding] = len(compress(body, encoding))
+        response_bytes[f"projected_{encoding}"] = len(compress(projected_body, encoding))
+
+    config = {
+        "repeat": repeat,
+        "response_bytes": response_bytes,
+        "quest_bytes": len(quest_text),
+        "drawing_bytes": len(png),
+        "drawing_base64_bytes": len(drawing),
+        "upload_peak_memory_bytes": memory,
+    }
+    return build_report("micro", config, results)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Micro-benchmarks for request-path helpers")
+    parser.add_argument("--repeat", type=int, default=7, help="Samples per benchmark")
+    parser.add_argument("--output", help="Optional path for the JSON result")
+    args = parser.parse_args()
+    write_report(run(args.repeat), args.output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,119 @@
+"""
+Benchmark Reports
+Timing statistics, JSON result files and regression comparison
+
+Usage:
+    python -m benchmarks.report baseline.json candidate.json [--threshold 0.10]
+"""
+
+import argparse
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import time
+from typing import Dict, List, Optional
+
+
+def summarize(samples: List[float]) -> Dict[str, float]:
+    """Latency summary in milliseconds for a list of durations in seconds"""
+    ordered = sorted(samples)
+    if not ordered:
+        return {"count": 0}
+
+    def pct(p: float) -> float:
+        index = min(len(ordered) - 1, max(0, round(p / 100 * len(ordered)) - 1))
+        return ordered[index] * 1000
+
+    return {
+        "count": len(ordered),
+        "min_ms": ordered[0] * 1000,
+        "mean_ms": statistics.fmean(ordered) * 1000,
+        "p50_ms": pct(50),
+        "p90_ms": pct(90),
+        "p99_ms": pct(99),
+        "max_ms": ordered[-1] * 1000,
+    }
+
+
+def _git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            capture_output=True, text=True, check=True,
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+        ).stdout.strip()
+    except Exception:
+        return None
+
+
+def build_report(suite: str, config: dict, results: Dict[str, dict]) -> dict:
+    """Wraps benchmark results with the metadata needed to compare runs"""
+    return {
+        "suite": suite,
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "git_commit": _git_commit(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "config": config,
+        "results": results,
+    }
+
+
+def write_report(report: dict, output: Optional[str]) -> None:
+    print(json.dumps(report, indent=2))
+    if output:
+        os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+        with open(output, "w") as f:
+            json.dump(report, f, indent=2)
+
+
+def compare(baseline: dict, candidate: dict, threshold: float = 0.10, metric: str = "p50_ms") -> List[dict]:
+    """
+    Compares two reports benchmark by benchmark
+
+    Returns:
+        One row per benchmark present in both reports; `regression` is True
+        when the candidate is slower than the baseline by more than `threshold`
+    """
+    rows = []
+    for name, base in baseline.get("results", {}).items():
+        new = candidate.get("results", {}).get(name)
+        if not new or metric not in base or metric not in new or not base[metric]:
+            continue
+        change = (new[metric] - base[metric]) / base[metric]
+        rows.append({
+            "benchmark": name,
+            "baseline": base[metric],
+            "candidate": new[metric],
+            "change": change,
+            "regression": change > threshold,
+        })
+    return rows
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Compare two benchmark result files")
+    parser.add_argument("baseline")
+    parser.add_argument("candidate")
+    parser.add_argument("--threshold", type=float, default=0.10, help="Allowed slowdown (0.10 = 10%%)")
+    parser.add_argument("--metric", default="p50_ms")
+    args = parser.parse_args()
+
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    with open(args.candidate) as f:
+        candidate = json.load(f)
+
+    rows = compare(baseline, candidate, args.threshold, args.metric)
+    for row in rows:
+        flag = "REGRESSION" if row["regression"] else "ok"
+        print(f"{row['benchmark']:<40} {row['baseline']:>12.3f} -> {row['candidate']:>12.3f} "
+              f"{row['change']:>+8.1%}  {flag}")
+    sys.exit(1 if any(row["regression"] for row in rows) else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -4,37 +4,143 @@ Main entry point for the ADK agents service
 """
 
 import os
-import json
 import re
-from fastapi import FastAPI, UploadFile, File, Form, HTTPException, Body
+import time
+import uuid
+import random
+import asyncio
+from contextlib import asynccontextmanager
+from typing import Dict, Optional
+from fastapi import FastAPI, UploadFile, File, Form, HTTPException, Body, Request
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse, PlainTextResponse
 from pydantic import BaseModel
 from dotenv import load_dotenv
+from google.adk.agents.run_config import RunConfig, StreamingMode
 from google.adk.runners import Runner
 from google.adk.sessions import InMemorySessionService
 from google.genai import types
-from ddtrace.llmobs import LLMObs
 from ddtrace.llmobs.decorators import llm
 
+from observability import costs, metrics
+from observability.evaluations import emit_evaluation, evaluation_emitter
+from observability.log import get_logger, new_request_id, request_id_var, set_stage
+from pipeline.admission import AdmissionRejected, admission, admitted
+from pipeline.idempotency import IdempotencyMiddleware
+from pipeline.prompts import PromptBuilder, compact_json, judge_analysis, judge_quest
+from pipeline.quota import QuotaTimeout, quota
+from pipeline.responses import CompressionMiddleware, FastJSONResponse, typed_response
+from pipeline.run_store import run_store
+from pipeline.scheduler import image_scheduler
+from agents.schemas import DrawingAnalysis, QuestScene
+from tools.cassette import run_agent
+
 # Load environment variables
 load_dotenv()
 
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Starts background observability tasks and drains them on shutdown"""
+    evaluation_emitter.start()
+    yield
+    await evaluation_emitter.stop()
+
+
 # Initialize FastAPI app
 app = FastAPI(
     title="Storytopia ADK Agents Service",
     description="Multi-agent system for converting children's drawings to animated stories",
-    version="1.0.0"
+    version="1.0.0",
+    lifespan=lifespan,
+    default_response_class=FastJSONResponse,
 )
 
-# CORS middleware for frontend communication
+# Structured, queue-based logging (see observability/log.py)
+logger = get_logger("api")
+
+
+@app.middleware("http")
+async def admission_control(request: Request, call_next):
+    """Sheds excess load with 429/503 + Retry-After per endpoint pool (see pipeline/admission.py)"""
+    try:
+        async with admitted(request.url.path):
+            return await call_next(request)
+    except AdmissionRejected as e:
+        logger.warning("Shed %s (%s, retry after %ss)", request.url.path, e.reason, e.retry_after)
+        return JSONResponse(
+            status_code=e.status_code,
+            content={"detail": "Storytopia is busy right now, please try again in a moment!"},
+            headers={"Retry-After": str(e.retry_after)},
+        )
+
+
+def quota_busy(e: QuotaTimeout, headers: Optional[Dict[str, str]] = None) -> HTTPException:
+    """429 + Retry-After for a model call whose quota slot was too far away (see pipeline/quota.py)"""
+    logger.warning("Quota exhausted for %s (retry after %ss)", e.model, e.retry_after)
+    return HTTPException(
+        status_code=429,
+        detail="Storytopia is busy right now, please try again in a moment!",
+        headers={"Retry-After": str(e.retry_after), **(headers or {})},
+    )
+
+
+# Idempotency-Key handling for the expensive POSTs; added between the two http
+# middlewares so repeats bypass admission but still get a request ID (see pipeline/idempotency.py)
+app.add_middleware(IdempotencyMiddleware)
+
+
+@app.middleware("http")
+async def request_context(request: Request, call_next):
+    """
+    Binds a request_id to every log record emitted while handling the request
+    and reports the request's stage durations in a Server-Timing header;
+    the model spend of the request (observability/costs.py) is logged and
+    observed per endpoint
+    """
+    request_id = request.headers.get("x-request-id") or new_request_id()
+    token = request_id_var.set(request_id)
+    timings_token = metrics.start_request_timings()
+    timings = metrics.request_timings_var.get()
+    ledger_token = costs.start_request_ledger()
+    ledger = costs.ledger_var.get()
+    metrics.REQUESTS_IN_FLIGHT.inc()
+    start = time.perf_counter()
+    try:
+        response = await call_next(request)
+    finally:
+        metrics.REQUESTS_IN_FLIGHT.dec()
+        if ledger.entries:
+            metrics.REQUEST_COST.observe(ledger.total(), path=request.url.path)
+            logger.info(
+                "Request cost $%.4f",
+                ledger.total(),
+                extra={"path": request.url.path, "cost_by_stage": ledger.by_stage()},
+            )
+        costs.ledger_var.reset(ledger_token)
+        metrics.request_timings_var.reset(timings_token)
+        request_id_var.reset(token)
+    response.headers["X-Request-ID"] = request_id
+    response.headers["Server-Timing"] = metrics.server_timing_header(timings, time.perf_counter() - start)
+    return response
+
+
+# gzip / brotli for JSON responses, negotiated from Accept-Encoding (see pipeline/responses.py)
+app.add_middleware(CompressionMiddleware, minimum_size=1024)
+
+# CORS middleware for frontend communication (added last so it is outermost and
+# also decorates shed responses)
 app.add_middleware(
     CORSMiddleware,
     allow_origins=["*"],  # Update with specific frontend URL in production
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    # Run ID of a failed /create-quest (to resume it) and Idempotency-Key replays
+    expose_headers=["X-Run-Id", "Idempotent-Replayed"],
 )
 
+
 # Initialize ADK Session Service
 session_service = InMemorySessionService()
 APP_NAME = "storytopia"
@@ -46,67 +152,71 @@ class CreateQuestRequest(BaseModel):
     character_name: str
     lesson: str
     character_image_uri: str | None = None
+    colors_used: list[str] | None = None
+    # Retrying with the run_id of a failed attempt resumes from its checkpoints
+    run_id: str | None = None
+
+
+class RegenerateScenesRequest(BaseModel):
+    quest_id: str
+    scene_numbers: list[int]
+
+# Multipart drawing uploads larger than this are rejected with 413
+MAX_DRAWING_BYTES = int(os.getenv("MAX_DRAWING_BYTES", 10 * 1024 * 1024))
+
+RUN_ID_PATTERN = re.compile(r"[A-Za-z0-9_-]{1,64}")
+
 
 class TextToSpeechRequest(BaseModel):
     text: str
     voice_name: str = "Kore"
 
 
-def extract_json_block(text: str) -> dict:
-    """
-    Extract the first JSON object from an LLM-ish string.
-    Handles prose + ```json fences.
-    """
-    # If it's in a ```json ... ``` block, grab inside
-    fence_match = re.search(r"```json(.*?)```", text, re.DOTALL)
-    if fence_match:
-        candidate = fence_match.group(1).strip()
-    else:
-        # Otherwise, grab from first { to last }
-        start = text.find("{")
-        end = text.rfind("}")
-        if start == -1 or end == -1:
-            raise ValueError("No JSON object found in agent response")
-        candidate = text[start:end+1]
-    
-    # Fix common escape issues: \' is not valid in JSON, should be just '
-    # JSON only allows: \" \\ \/ \b \f \n \r \t \uXXXX
-    candidate = candidate.replace("\\'", "'")
-    
-    return json.loads(candidate)
+# Response models (the `fields=` projection is applied to the validated payload)
+class CreativeIntentMetrics(BaseModel):
+    creative_intent_score: float
+    agent_ops_reasoning: str | None = None
+    creative_intent_scorer: str
 
 
-def normalize_agent_response(raw_text: str) -> dict:
-    """
-    Turns the messy agent output into a clean, final JSON dict.
-    Expected structure:
-    {
-      "analyze_and_generate_character_response": {
-        "result": "{\"success\": true, ... }"
-      }
-    }
-    """
-    outer = extract_json_block(raw_text)
+class GenerateCharacterResponse(BaseModel):
+    status: str
+    drawing_uri: str | None = None
+    analysis: DrawingAnalysis | None = None
+    generated_character_uri: str = ""
+    # Responsive WebP / JPEG variants: {"256w": uri, "512w": uri, ...}
+    generated_character_srcset: dict[str, str] = {}
+    character_type: str = ""
+    character_description: str = ""
+    # {"visionizer": ...} when a creative_intent_score was computed
+    agent_metrics: dict[str, CreativeIntentMetrics] | None = None
+    # Set instead of the fields above when the agent returned nothing usable
+    error: str | None = None
+    detail: str | None = None
 
-    # If agent wrapped in this top-level key
-    if "analyze_and_generate_character_response" in outer:
-        inner = outer["analyze_and_generate_character_response"]
-    else:
-        inner = outer
 
-    raw_result = inner.get("result", inner)
+class QuestSceneResponse(QuestScene):
+    image_uri: str = ""
+    # Responsive WebP / JPEG variants: {"480w": uri, "960w": uri, ...}
+    image_srcset: dict[str, str] = {}
+
+
+class CreateQuestResponse(BaseModel):
+    status: str
+    quest_id: str
+    quest_title: str
+    lesson: str
+    character_name: str
+    scenes: list[QuestSceneResponse]
+    total_scenes: int
 
-    # If result is itself a JSON string, decode it
-    if isinstance(raw_result, str):
-        try:
-            result = json.loads(raw_result)
-        except json.JSONDecodeError:
-            # If it's not valid JSON, just raise so we see it
-            raise ValueError("Failed to decode nested result JSON")
-    else:
-        result = raw_result
 
-    return result
+class RegenerateScenesResponse(BaseModel):
+    status: str
+    quest_id: str
+    scenes: list[QuestSceneResponse]
+    failed_scenes: list[int]
+
 
 @app.get("/")
 async def root():
@@ -120,43 +230,88 @@ async def root():
 @app.get("/health")
 async def health_check():
     """Detailed health check"""
+    from tools.creative_intent_tool import agreement_tracker
+
     return {
         "status": "healthy",
         "service": "Storytopia ADK Agents",
         "project": os.getenv("GOOGLE_CLOUD_PROJECT"),
-        "location": os.getenv("GOOGLE_CLOUD_LOCATION")
+        "location": os.getenv("GOOGLE_CLOUD_LOCATION"),
+        "creative_intent_prescore": agreement_tracker.snapshot(),
+        "evaluations": evaluation_emitter.stats(),
+        "admission": admission.stats(),
+        "quota": quota.stats(),
+        "image_scheduler": image_scheduler.stats(),
     }
 
-@app.post("/generate-character")
+@app.get("/metrics", response_class=PlainTextResponse)
+async def metrics_endpoint():
+    """Prometheus scrape endpoint (per-process stage histograms, counters and gauges)"""
+    metrics.QUEUE_DEPTH.set(evaluation_emitter.stats()["buffered"], queue="evaluations")
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
+
+@app.post("/generate-character", response_model=GenerateCharacterResponse)
 @llm(
     model_name="gemini-2.0-flash-exp",
     name="visionizer_generate_character",
     model_provider="google",
 )
 async def generate_character(
-    drawing_data: str = Form(...),
-    user_id: str = Form(...)
+    user_id: str = Form(...),
+    drawing: UploadFile | None = File(None),
+    drawing_data: str | None = Form(None),
+    fields: str | None = None,
 ):
     """
     Visionizer endpoint: Analyzes drawing and generates animated character using ADK Runner
     
     Args:
-        drawing_data: Base64 encoded drawing from canvas
         user_id: User identifier
+        drawing: Binary drawing as a multipart file part (preferred)
+        drawing_data: Base64 encoded drawing from canvas (kept for older clients)
+        fields: Optional response projection, e.g. "-analysis" (see pipeline/responses.py)
         
     Returns:
         Analysis and generated character image URI
     """
     try:
-        from tools.storage_tool import upload_base64_to_gcs
+        from tools.storage_tool import (
+            IMAGE_EXTENSIONS,
+            UploadTooLarge,
+            sniff_image_type,
+            upload_base64_to_gcs,
+            upload_stream_to_gcs,
+        )
         from agents.visionizer import visionizer_agent
         from agents.agent_ops import agent_ops
+        from agents.schemas import CreativeIntentEvaluation, VisionizerResult, parse_model
         
         # Upload drawing to GCS
-        drawing_uri = upload_base64_to_gcs(
-            base64_data=drawing_data,
-            filename=f"drawing_{user_id}.png"
-        )
+        set_stage("upload")
+        if drawing is not None:
+            # Multipart: the spooled file is hashed and uploaded in chunks
+            content_type = sniff_image_type(await drawing.read(16))
+            if content_type is None:
+                raise HTTPException(status_code=415, detail="Drawing must be a PNG, JPEG or WebP image")
+            try:
+                drawing_uri, size = await asyncio.to_thread(
+                    upload_stream_to_gcs,
+                    drawing.file,
+                    filename=f"drawing{IMAGE_EXTENSIONS[content_type]}",
+                    content_type=content_type,
+                    max_bytes=MAX_DRAWING_BYTES,
+                )
+            except UploadTooLarge:
+                raise HTTPException(status_code=413, detail="Drawing is too large")
+            metrics.UPLOAD_BYTES.observe(size, encoding="multipart")
+        elif drawing_data:
+            metrics.UPLOAD_BYTES.observe(len(drawing_data), encoding="base64")
+            drawing_uri = upload_base64_to_gcs(
+                base64_data=drawing_data,
+                filename=f"drawing_{user_id}.png"
+            )
+        else:
+            raise HTTPException(status_code=400, detail="Missing drawing (file part) or drawing_data")
         
         # Create or get session
         session_id = f"session_{user_id}"
@@ -182,6 +337,7 @@ async def generate_character(
             )
         
         # Initialize ADK Runner with visionizer agent
+        set_stage("visionizer")
         runner = Runner(
             agent=visionizer_agent,
             app_name=APP_NAME,
@@ -198,7 +354,8 @@ async def generate_character(
         final_response_text = ""
         tool_results = []
         
-        async for event in runner.run_async(
+        async for event in run_agent(
+            runner,
             user_id=user_id,
             session_id=session_id,
             new_message=user_message
@@ -213,104 +370,51 @@ async def generate_character(
                     elif hasattr(part, 'text') and part.text:
                         final_response_text = part.text
         
-        print(f"[API] Raw response: {final_response_text[:500] if final_response_text else 'No text response'}")
-        print(f"[API] Tool results captured: {len(tool_results)}")
+        logger.debug("Visionizer raw response", extra={"response": final_response_text})
+        logger.info("Visionizer tool results captured: %d", len(tool_results))
         
-        # Try to parse the tool result directly
+        # Validate the tool result against the Visionizer schema
         result = None
         for tool_result in tool_results:
             try:
-                print(f"[API] Tool result type: {type(tool_result)}")
-                print(f"[API] Tool result attributes: {dir(tool_result)}")
-                
-                # Try different ways to access the result
-                if hasattr(tool_result, 'response'):
-                    response_data = tool_result.response
-                    print(f"[API] Response data type: {type(response_data)}")
-                    
-                    if isinstance(response_data, dict):
-                        # Check if it has a 'result' field
-                        if 'result' in response_data:
-                            result_str = response_data['result']
-                            result = json.loads(result_str) if isinstance(result_str, str) else result_str
-                        else:
-                            result = response_data
-                    elif isinstance(response_data, str):
-                        result = json.loads(response_data)
-                    
-                    if result and result.get("success"):
-                        print(f"[API] Successfully parsed tool result!")
-                        break
-            except Exception as e:
-                print(f"[API] Failed to parse tool result: {e}")
-                import traceback
-                traceback.print_exc()
+                result = parse_model(VisionizerResult, tool_result.response).model_dump()
+                if result.get("success"):
+                    break
+            except ValueError as e:
+                logger.warning("Failed to parse Visionizer tool result: %s", e)
                 continue
         
-        # If no tool result, try parsing the final response text
-        if not result and final_response_text:
-            try:
-                result = normalize_agent_response(final_response_text)
-                print(f"[API] Normalized result keys: {result.keys()}")
-            except Exception as parse_error:
-                print(f"[API] Parse error: {parse_error}")
-                print(f"[API] Full response: {final_response_text}")
-                
-                # If parsing failed but we have tool results, extract from them
-                if tool_results:
-                    print(f"[API] Attempting to extract from tool results...")
-                    # The tool already succeeded based on logs, so construct response
-                    result = {
-                        "success": True,
-                        "error": None
-                    }
-        
         # If still no result, return error
         if not result:
-            return {
+            return typed_response(GenerateCharacterResponse, {
                 "status": "error",
                 "error": "Failed to get result from agent",
                 "detail": "No parseable response or tool result found"
-            }
+            }, fields)
         
         if not result.get("success"):
             # For failed Visionizer runs, still emit an evaluation so we can monitor failure rates
-            try:
-                span_ctx = LLMObs.export_span(span=None)
-
-                analysis_for_flag = result.get("analysis") or {}
-                age_appropriate = False
-                if isinstance(analysis_for_flag, dict) and "age_appropriate" in analysis_for_flag:
-                    age_appropriate = bool(analysis_for_flag.get("age_appropriate"))
-
-                # For monitoring, treat any failed run as a flag = 1.0
-                inappropriate_flag_value = 1.0
-
-                LLMObs.submit_evaluation(
-                    span=span_ctx,
-                    ml_app="storytopia-backend",
-                    label="inappropriate_content_flag",
-                    metric_type="score",
-                    value=inappropriate_flag_value,
-                    tags={
-                        "agent": "visionizer",
-                        "task": "kids_drawing",
-                        "status": "failed",
-                    },
-                    assessment="fail",
-                    reasoning=(
-                        "Visionizer run failed; drawing marked inappropriate."
-                        if not age_appropriate
-                        else "Visionizer run failed before completion (e.g., model or Imagen error)."
-                    ),
-                )
-                print(
-                    f"[LLMObs] Submitted failure evaluation inappropriate_content_flag={inappropriate_flag_value}"
-                )
-            except Exception as e:
-                import traceback
-                print(f"[LLMObs] ERROR submitting failure evaluation: {e}")
-                print(traceback.format_exc())
+            analysis_for_flag = result.get("analysis") or {}
+            age_appropriate = False
+            if isinstance(analysis_for_flag, dict) and "age_appropriate" in analysis_for_flag:
+                age_appropriate = bool(analysis_for_flag.get("age_appropriate"))
+
+            # For monitoring, treat any failed run as a flag = 1.0
+            emit_evaluation(
+                "inappropriate_content_flag",
+                1.0,
+                tags={
+                    "agent": "visionizer",
+                    "task": "kids_drawing",
+                    "status": "failed",
+                },
+                assessment="fail",
+                reasoning=(
+                    "Visionizer run failed; drawing marked inappropriate."
+                    if not age_appropriate
+                    else "Visionizer run failed before completion (e.g., model or Imagen error)."
+                ),
+            )
 
             # User-friendly error message
             user_message = "Oops, that didn't work. Try again and make sure your drawing is appropriate!"
@@ -322,19 +426,38 @@ async def generate_character(
         # ------------------------------------------------------------------
         # AgentOps: compute creative_intent_score for Visionizer output
         # ------------------------------------------------------------------
+        set_stage("agent_ops")
         creative_intent_score = None
         agent_ops_reasoning = None
+        creative_intent_scorer = "local"
+        prescore_agreement = None
         try:
+            from tools.creative_intent_tool import (
+                AUDIT_RATE,
+                agreement_tracker,
+                build_reasoning,
+                prescore,
+            )
+
             character_description = result.get("character_description", "") or ""
             analysis = result.get("analysis", {}) or {}
 
-            if character_description:
+            # Cheap deterministic pre-score; only borderline cases go to the LLM judge
+            local_result = prescore(character_description, analysis)
+            escalate = bool(character_description) and (
+                local_result["decision"] == "escalate" or random.random() < AUDIT_RATE
+            )
+            agreement_tracker.record_decision(escalated=escalate)
+
+            if escalate:
                 # Prepare input for AgentOps summarizing analysis and description
                 agent_ops_input = (
-                    "Evaluate the Visionizer output for this drawing.\n\n"
-                    "ANALYSIS (JSON):\n" + json.dumps(analysis) + "\n\n"
-                    "CHARACTER DESCRIPTION:\n" + character_description + "\n\n"
-                    "Return the creative_intent_score JSON as specified."
+                    PromptBuilder("agent_ops")
+                    .add("Evaluate the Visionizer output for this drawing.")
+                    .add(compact_json(judge_analysis(analysis)), prefix="ANALYSIS (JSON):\n", dedupe=False)
+                    .add(character_description, prefix="CHARACTER DESCRIPTION:\n", truncatable=True, dedupe=False)
+                    .add("Return the creative_intent_score JSON as specified.")
+                    .build()
                 )
 
                 # Ensure a dedicated session exists for AgentOps
@@ -362,102 +485,110 @@ async def generate_character(
                 )
 
                 agent_ops_text = ""
-                async for event in agent_ops_runner.run_async(
-                    user_id=user_id,
-                    session_id=agent_ops_session_id,
-                    new_message=ops_message,
-                ):
-                    if event.content and event.content.parts:
-                        for part in event.content.parts:
-                            if hasattr(part, "text") and part.text:
-                                agent_ops_text = part.text
+                with metrics.timed_stage("agent_ops_creative_intent"):
+                    async for event in run_agent(
+                        agent_ops_runner,
+                        user_id=user_id,
+                        session_id=agent_ops_session_id,
+                        new_message=ops_message,
+                    ):
+                        if event.content and event.content.parts:
+                            for part in event.content.parts:
+                                if hasattr(part, "text") and part.text:
+                                    agent_ops_text = part.text
 
                 if agent_ops_text:
                     try:
-                        ops_payload = extract_json_block(agent_ops_text)
-                        raw_score = ops_payload.get("creative_intent_score")
-                        if isinstance(raw_score, (int, float)):
-                            # Clamp for safety
-                            creative_intent_score = max(0.0, min(1.0, float(raw_score)))
-                        agent_ops_reasoning = ops_payload.get("reasoning")
-                    except Exception as parse_err:
-                        print(f"[AgentOps] Failed to parse AgentOps JSON: {parse_err}")
-            else:
-                print("[AgentOps] Skipping AgentOps scoring: empty character_description")
+                        ops_payload = parse_model(CreativeIntentEvaluation, agent_ops_text)
+                        creative_intent_score = ops_payload.creative_intent_score
+                        creative_intent_scorer = "llm"
+                        prescore_agreement = agreement_tracker.record_comparison(
+                            local_result["score"], creative_intent_score
+                        )
+                        agent_ops_reasoning = ops_payload.reasoning or None
+                    except ValueError as parse_err:
+                        logger.warning("Failed to parse AgentOps JSON: %s", parse_err)
+
+            # Confident local decision (or LLM judge unavailable): use the local score
+            if creative_intent_score is None:
+                creative_intent_score = local_result["score"]
+                agent_ops_reasoning = build_reasoning(local_result)
+                creative_intent_scorer = "local"
+            logger.info(
+                "creative_intent_score=%.2f (scorer=%s, prescore=%.2f)",
+                creative_intent_score,
+                creative_intent_scorer,
+                local_result["score"],
+            )
         except Exception as e:
-            import traceback
-            print(f"[AgentOps] ERROR while computing creative_intent_score: {e}")
-            print(traceback.format_exc())
+            logger.exception("Error while computing creative_intent_score")
 
         # ------------------------------------------------------------------
-        # Datadog LLM Observability: submit evaluations for Visionizer
-        #  - creative_intent_score (0.0–1.0) from AgentOps
+        # Datadog LLM Observability: queue evaluations for Visionizer
+        #  - creative_intent_score (0.0–1.0) from the pre-scorer / AgentOps
         #  - inappropriate_content_flag (0 or 1) from age_appropriate
         # ------------------------------------------------------------------
-        if creative_intent_score is not None or result.get("analysis") is not None:
-            try:
-                # Capture the current active LLMObs/trace span context
-                span_ctx = LLMObs.export_span(span=None)
-
-                # 1) Creative intent score evaluation (unchanged behavior)
-                if creative_intent_score is not None:
-                    LLMObs.submit_evaluation(
-                        span=span_ctx,
-                        ml_app="storytopia-backend",
-                        label="creative_intent_score",
-                        metric_type="score",
-                        value=creative_intent_score,
-                        tags={
-                            "agent": "visionizer",
-                            "task": "kids_drawing",
-                        },
-                        assessment="pass" if creative_intent_score >= 0.5 else "fail",
-                        reasoning=agent_ops_reasoning
-                        or "AgentOps evaluated character_description detail and coherence.",
-                    )
-                    print(
-                        f"[LLMObs] Submitted evaluation creative_intent_score={creative_intent_score}"
-                    )
+        # 1) Creative intent score evaluation
+        if creative_intent_score is not None:
+            emit_evaluation(
+                "creative_intent_score",
+                creative_intent_score,
+                tags={
+                    "agent": "visionizer",
+                    "task": "kids_drawing",
+                    "scorer": creative_intent_scorer,
+                },
+                assessment="pass" if creative_intent_score >= 0.5 else "fail",
+                reasoning=agent_ops_reasoning
+                or "AgentOps evaluated character_description detail and coherence.",
+            )
 
-                # 2) Inappropriate content flag evaluation from age_appropriate
-                analysis_for_flag = result.get("analysis") or {}
-                if isinstance(analysis_for_flag, dict):
-                    # Default to appropriate (0) if key is missing
-                    age_appropriate = bool(analysis_for_flag.get("age_appropriate", True))
-                    # Metric semantics: 0 = appropriate, 1 = inappropriate
-                    inappropriate_flag_value = 0.0 if age_appropriate else 1.0
-
-                    LLMObs.submit_evaluation(
-                        span=span_ctx,
-                        ml_app="storytopia-backend",
-                        label="inappropriate_content_flag",
-                        metric_type="score",
-                        value=inappropriate_flag_value,
-                        tags={
-                            "agent": "visionizer",
-                            "task": "kids_drawing",
-                        },
-                        assessment="pass" if age_appropriate else "fail",
-                        reasoning=(
-                            "Drawing marked age_appropriate by Visionizer analysis."
-                            if age_appropriate
-                            else "Drawing marked inappropriate by Visionizer analysis."
-                        ),
-                    )
-                    print(
-                        f"[LLMObs] Submitted evaluation inappropriate_content_flag={inappropriate_flag_value}"
-                    )
-            except Exception as e:
-                import traceback
-                print(f"[LLMObs] ERROR submitting Visionizer evaluations: {e}")
-                print(traceback.format_exc())
+        # Local pre-score vs. LLM judge agreement, for tuning the escalation thresholds
+        if prescore_agreement is not None:
+            emit_evaluation(
+                "creative_intent_prescore_agreement",
+                1.0 if prescore_agreement else 0.0,
+                tags={
+                    "agent": "visionizer",
+                    "task": "kids_drawing",
+                },
+                assessment="pass" if prescore_agreement else "fail",
+                reasoning="Local pre-score and AgentOps agree on pass/fail."
+                if prescore_agreement
+                else "Local pre-score and AgentOps disagree on pass/fail.",
+            )
+
+        # 2) Inappropriate content flag evaluation from age_appropriate
+        analysis_for_flag = result.get("analysis") or {}
+        if isinstance(analysis_for_flag, dict):
+            # Default to appropriate (0) if key is missing
+            age_appropriate = bool(analysis_for_flag.get("age_appropriate", True))
+            # Metric semantics: 0 = appropriate, 1 = inappropriate
+            emit_evaluation(
+                "inappropriate_content_flag",
+                0.0 if age_appropriate else 1.0,
+                tags={
+                    "agent": "visionizer",
+                    "task": "kids_drawing",
+                },
+                assessment="pass" if age_appropriate else "fail",
+                reasoning=(
+                    "Drawing marked age_appropriate by Visionizer analysis."
+                    if age_appropriate
+                    else "Drawing marked inappropriate by Visionizer analysis."
+                ),
+            )
         
+        # Token totals and per-stage cost on the LLMObs span
+        costs.annotate_span()
+
         # Return the result - include AgentOps metrics when available
         response = {
             "status": "success",
             "drawing_uri": drawing_uri,
             "analysis": result.get("analysis", {}),
             "generated_character_uri": result.get("generated_character_uri", ""),
+            "generated_character_srcset": result.get("generated_character_srcset", {}),
             "character_type": result.get("character_type", ""),
             "character_description": result.get("character_description", ""),
         }
@@ -468,28 +599,30 @@ async def generate_character(
                 "visionizer": {
                     "creative_intent_score": creative_intent_score,
                     "agent_ops_reasoning": agent_ops_reasoning,
+                    "creative_intent_scorer": creative_intent_scorer,
                 }
             }
 
-        return response
+        return typed_response(GenerateCharacterResponse, response, fields)
         
     except HTTPException:
         raise
+    except QuotaTimeout as e:
+        raise quota_busy(e)
     except Exception as e:
-        import traceback
-        traceback.print_exc()
+        logger.exception("generate_character failed")
         # User-friendly error message for unexpected errors
         user_message = "Oops, that didn't work. Try again and make sure your drawing is appropriate!"
         raise HTTPException(status_code=500, detail=user_message)
 
 
-@app.post("/create-quest")
+@app.post("/create-quest", response_model=CreateQuestResponse)
 @llm(
     model_name="gemini-2.0-pro-exp",
     name="quest_creator_create_quest",
     model_provider="google",
 )
-async def create_quest(request: CreateQuestRequest):
+async def create_quest(request: CreateQuestRequest, fields: str | None = None):
     """
     Creates an interactive quest with 8 scenes
     
@@ -497,14 +630,25 @@ async def create_quest(request: CreateQuestRequest):
         character_description: Full character description
         character_name: Character name
         lesson: Lesson ID (e.g., "sharing", "kindness")
+        run_id: Optional run ID; a retry with the run ID of a failed attempt
+            (sent back in the X-Run-Id header) resumes after its last completed stage
+        fields: Optional response projection, e.g. "-scenes.image_prompt" (see pipeline/responses.py)
     
     Returns:
-        Quest data with 8 scenes and illustrations
+        Quest data with 8 scenes and illustrations; quest_id is the run ID
     """
+    if request.run_id is not None and not RUN_ID_PATTERN.fullmatch(request.run_id):
+        raise HTTPException(status_code=400, detail="run_id must be 1-64 letters, digits, '-' or '_'")
+    run_id = request.run_id or uuid.uuid4().hex
+    
     try:
         from agents.quest_creator import quest_creator_agent
-        from agents.illustrator import illustrator_agent
-        from agents.agent_ops import agent_ops_quest, agent_ops_illustrator
+        from agents.quest_specializer import quest_specializer_agent
+        from agents.lesson_library import lesson_library, specialization_input
+        from agents.illustrator import SceneIllustrationQueue, apply_scene_images
+        from agents.agent_ops import agent_ops_quest
+        from agents.scene_stream import SceneStreamParser
+        from agents.schemas import LessonAlignmentEvaluation, Quest, parse_model
         
         character_description = request.character_description
         character_name = request.character_name
@@ -518,10 +662,32 @@ async def create_quest(request: CreateQuestRequest):
                 detail="Missing character_description or lesson"
             )
         
+        # Checkpoints of earlier attempts with this run ID (see pipeline/run_store.py)
+        run_request = {
+            "character_name": character_name,
+            "character_description": character_description,
+            "lesson": lesson,
+        }
+        checkpoints = await asyncio.to_thread(run_store.load_run, run_id) if request.run_id else {}
+        for stage in ("quest_text", "quest"):
+            if stage in checkpoints and any(checkpoints[stage].get(k) != v for k, v in run_request.items()):
+                raise HTTPException(status_code=409, detail="run_id belongs to a different quest request")
+        
+        def checkpoint(stage: str, payload: dict) -> None:
+            """Saves a stage's output; a failed save only costs resumability"""
+            try:
+                run_store.save(run_id, stage, payload)
+            except Exception:
+                logger.exception("Could not checkpoint %s of run %s", stage, run_id)
+        
+        def checkpoint_scene(image: dict) -> None:
+            checkpoint(f"scene_{image['scene_number']}", image)
+        
         # Step 1: Create Quest with Quest-Creator Agent
-        print(f"[API] Creating quest for {character_name} with lesson: {lesson}")
+        set_stage("quest_creator")
+        logger.info("Creating quest for %s with lesson: %s", character_name, lesson)
         
-        quest_input = f"""
+        quest_input = PromptBuilder("quest_creator").add(f"""
 Create an interactive quest with these details:
 
 CHARACTER NAME: {character_name}
@@ -531,7 +697,7 @@ LESSON: {lesson}
 CRITICAL: Use the character name "{character_name}" in ALL 8 scenes. 
 The character's name is "{character_name}" - use this exact name throughout the entire quest.
 Generate 8 scenes teaching this lesson through {character_name}'s adventure.
-"""
+""", dedupe=False).build()
         
         # Create session for quest creation
         user_id = f"quest_{lesson}"
@@ -547,414 +713,374 @@ Generate 8 scenes teaching this lesson through {character_name}'s adventure.
         except:
             pass  # Session might already exist
         
-        # Run Quest-Creator agent
-        runner = Runner(
-            agent=quest_creator_agent,
-            app_name=APP_NAME,
-            session_service=session_service
-        )
-        
-        user_message = types.Content(
-            role='user',
-            parts=[types.Part(text=quest_input)]
-        )
-        
-        quest_response_text = ""
-        async for event in runner.run_async(
-            user_id=user_id,
-            session_id=session_id,
-            new_message=user_message
-        ):
-            if event.content and event.content.parts:
-                for part in event.content.parts:
-                    if hasattr(part, 'text') and part.text:
-                        quest_response_text = part.text
-        
-        print(f"[API] Quest response: {quest_response_text[:200]}...")
-        
-        # Parse quest data
-        try:
-            quest_data = extract_json_block(quest_response_text)
-        except Exception as e:
-            print(f"[API] Failed to parse quest JSON: {e}")
-            raise HTTPException(
-                status_code=500,
-                detail="Oops, please try again!"
-            )
-        
-        # Step 2: Generate illustrations with Illustrator Agent
-        print(f"[API] Generating illustrations for {len(quest_data.get('scenes', []))} scenes...")
-        
-        illustrator_input = f"""
-Generate illustrations for this quest:
-
-QUEST DATA (JSON):
-{json.dumps(quest_data)}
-
-CHARACTER DESCRIPTION (USE THIS EXACTLY):
-{character_description}
-
-CRITICAL CONSISTENCY REQUIREMENTS:
-- The character MUST look EXACTLY the same in all 8 scenes
-- Use the character description PRECISELY - do not deviate
-- Maintain IDENTICAL: colors, proportions, features, style, markings
-- The character should be instantly recognizable across all scenes
-- Do NOT change, morph, or alter the character's appearance in any way
-"""
-        
-        # Create separate session for illustrator
-        illustrator_session_id = f"{session_id}_illustrator"
-        try:
-            await session_service.create_session(
+        async def stream_quest(agent, text: str):
+            """
+            Runs a quest agent in streaming mode; each scene is handed to a fresh
+            illustration queue as soon as its closing brace arrives
+            
+            Returns:
+                (quest dict or None if the output did not validate, illustration queue)
+            """
+            runner = Runner(
+                agent=agent,
                 app_name=APP_NAME,
-                user_id=user_id,
-                session_id=illustrator_session_id,
-                state={}
+                session_service=session_service
             )
-        except:
-            pass  # Session might already exist
+            
+            user_message = types.Content(
+                role='user',
+                parts=[types.Part(text=text)]
+            )
+            
+            scene_parser = SceneStreamParser()
+            queue = SceneIllustrationQueue(character_description, on_rendered=checkpoint_scene)
+            
+            quest_response_text = ""
+            try:
+                async for event in run_agent(
+                    runner,
+                    user_id=user_id,
+                    session_id=session_id,
+                    new_message=user_message,
+                    run_config=RunConfig(streaming_mode=StreamingMode.SSE),
+                ):
+                    if event.content and event.content.parts:
+                        for part in event.content.parts:
+                            if hasattr(part, 'text') and part.text:
+                                if event.partial:
+                                    # Streamed delta: parse incrementally and start illustrating
+                                    for scene in scene_parser.feed(part.text):
+                                        logger.info("Scene %d streamed, queueing illustration", scene["scene_number"])
+                                        queue.submit(scene)
+                                else:
+                                    # Final aggregated response
+                                    quest_response_text = part.text
+                
+                logger.debug("Quest response", extra={"response": quest_response_text, "agent": agent.name})
+                
+                # Validate the complete quest against the schema the model was constrained to
+                try:
+                    return parse_model(Quest, quest_response_text or scene_parser.text).model_dump(), queue
+                except ValueError as e:
+                    logger.warning("Failed to parse %s quest JSON: %s", agent.name, e)
+                    queue.cancel()
+                    return None, queue
+            except BaseException:
+                queue.cancel()
+                raise
         
-        # Run Illustrator agent
-        illustrator_runner = Runner(
-            agent=illustrator_agent,
-            app_name=APP_NAME,
-            session_service=session_service
-        )
+        quest_started_at = time.monotonic()
+        quest_data = None
+        illustration_queue = None
         
-        illustrator_message = types.Content(
-            role='user',
-            parts=[types.Part(text=illustrator_input)]
-        )
+        if "quest" in checkpoints:
+            # Text and illustrations are done: only the evaluations remain
+            quest_data = checkpoints["quest"]["quest"]
+            metrics.CHECKPOINT_RESUMES.inc(stage="quest")
+            logger.info("Resuming run %s after its illustrations", run_id)
+        elif "quest_text" in checkpoints:
+            quest_data = checkpoints["quest_text"]["quest"]
+            metrics.CHECKPOINT_RESUMES.inc(stage="quest_text")
+            logger.info("Resuming run %s after its quest text", run_id)
+        else:
+            # Cheap path: specialize a pre-generated skeleton for this lesson / archetype
+            skeleton = lesson_library.lookup(lesson, character_description)
+            if skeleton is not None:
+                logger.info("Specializing %s/%s skeleton", skeleton["lesson_id"], skeleton["archetype"])
+                try:
+                    quest_data, illustration_queue = await stream_quest(
+                        quest_specializer_agent,
+                        specialization_input(skeleton, character_name, character_description),
+                    )
+                except Exception:
+                    logger.exception("Quest specialization failed")
+                if quest_data is not None and len(quest_data.get("scenes", [])) != len(skeleton["quest"]["scenes"]):
+                    logger.warning("Specialized quest changed the scene count; regenerating")
+                    illustration_queue.cancel()
+                    quest_data = None
         
-        illustration_response_text = ""
-        illustration_tool_results = []
+            # Full generation for unusual lessons (or when specialization failed)
+            if quest_data is None:
+                quest_data, illustration_queue = await stream_quest(quest_creator_agent, quest_input)
+                if quest_data is None:
+                    raise HTTPException(
+                        status_code=500,
+                        detail="Oops, please try again!",
+                        headers={"X-Run-Id": run_id},
+                    )
+            
+            metrics.record_stage("quest_generation", time.monotonic() - quest_started_at)
+            logger.info("Quest text complete in %.1fs", time.monotonic() - quest_started_at)
+            await asyncio.to_thread(checkpoint, "quest_text", {"quest": quest_data, **run_request})
         
-        async for event in illustrator_runner.run_async(
-            user_id=user_id,
-            session_id=illustrator_session_id,
-            new_message=illustrator_message
-        ):
-            if event.content and event.content.parts:
-                for part in event.content.parts:
-                    if hasattr(part, 'function_response') and part.function_response:
-                        print(f"[API] Tool function was called! Response: {part.function_response}")
-                        illustration_tool_results.append(part.function_response)
-                    elif hasattr(part, 'function_call') and part.function_call:
-                        print(f"[API] Tool function call detected: {part.function_call}")
-                    elif hasattr(part, 'text') and part.text:
-                        illustration_response_text = part.text
-                        print(f"[API] Text response from agent: {part.text[:200]}...")
+        if "quest" not in checkpoints:
+            # Step 2: Queue the scenes that are neither streamed already (e.g. non-streaming
+            # fallback) nor rendered by an earlier attempt with the same prompt
+            set_stage("illustrator")
+            if illustration_queue is None:
+                illustration_queue = SceneIllustrationQueue(
+                    character_description, started_at=quest_started_at, on_rendered=checkpoint_scene
+                )
+            rendered = []
+            for scene in quest_data.get("scenes", []):
+                image = checkpoints.get(f"scene_{scene['scene_number']}")
+                if image is not None and image.get("prompt_used") == scene.get("image_prompt", ""):
+                    rendered.append(image)
+                elif scene["scene_number"] not in illustration_queue:
+                    illustration_queue.submit(scene)
+            if rendered:
+                metrics.CHECKPOINT_RESUMES.inc(len(rendered), stage="scene_image")
+                logger.info("Reusing %d checkpointed scene images", len(rendered))
+            
+            logger.info("Waiting for illustrations of %d scenes", len(quest_data.get("scenes", [])) - len(rendered))
+            illustration_data = await illustration_queue.gather()
+            if illustration_queue.first_image_at is not None:
+                logger.info("Time to first image: %.1fs", illustration_queue.first_image_at - quest_started_at)
+            
+            logger.debug("Illustration data", extra={"illustration_data": illustration_data})
+            
+            # Merge scene images into quest data
+            if illustration_data and illustration_data.get("success"):
+                images_applied = apply_scene_images(
+                    quest_data.get("scenes", []), rendered + illustration_data.get("scene_images", [])
+                )
+                logger.info("Applied %d images to scenes", images_applied)
+            
+            # Also keeps the prompts so failed scenes can be re-rendered (/regenerate-scenes)
+            await asyncio.to_thread(checkpoint, "quest", {"quest": quest_data, **run_request})
         
-        # Parse illustration results
-        illustration_data = None
-        for tool_result in illustration_tool_results:
+        logger.info("Quest creation complete")
+
+        if "evaluations" in checkpoints:
+            metrics.CHECKPOINT_RESUMES.inc(stage="evaluations")
+        else:
+            # ------------------------------------------------------------------
+            # Illustrator consistency: score every scene locally (NumPy/Pillow)
+            # ------------------------------------------------------------------
+            set_stage("consistency")
+            illustrator_consistency_scores = {}
             try:
-                if hasattr(tool_result, 'response'):
-                    response_data = tool_result.response
-                    print(f"[API] Tool response type: {type(response_data)}")
-                    
-                    # If response is a dict with 'result' key that's a JSON string
-                    if isinstance(response_data, dict):
-                        if 'result' in response_data:
-                            result_str = response_data['result']
-                            if isinstance(result_str, str):
-                                illustration_data = json.loads(result_str)
-                            else:
-                                illustration_data = result_str
-                        else:
-                            illustration_data = response_data
-                        break
-                    elif isinstance(response_data, str):
-                        illustration_data = json.loads(response_data)
-                        break
+                if character_image_uri:
+                    from tools.consistency_tool import score_scene_consistency
+
+                    scene_uris = {
+                        scene.get("scene_number"): scene.get("image_uri") or ""
+                        for scene in quest_data.get("scenes", [])
+                        if isinstance(scene.get("scene_number"), int)
+                    }
+                    illustrator_consistency_scores = await asyncio.to_thread(
+                        score_scene_consistency,
+                        character_image_uri,
+                        scene_uris,
+                        request.colors_used,
+                        character_description,
+                    )
+                    logger.info("Scored consistency for %d scenes", len(illustrator_consistency_scores))
+                else:
+                    logger.info("Skipping illustrator_consistency: missing character_image_uri")
             except Exception as e:
-                print(f"[API] Failed to parse tool result: {e}")
-                continue
-        
-        if not illustration_data and illustration_response_text:
+                logger.exception("Error while computing illustrator_consistency")
+
+            # ------------------------------------------------------------------
+            # AgentOps (Quest): compute lesson_alignment_score for Quest Creator
+            # ------------------------------------------------------------------
+            set_stage("agent_ops_quest")
+            lesson_alignment_score = None
+            lesson_alignment_reasoning = None
             try:
-                illustration_data = extract_json_block(illustration_response_text)
-            except Exception as e:
-                print(f"[API] Failed to parse illustration text: {e}")
-                pass
-        
-        print(f"[API] Illustration data: {illustration_data}")
-        
-        # Merge scene images into quest data
-        if illustration_data and illustration_data.get("success"):
-            scene_images_list = illustration_data.get("scene_images", [])
-            print(f"[API] Scene images type: {type(scene_images_list)}, value: {scene_images_list[:2] if len(scene_images_list) > 2 else scene_images_list}")
-            
-            # Ensure scene_images is a list
-            if isinstance(scene_images_list, list) and len(scene_images_list) > 0:
-                # Check if it's a list of dicts or a list of strings
-                if isinstance(scene_images_list[0], dict):
-                    # Format: [{"scene_number": 1, "image_uri": "..."}, ...]
-                    # Include ALL scenes, even with empty image_uri (for progressive loading)
-                    scene_images = {img["scene_number"]: img.get("image_uri", "") 
-                                   for img in scene_images_list if isinstance(img, dict) and "scene_number" in img}
-                elif isinstance(scene_images_list[0], str):
-                    # Format: ["url1", "url2", ...] - map by index
-                    scene_images = {i+1: url for i, url in enumerate(scene_images_list)}
-                    print(f"[API] Mapped {len(scene_images)} string URLs to scene numbers")
-                else:
-                    print(f"[API] Warning: Unknown scene_images format")
-                    scene_images = {}
-                
-                # Apply images to scenes (including empty strings for scenes not yet generated)
-                images_applied = 0
-                for scene in quest_data.get("scenes", []):
-                    scene_num = scene.get("scene_number")
-                    if scene_num in scene_images:
-                        scene["image_uri"] = scene_images[scene_num]
-                        if scene_images[scene_num]:  # Only count non-empty URIs
-                            images_applied += 1
-                    else:
-                        # Scene not in response yet (shouldn't happen but be safe)
-                        scene["image_uri"] = ""
-                
-                print(f"[API] Applied {images_applied} images to scenes")
-            else:
-                print(f"[API] Warning: scene_images is not a valid list, skipping image merge")
-        
-        print(f"[API] Quest creation complete!")
+                # Prepare input summarizing the lesson, character, and generated quest
+                from agents.agent_ops import agent_ops_quest
 
-        # ------------------------------------------------------------------
-        # AgentOps (Illustrator): compute illustrator_consistency for scene 3
-        # ------------------------------------------------------------------
-        illustrator_consistency_score = None
-        illustrator_consistency_reasoning = None
-        try:
-            # We need both the original character image and a scene image
-            if character_image_uri:
-                # Prefer scene 3 if available
-                scene3_uri = None
-                if illustration_data and illustration_data.get("success"):
-                    scene_images_list = illustration_data.get("scene_images", [])
-                    # scene_images_list entries may be dicts with scene_number & image_uri
-                    for img in scene_images_list:
-                        if (
-                            isinstance(img, dict)
-                            and img.get("scene_number") == 3
-                        ):
-                            scene3_uri = img.get("image_uri") or None
-                            break
-
-                # Fallback: look in quest_data scenes (after merge)
-                if not scene3_uri:
-                    for scene in quest_data.get("scenes", []):
-                        if scene.get("scene_number") == 3:
-                            scene3_uri = scene.get("image_uri") or None
-                            break
-
-                if scene3_uri:
-                    # Ensure a dedicated session exists for Illustrator AgentOps
-                    agent_ops_illustrator_session_id = f"{session_id}_agent_ops_illustrator"
-                    try:
-                        await session_service.create_session(
-                            app_name=APP_NAME,
-                            user_id=user_id,
-                            session_id=agent_ops_illustrator_session_id,
-                            state={},
-                        )
-                    except Exception:
-                        # Session might already exist; ignore
-                        pass
-
-                    illustrator_ops_runner = Runner(
-                        agent=agent_ops_illustrator,
+                # Ensure a dedicated session exists for AgentOps (Quest)
+                agent_ops_quest_session_id = f"{session_id}_agent_ops_quest"
+                try:
+                    await session_service.create_session(
                         app_name=APP_NAME,
-                        session_service=session_service,
+                        user_id=user_id,
+                        session_id=agent_ops_quest_session_id,
+                        state={},
                     )
+                except Exception:
+                    # Session might already exist; ignore
+                    pass
 
-                    illustrator_ops_input = (
-                        "Evaluate Illustrator character consistency for scene 3.\n\n"
-                        f"original_character_image_uri: {character_image_uri}\n"
-                        f"scene_image_uri: {scene3_uri}\n\n"
-                        "Return the illustrator_consistency_score JSON as specified."
-                    )
+                agent_ops_runner = Runner(
+                    agent=agent_ops_quest,
+                    app_name=APP_NAME,
+                    session_service=session_service,
+                )
 
-                    illustrator_ops_message = types.Content(
-                        role="user",
-                        parts=[types.Part(text=illustrator_ops_input)],
-                    )
+                # Only the fields the judge scores (no image prompts, URIs or srcsets)
+                quest_eval_input = (
+                    PromptBuilder("agent_ops_quest")
+                    .add("Evaluate how well this quest aligns with the target lesson.")
+                    .add(f"LESSON: {lesson}\nCHARACTER DESCRIPTION: {character_description}", dedupe=False)
+                    .add(compact_json(judge_quest(quest_data)), prefix="QUEST DATA (JSON):\n", dedupe=False)
+                    .build()
+                )
 
-                    illustrator_ops_text = ""
-                    async for event in illustrator_ops_runner.run_async(
+                quest_ops_message = types.Content(
+                    role="user",
+                    parts=[types.Part(text=quest_eval_input)],
+                )
+
+                quest_ops_text = ""
+                with metrics.timed_stage("agent_ops_lesson_alignment"):
+                    async for event in run_agent(
+                        agent_ops_runner,
                         user_id=user_id,
-                        session_id=agent_ops_illustrator_session_id,
-                        new_message=illustrator_ops_message,
+                        session_id=agent_ops_quest_session_id,
+                        new_message=quest_ops_message,
                     ):
                         if event.content and event.content.parts:
                             for part in event.content.parts:
                                 if hasattr(part, "text") and part.text:
-                                    illustrator_ops_text = part.text
-
-                    if illustrator_ops_text:
-                        try:
-                            illustrator_payload = extract_json_block(illustrator_ops_text)
-                            raw_score = illustrator_payload.get("illustrator_consistency_score")
-                            if isinstance(raw_score, (int, float)):
-                                illustrator_consistency_score = max(
-                                    0.0, min(1.0, float(raw_score))
-                                )
-                            illustrator_consistency_reasoning = illustrator_payload.get(
-                                "reasoning"
-                            )
-                        except Exception as parse_err:
-                            print(
-                                f"[AgentOps-Illustrator] Failed to parse illustrator_consistency JSON: {parse_err}"
-                            )
-                else:
-                    print(
-                        "[AgentOps-Illustrator] Skipping illustrator_consistency: missing scene 3 image URI"
-                    )
-            else:
-                print(
-                    "[AgentOps-Illustrator] Skipping illustrator_consistency: missing character_image_uri"
-                )
-        except Exception as e:
-            import traceback
+                                    quest_ops_text = part.text
 
-            print(f"[AgentOps-Illustrator] ERROR while computing illustrator_consistency: {e}")
-            print(traceback.format_exc())
-
-        # ------------------------------------------------------------------
-        # AgentOps (Quest): compute lesson_alignment_score for Quest Creator
-        # ------------------------------------------------------------------
-        lesson_alignment_score = None
-        lesson_alignment_reasoning = None
-        try:
-            # Prepare input summarizing the lesson, character, and generated quest
-            from agents.agent_ops import agent_ops_quest
-
-            # Ensure a dedicated session exists for AgentOps (Quest)
-            agent_ops_quest_session_id = f"{session_id}_agent_ops_quest"
-            try:
-                await session_service.create_session(
-                    app_name=APP_NAME,
-                    user_id=user_id,
-                    session_id=agent_ops_quest_session_id,
-                    state={},
+                if quest_ops_text:
+                    try:
+                        ops_payload = parse_model(LessonAlignmentEvaluation, quest_ops_text)
+                        lesson_alignment_score = ops_payload.lesson_alignment_score
+                        lesson_alignment_reasoning = ops_payload.reasoning or None
+                    except ValueError as parse_err:
+                        logger.warning("Failed to parse lesson_alignment_score JSON: %s", parse_err)
+            except Exception as e:
+                logger.exception("Error while computing lesson_alignment_score")
+
+            # Datadog LLM Observability: submit external evaluations for Quest Creator & Illustrator
+            if lesson_alignment_score is not None:
+                emit_evaluation(
+                    "lesson_alignment_score",
+                    lesson_alignment_score,
+                    tags={"agent": "quest_creator", "task": lesson},
+                    assessment="pass" if lesson_alignment_score >= 0.7 else "fail",
+                    reasoning=lesson_alignment_reasoning
+                    or "AgentOps evaluated how well quest scenes align with the target lesson.",
                 )
-            except Exception:
-                # Session might already exist; ignore
-                pass
 
-            agent_ops_runner = Runner(
-                agent=agent_ops_quest,
-                app_name=APP_NAME,
-                session_service=session_service,
-            )
-
-            quest_eval_input = (
-                "Evaluate how well this quest aligns with the target lesson.\n\n"
-                f"LESSON: {lesson}\n"
-                f"CHARACTER DESCRIPTION: {character_description}\n\n"
-                "QUEST DATA (JSON):\n" + json.dumps(quest_data)
-            )
+            # Illustrator consistency evaluation (one per scene)
+            from tools.consistency_tool import PASS_THRESHOLD
 
-            quest_ops_message = types.Content(
-                role="user",
-                parts=[types.Part(text=quest_eval_input)],
-            )
-
-            quest_ops_text = ""
-            async for event in agent_ops_runner.run_async(
-                user_id=user_id,
-                session_id=agent_ops_quest_session_id,
-                new_message=quest_ops_message,
-            ):
-                if event.content and event.content.parts:
-                    for part in event.content.parts:
-                        if hasattr(part, "text") and part.text:
-                            quest_ops_text = part.text
-
-            if quest_ops_text:
-                try:
-                    ops_payload = extract_json_block(quest_ops_text)
-                    raw_score = ops_payload.get("lesson_alignment_score")
-                    if isinstance(raw_score, (int, float)):
-                        lesson_alignment_score = max(0.0, min(1.0, float(raw_score)))
-                    lesson_alignment_reasoning = ops_payload.get("reasoning")
-                except Exception as parse_err:
-                    print(f"[AgentOps-Quest] Failed to parse lesson_alignment_score JSON: {parse_err}")
-        except Exception as e:
-            import traceback
-            print(f"[AgentOps-Quest] ERROR while computing lesson_alignment_score: {e}")
-            print(traceback.format_exc())
+            for scene_number, breakdown in illustrator_consistency_scores.items():
+                score = breakdown["score"]
+                emit_evaluation(
+                    "illustrator_consistency",
+                    score,
+                    tags={"agent": "illustrator", "scene": scene_number, "task": lesson},
+                    assessment="pass" if score >= PASS_THRESHOLD else "fail",
+                    reasoning=(
+                        f"Local scorer: histogram={breakdown['histogram']:.2f}, "
+                        f"palette={breakdown['palette']:.2f}, phash={breakdown['phash']:.2f}"
+                    ),
+                )
 
-        # Datadog LLM Observability: submit external evaluations for Quest Creator & Illustrator
-        if lesson_alignment_score is not None or illustrator_consistency_score is not None:
-            try:
-                from ddtrace.llmobs import LLMObs
-
-                span_ctx = LLMObs.export_span(span=None)
-
-                # Lesson alignment evaluation
-                if lesson_alignment_score is not None:
-                    LLMObs.submit_evaluation(
-                        span=span_ctx,
-                        ml_app="storytopia-backend",
-                        label="lesson_alignment_score",
-                        metric_type="score",
-                        value=lesson_alignment_score,
-                        tags={
-                            "agent": "quest_creator",
-                            "task": str(lesson),
-                        },
-                        assessment="pass" if lesson_alignment_score >= 0.7 else "fail",
-                        reasoning=lesson_alignment_reasoning
-                        or "AgentOps evaluated how well quest scenes align with the target lesson.",
-                    )
-                    print(
-                        f"[LLMObs] Submitted evaluation lesson_alignment_score={lesson_alignment_score}"
-                    )
+            await asyncio.to_thread(checkpoint, "evaluations", {
+                "illustrator_consistency": illustrator_consistency_scores,
+                "lesson_alignment_score": lesson_alignment_score,
+            })
 
-                # Illustrator consistency evaluation (scene 3)
-                if illustrator_consistency_score is not None:
-                    LLMObs.submit_evaluation(
-                        span=span_ctx,
-                        ml_app="storytopia-backend",
-                        label="illustrator_consistency",
-                        metric_type="score",
-                        value=illustrator_consistency_score,
-                        tags={
-                            "agent": "illustrator",
-                            "scene": "3",
-                            "task": str(lesson),
-                        },
-                        assessment=(
-                            "pass"
-                            if illustrator_consistency_score >= 0.8
-                            else "fail"
-                        ),
-                        reasoning=illustrator_consistency_reasoning
-                        or "AgentOps evaluated how well scene 3 illustration preserves character identity and style.",
-                    )
-                    print(
-                        "[LLMObs] Submitted evaluation illustrator_consistency="
-                        f"{illustrator_consistency_score}"
-                    )
-            except Exception as e:
-                import traceback
-                print(f"[LLMObs] ERROR submitting lesson_alignment_score evaluation: {e}")
-                print(traceback.format_exc())
-
-        return {
+        costs.annotate_span()
+        return typed_response(CreateQuestResponse, {
             "status": "success",
+            "quest_id": run_id,
             "quest_title": quest_data.get("quest_title", f"{character_name}'s Adventure"),
             "lesson": lesson,
             "character_name": character_name,
             "scenes": quest_data.get("scenes", []),
             "total_scenes": len(quest_data.get("scenes", []))
-        }
+        }, fields)
         
     except HTTPException:
         raise
+    except QuotaTimeout as e:
+        raise quota_busy(e, {"X-Run-Id": run_id})
+    except Exception as e:
+        logger.exception("create_quest failed")
+        raise HTTPException(status_code=500, detail="Oops, please try again!", headers={"X-Run-Id": run_id})
+
+@app.post("/regenerate-scenes", response_model=RegenerateScenesResponse)
+@llm(
+    model_name="imagen-3.0-generate-001",
+    name="illustrator_regenerate_scenes",
+    model_provider="google",
+)
+async def regenerate_scenes(request: RegenerateScenesRequest, fields: str | None = None):
+    """
+    Re-renders the named scenes of an existing quest
+    
+    Uses the image prompts and character description stored by /create-quest;
+    the scenes are rendered ahead of queued quest scenes since a child is
+    already looking at the quest.
+    
+    Args:
+        quest_id: quest_id returned by /create-quest
+        scene_numbers: Scenes to re-render (e.g. the ones with an empty image_uri)
+        fields: Optional response projection (see pipeline/responses.py)
+    
+    Returns:
+        Only the updated scenes, plus the scene numbers that failed again
+    """
+    try:
+        from agents.illustrator import SceneIllustrationQueue, apply_scene_images
+        
+        stored = await asyncio.to_thread(run_store.load, request.quest_id, "quest")
+        if stored is None:
+            raise HTTPException(status_code=404, detail="Quest not found or expired")
+        
+        scenes = {scene["scene_number"]: scene for scene in stored["quest"].get("scenes", [])}
+        scene_numbers = sorted(set(request.scene_numbers))
+        unknown = [n for n in scene_numbers if n not in scenes]
+        if not scene_numbers or unknown:
+            raise HTTPException(
+                status_code=400,
+                detail=f"Unknown scene numbers: {unknown}" if unknown else "No scene numbers given"
+            )
+        
+        set_stage("illustrator")
+        logger.info("Regenerating scenes %s of quest %s", scene_numbers, request.quest_id)
+        queue = SceneIllustrationQueue(stored["character_description"])
+        now = time.monotonic()
+        for scene_number in scene_numbers:
+            queue.submit(scenes[scene_number], deadline=now)
+        illustration_data = await queue.gather()
+        
+        updated = [scenes[n] for n in scene_numbers]
+        images_applied = apply_scene_images(updated, illustration_data.get("scene_images", []))
+        failed = [scene["scene_number"] for scene in updated if not scene["image_uri"]]
+        metrics.SCENE_REGENERATIONS.inc(images_applied, result="success")
+        metrics.SCENE_REGENERATIONS.inc(len(failed), result="failed")
+        
+        # Merge only the newly rendered scenes into the latest stored quest, so
+        # concurrent regenerations of other scenes are not overwritten
+        rendered = {scene["scene_number"]: scene for scene in updated if scene["image_uri"]}
+        
+        def merge(latest: dict) -> Optional[dict]:
+            if not rendered:
+                return None
+            latest["quest"]["scenes"] = [
+                rendered.get(scene["scene_number"], scene) for scene in latest["quest"].get("scenes", [])
+            ]
+            return latest
+        
+        try:
+            await asyncio.to_thread(run_store.update, request.quest_id, "quest", merge)
+        except Exception:
+            logger.exception("Could not update quest %s", request.quest_id)
+        
+        costs.annotate_span()
+        return typed_response(RegenerateScenesResponse, {
+            "status": "success" if not failed else "partial",
+            "quest_id": request.quest_id,
+            "scenes": updated,
+            "failed_scenes": failed,
+        }, fields)
+    
+    except HTTPException:
+        raise
+    except QuotaTimeout as e:
+        raise quota_busy(e)
     except Exception as e:
-        import traceback
-        traceback.print_exc()
+        logger.exception("regenerate_scenes failed")
         raise HTTPException(status_code=500, detail="Oops, please try again!")
 
 @app.post("/text-to-speech")
@@ -970,14 +1096,18 @@ async def generate_speech(request: TextToSpeechRequest):
     try:
         from tools.tts_tool import text_to_speech
         
-        print(f"[TTS] Converting text to speech: {request.text[:50]}...")
+        set_stage("tts")
+        logger.info("Converting text to speech", extra={"text": request.text[:50]})
         
-        audio_data = text_to_speech(
+        # Worker thread: keeps the event loop free and lets duplicate requests coalesce
+        audio_data = await asyncio.to_thread(
+            text_to_speech,
             text=request.text,
             voice_name=request.voice_name
         )
         
-        print(f"[TTS] Audio generated: {audio_data['audio_uri']}, duration: {audio_data['duration_seconds']:.2f}s")
+        logger.info("Audio generated: %s, duration: %.2fs", audio_data["audio_uri"], audio_data["duration_seconds"])
+        costs.annotate_span()
         
         return {
             "status": "success",
@@ -988,8 +1118,7 @@ async def generate_speech(request: TextToSpeechRequest):
         }
         
     except Exception as e:
-        import traceback
-        traceback.print_exc()
+        logger.exception("generate_speech failed")
         raise HTTPException(status_code=500, detail=f"Error generating speech: {str(e)}")
 
 if __name__ == "__main__":
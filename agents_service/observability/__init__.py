@@ -0,0 +1,2 @@
+# Observability module
+# In-process logging, metrics and evaluation plumbing for the agents service
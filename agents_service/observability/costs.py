@@ -0,0 +1,209 @@
+"""
+Costs
+Per-request token and cost ledger
+
+Every live model call reports its usage here:
+- ADK agents: input / output tokens from the usage metadata of each final
+  (non-partial) model response, via the `record_model_usage` after-model callback
+- Gemini Vision: tokens from the generate_content usage metadata
+- Imagen: images generated
+- TTS: characters synthesized (text + style prompt)
+
+Usage is priced with the price table below and recorded three ways: the
+process-wide Prometheus counters (storytopia_model_usage_total,
+storytopia_model_cost_usd_total), the current request's CostLedger (summed per
+stage, logged and observed as storytopia_request_cost_usd when the request
+ends) and the request's LLMObs span (annotate_span). Replayed cassette calls
+cost nothing and are not recorded.
+
+Prices are list prices in USD and only estimates; models match the longest
+price-table prefix (gemini-2.0-flash-exp -> gemini-2.0-flash). Unknown models
+are counted at zero cost.
+
+Environment:
+    COST_PRICE_TABLE  JSON object, or path to a JSON file, merged over the defaults:
+                      {"<model prefix>": {"input_per_million": ..., "output_per_million": ...,
+                                          "per_image": ..., "per_million_characters": ...}}
+"""
+
+import contextvars
+import json
+import os
+import threading
+from typing import Any, Dict, Optional
+
+from observability.log import get_logger
+from observability.metrics import MODEL_COST, MODEL_USAGE
+
+logger = get_logger("costs")
+
+DEFAULT_PRICES: Dict[str, Dict[str, float]] = {
+    "gemini-2.0-flash": {"input_per_million": 0.10, "output_per_million": 0.40},
+    "gemini-2.0-flash-lite": {"input_per_million": 0.075, "output_per_million": 0.30},
+    "imagen-3.0-generate": {"per_image": 0.04},
+    # Billed in tokens of text in / audio out; approximated per input character
+    "gemini-2.5-flash-tts": {"per_million_characters": 20.0},
+}
+
+USAGE_UNITS = ("input_tokens", "output_tokens", "images", "characters")
+_PRICE_KEYS = {
+    "input_tokens": ("input_per_million", 1e6),
+    "output_tokens": ("output_per_million", 1e6),
+    "images": ("per_image", 1),
+    "characters": ("per_million_characters", 1e6),
+}
+
+
+def _load_prices() -> Dict[str, Dict[str, float]]:
+    prices = {model: dict(rates) for model, rates in DEFAULT_PRICES.items()}
+    override = os.getenv("COST_PRICE_TABLE", "").strip()
+    if not override:
+        return prices
+    try:
+        if not override.startswith("{"):
+            with open(override) as f:
+                override = f.read()
+        for model, rates in json.loads(override).items():
+            prices.setdefault(model, {}).update({k: float(v) for k, v in rates.items()})
+    except (OSError, ValueError, AttributeError) as e:
+        logger.warning("Ignoring invalid COST_PRICE_TABLE: %s", e)
+    return prices
+
+
+PRICES = _load_prices()
+
+
+def price_for(model: str) -> Dict[str, float]:
+    """Rates of the longest price-table prefix of `model` ({} if none matches)"""
+    matches = [name for name in PRICES if model.startswith(name)]
+    return PRICES[max(matches, key=len)] if matches else {}
+
+
+def usage_cost(model: str, **usage: float) -> float:
+    """USD cost of one call's usage (keyword arguments from USAGE_UNITS)"""
+    rates = price_for(model)
+    cost = 0.0
+    for unit, amount in usage.items():
+        key, per = _PRICE_KEYS[unit]
+        cost += amount * rates.get(key, 0.0) / per
+    return cost
+
+
+class CostLedger:
+    """Usage and cost of one request, summed per (stage, model); shared with the request's worker threads"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.entries: Dict[tuple, Dict[str, float]] = {}
+
+    def add(self, stage: str, model: str, cost: float, usage: Dict[str, float]) -> None:
+        with self._lock:
+            entry = self.entries.setdefault((stage, model), {"calls": 0, "cost_usd": 0.0})
+            entry["calls"] += 1
+            entry["cost_usd"] += cost
+            for unit, amount in usage.items():
+                entry[unit] = entry.get(unit, 0) + amount
+
+    def total(self) -> float:
+        with self._lock:
+            return sum(entry["cost_usd"] for entry in self.entries.values())
+
+    def by_stage(self) -> Dict[str, Dict[str, Any]]:
+        """{stage: {"cost_usd", "calls", <units>..., "models": [...]}} with costs rounded to 1e-6"""
+        stages: Dict[str, Dict[str, Any]] = {}
+        with self._lock:
+            for (stage, model), entry in sorted(self.entries.items()):
+                summary = stages.setdefault(stage, {"cost_usd": 0.0, "calls": 0, "models": []})
+                summary["models"].append(model)
+                for key, value in entry.items():
+                    summary[key] = summary.get(key, 0) + value
+        for summary in stages.values():
+            summary["cost_usd"] = round(summary["cost_usd"], 6)
+        return stages
+
+
+ledger_var: contextvars.ContextVar[Optional[CostLedger]] = contextvars.ContextVar("cost_ledger", default=None)
+
+
+def start_request_ledger() -> contextvars.Token:
+    """Starts a ledger for the current request (worker threads see it through copied contexts)"""
+    return ledger_var.set(CostLedger())
+
+
+def record_usage(stage: str, model: str, **usage: float) -> float:
+    """
+    Records one live model call
+
+    Args:
+        stage: Pipeline stage, e.g. "imagen_scene" or an agent name
+        model: Model id, matched against the price table
+        usage: Amounts per unit in USAGE_UNITS (zero amounts are skipped)
+
+    Returns:
+        Estimated cost in USD
+    """
+    usage = {unit: amount for unit, amount in usage.items() if amount}
+    cost = usage_cost(model, **usage)
+    for unit, amount in usage.items():
+        MODEL_USAGE.inc(amount, stage=stage, model=model, unit=unit)
+    MODEL_COST.inc(cost, stage=stage, model=model)
+    ledger = ledger_var.get()
+    if ledger is not None:
+        ledger.add(stage, model, cost, usage)
+    return cost
+
+
+def record_token_usage(stage: str, model: str, usage_metadata: Any) -> float:
+    """Records a Gemini response's usage metadata (prompt / candidates token counts); None is ignored"""
+    if usage_metadata is None:
+        return 0.0
+    return record_usage(
+        stage,
+        model,
+        input_tokens=getattr(usage_metadata, "prompt_token_count", None) or 0,
+        output_tokens=(getattr(usage_metadata, "candidates_token_count", None) or 0)
+        + (getattr(usage_metadata, "thoughts_token_count", None) or 0),
+    )
+
+
+async def record_model_usage(callback_context, llm_response) -> None:
+    """
+    ADK after_model_callback: records the tokens of every final model response
+
+    Partial (streamed) responses are skipped; the final aggregated response
+    carries the usage of the whole call. Returning None keeps the response.
+    """
+    if getattr(llm_response, "partial", False):
+        return None
+    model = getattr(llm_response, "model_version", None)
+    if not model and hasattr(callback_context, "get_invocation_context"):
+        model = getattr(callback_context.get_invocation_context().agent, "model", None)
+    record_token_usage(callback_context.agent_name, model or "unknown", getattr(llm_response, "usage_metadata", None))
+    return None
+
+
+def annotate_span() -> None:
+    """Adds the current request's token totals and per-stage cost to the active LLMObs span"""
+    ledger = ledger_var.get()
+    if ledger is None or not ledger.entries:
+        return
+    try:
+        from ddtrace.llmobs import LLMObs
+
+        if not LLMObs.enabled:
+            return
+        stages = ledger.by_stage()
+        input_tokens = sum(s.get("input_tokens", 0) for s in stages.values())
+        output_tokens = sum(s.get("output_tokens", 0) for s in stages.values())
+        LLMObs.annotate(
+            span=None,
+            metrics={
+                "input_tokens": input_tokens,
+                "output_tokens": output_tokens,
+                "total_tokens": input_tokens + output_tokens,
+                "estimated_total_cost": round(ledger.total(), 6),
+            },
+            metadata={"cost_by_stage": stages},
+        )
+    except Exception as e:
+        logger.debug("Could not annotate the LLMObs span with costs: %s", e)
@@ -0,0 +1,206 @@
+"""
+Evaluation Emitter
+Buffered, non-blocking submission of LLMObs evaluations
+
+Request handlers call `emit_evaluation(...)`, which captures the active span
+context and appends a record to a bounded ring buffer - it never blocks and
+never raises. A background task drains the buffer in batches and calls
+LLMObs.submit_evaluation off the request path.
+
+Repeated evaluations for the same span, label and tags are dropped, and
+counters for enqueued / flushed / dropped / failed records are exposed via
+`evaluation_emitter.stats()`.
+"""
+
+import asyncio
+import os
+import threading
+from collections import OrderedDict, deque
+from typing import Any, Deque, Dict, List, Optional
+
+from ddtrace.llmobs import LLMObs
+
+from observability.log import get_logger
+
+ML_APP = os.getenv("DD_LLMOBS_ML_APP", "storytopia-backend")
+
+BUFFER_CAPACITY = int(os.getenv("EVAL_BUFFER_CAPACITY", "1024"))
+BATCH_SIZE = int(os.getenv("EVAL_BATCH_SIZE", "64"))
+FLUSH_INTERVAL_SECONDS = float(os.getenv("EVAL_FLUSH_INTERVAL_SECONDS", "1.0"))
+# How many recent (span, label, tags) keys are remembered for de-duplication
+DEDUPE_WINDOW = 4096
+
+logger = get_logger("evaluations")
+
+
+class EvaluationEmitter:
+    """Bounded ring buffer of evaluation records flushed by a background task"""
+
+    def __init__(
+        self,
+        capacity: int = BUFFER_CAPACITY,
+        batch_size: int = BATCH_SIZE,
+        flush_interval: float = FLUSH_INTERVAL_SECONDS,
+    ):
+        self.capacity = capacity
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self._buffer: Deque[Dict[str, Any]] = deque()
+        self._seen: "OrderedDict[tuple, None]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._task: Optional[asyncio.Task] = None
+        self.counters = {
+            "enqueued": 0,
+            "flushed": 0,
+            "failed": 0,
+            "dropped_overflow": 0,
+            "dropped_duplicate": 0,
+            "dropped_no_span": 0,
+            "dropped_error": 0,
+        }
+
+    # ------------------------------------------------------------------
+    # Request path
+    # ------------------------------------------------------------------
+
+    def emit(
+        self,
+        label: str,
+        value: Any,
+        *,
+        tags: Optional[Dict[str, str]] = None,
+        assessment: Optional[str] = None,
+        reasoning: Optional[str] = None,
+        metric_type: str = "score",
+        span: Optional[Dict[str, str]] = None,
+    ) -> bool:
+        """
+        Queues one evaluation for the current (or given) span
+
+        Args:
+            label: Evaluation label, e.g. "creative_intent_score"
+            value: Metric value
+            tags: Evaluation tags
+            assessment: "pass" / "fail"
+            reasoning: Human-readable explanation
+            metric_type: LLMObs metric type (default "score")
+            span: Exported span context; defaults to the active span
+
+        Returns:
+            True if the record was queued, False if it was dropped
+        """
+        try:
+            if span is None:
+                span = LLMObs.export_span(span=None)
+            if not span:
+                self._count("dropped_no_span")
+                return False
+
+            tags = {k: str(v) for k, v in (tags or {}).items()}
+            key = (span.get("trace_id"), span.get("span_id"), label, tuple(sorted(tags.items())))
+
+            with self._lock:
+                if key in self._seen:
+                    self.counters["dropped_duplicate"] += 1
+                    return False
+                self._seen[key] = None
+                if len(self._seen) > DEDUPE_WINDOW:
+                    self._seen.popitem(last=False)
+
+                if len(self._buffer) >= self.capacity:
+                    # Ring buffer: drop the oldest record to make room
+                    self._buffer.popleft()
+                    self.counters["dropped_overflow"] += 1
+                self._buffer.append({
+                    "span": span,
+                    "label": label,
+                    "metric_type": metric_type,
+                    "value": value,
+                    "tags": tags,
+                    "assessment": assessment,
+                    "reasoning": reasoning,
+                })
+                self.counters["enqueued"] += 1
+            return True
+        except Exception:
+            # Never fail the request due to observability issues
+            self._count("dropped_error")
+            return False
+
+    def _count(self, name: str) -> None:
+        with self._lock:
+            self.counters[name] += 1
+
+    # ------------------------------------------------------------------
+    # Background flushing
+    # ------------------------------------------------------------------
+
+    def _take_batch(self) -> List[Dict[str, Any]]:
+        with self._lock:
+            n = min(self.batch_size, len(self._buffer))
+            return [self._buffer.popleft() for _ in range(n)]
+
+    def flush(self) -> int:
+        """Submits every buffered record to LLMObs in batches; returns the number flushed"""
+        total = 0
+        while True:
+            batch = self._take_batch()
+            if not batch:
+                break
+            sent = 0
+            for record in batch:
+                try:
+                    LLMObs.submit_evaluation(
+                        span=record["span"],
+                        ml_app=ML_APP,
+                        label=record["label"],
+                        metric_type=record["metric_type"],
+                        value=record["value"],
+                        tags=record["tags"],
+                        assessment=record["assessment"],
+                        reasoning=record["reasoning"],
+                    )
+                    sent += 1
+                except Exception as e:
+                    self._count("failed")
+                    logger.warning("Failed to submit evaluation %s: %s", record["label"], e)
+            with self._lock:
+                self.counters["flushed"] += sent
+            total += sent
+        if total:
+            logger.debug("Flushed %d evaluations", total)
+        return total
+
+    async def _run(self) -> None:
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            if self._buffer:
+                await asyncio.to_thread(self.flush)
+
+    def start(self) -> None:
+        """Starts the background flush task on the running event loop"""
+        if self._task is None or self._task.done():
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def stop(self) -> None:
+        """Stops the flush task and drains whatever is still buffered"""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await asyncio.to_thread(self.flush)
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {**self.counters, "buffered": len(self._buffer)}
+
+
+evaluation_emitter = EvaluationEmitter()
+
+
+def emit_evaluation(label: str, value: Any, **kwargs: Any) -> bool:
+    """Module-level shortcut for evaluation_emitter.emit"""
+    return evaluation_emitter.emit(label, value, **kwargs)
@@ -0,0 +1,191 @@
+"""
+Structured Logging
+Queue-based, level-filtered JSON logging for the request hot paths
+
+Log calls on the event loop only enqueue a record; a QueueListener thread
+does the JSON formatting, payload truncation and stdout I/O. Every record
+carries the current request_id and stage from contextvars.
+
+Environment:
+    LOG_LEVEL             minimum level (default INFO)
+    LOG_SAMPLE_RATE       share of DEBUG/INFO records kept (default 1.0)
+    LOG_MAX_FIELD_CHARS   truncation limit for messages and extra fields (default 512)
+"""
+
+import atexit
+import contextvars
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import random
+import sys
+import time
+from typing import Any, Optional
+
+LOGGER_NAME = "storytopia"
+
+request_id_var: contextvars.ContextVar[Optional[str]] = contextvars.ContextVar("request_id", default=None)
+stage_var: contextvars.ContextVar[Optional[str]] = contextvars.ContextVar("stage", default=None)
+
+# Standard LogRecord attributes; anything else on a record came from `extra=`
+_RESERVED = set(vars(logging.makeLogRecord({}))) | {"message", "asctime", "request_id", "stage"}
+
+_listener: Optional[logging.handlers.QueueListener] = None
+
+
+def truncate(value: Any, limit: int) -> Any:
+    """Truncates long strings (and serialized containers) to `limit` characters"""
+    if isinstance(value, (dict, list, tuple)):
+        value = json.dumps(value, default=str)
+    elif not isinstance(value, (str, int, float, bool)) and value is not None:
+        value = str(value)
+    if isinstance(value, str) and len(value) > limit:
+        return f"{value[:limit]}...<{len(value) - limit} more chars>"
+    return value
+
+
+def _snapshot(value: Any) -> Any:
+    """Immutable copy of an extra field, serialized the way truncate() would"""
+    if value is None or isinstance(value, (str, int, float, bool)):
+        return value
+    if isinstance(value, (dict, list, tuple)):
+        return json.dumps(value, default=str)
+    return str(value)
+
+
+class JsonFormatter(logging.Formatter):
+    """Formats records as one JSON object per line"""
+
+    def __init__(self, max_field_chars: int = 512):
+        super().__init__()
+        self.max_field_chars = max_field_chars
+
+    def format(self, record: logging.LogRecord) -> str:
+        payload = {
+            "ts": round(record.created, 3),
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": truncate(record.getMessage(), self.max_field_chars),
+            "request_id": getattr(record, "request_id", None),
+            "stage": getattr(record, "stage", None),
+        }
+        for key, value in record.__dict__.items():
+            if key not in _RESERVED and not key.startswith("_"):
+                payload[key] = truncate(value, self.max_field_chars)
+        if record.exc_info:
+            payload["exc"] = self.formatException(record.exc_info)
+        return json.dumps(payload, default=str)
+
+
+class ContextFilter(logging.Filter):
+    """Stamps request_id / stage onto the record in the calling context"""
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        record.request_id = request_id_var.get()
+        record.stage = stage_var.get()
+        return True
+
+
+class SamplingFilter(logging.Filter):
+    """Keeps a fraction of DEBUG/INFO records; WARNING and above always pass"""
+
+    def __init__(self, rate: float):
+        super().__init__()
+        self.rate = rate
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno >= logging.WARNING or self.rate >= 1.0:
+            return True
+        return random.random() < self.rate
+
+
+class DeferredQueueHandler(logging.handlers.QueueHandler):
+    """
+    QueueHandler that defers formatting to the listener thread
+
+    The stock handler formats the record (including tracebacks) in the caller;
+    here only the message arguments are merged and mutable `extra=` values
+    (dicts, lists, objects) are snapshotted to strings, so the record stays
+    cheap to enqueue and a caller mutating them afterwards does not change
+    what gets logged.
+    """
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        record.msg = record.getMessage()
+        record.args = None
+        for key, value in record.__dict__.items():
+            if key not in _RESERVED and not key.startswith("_"):
+                record.__dict__[key] = _snapshot(value)
+        return record
+
+
+def configure_logging(stream=None) -> logging.Logger:
+    """
+    Installs the queue handler on the "storytopia" logger (idempotent)
+
+    Args:
+        stream: Output stream for the listener (default sys.stdout)
+
+    Returns:
+        The configured root service logger
+    """
+    global _listener
+    logger = logging.getLogger(LOGGER_NAME)
+    if _listener is not None:
+        return logger
+
+    logger.setLevel(os.getenv("LOG_LEVEL", "INFO").upper())
+    logger.propagate = False
+
+    sink = logging.StreamHandler(stream or sys.stdout)
+    sink.setFormatter(JsonFormatter(int(os.getenv("LOG_MAX_FIELD_CHARS", "512"))))
+
+    log_queue: queue.SimpleQueue = queue.SimpleQueue()
+    handler = DeferredQueueHandler(log_queue)
+    handler.addFilter(SamplingFilter(float(os.getenv("LOG_SAMPLE_RATE", "1.0"))))
+    handler.addFilter(ContextFilter())
+    logger.handlers = [handler]
+
+    _listener = logging.handlers.QueueListener(log_queue, sink, respect_handler_level=False)
+    _listener.start()
+    atexit.register(shutdown_logging)
+    return logger
+
+
+def shutdown_logging() -> None:
+    """Flushes queued records and stops the listener thread"""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+
+
+def _restart_after_fork() -> None:
+    """The listener thread does not survive fork(); a forked worker starts its own"""
+    global _listener
+    if _listener is not None:
+        stream = _listener.handlers[0].stream
+        _listener = None
+        configure_logging(stream)
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_restart_after_fork)
+
+
+def get_logger(name: str) -> logging.Logger:
+    """Returns a child of the "storytopia" logger, configuring logging on first use"""
+    configure_logging()
+    return logging.getLogger(f"{LOGGER_NAME}.{name}")
+
+
+def new_request_id() -> str:
+    """Short random id used to correlate log records of one request"""
+    return f"{int(time.time() * 1000) & 0xFFFFFF:06x}{random.getrandbits(24):06x}"
+
+
+def set_stage(name: Optional[str]) -> None:
+    """Tags subsequent records in the current request context with `stage=name`"""
+    stage_var.set(name)
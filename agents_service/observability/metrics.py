@@ -0,0 +1,359 @@
+"""
+Metrics
+In-process Prometheus-style metrics and per-request Server-Timing
+
+Stage latencies are recorded with `timed_stage(name)`, which feeds the
+`storytopia_stage_duration_seconds` histogram and the current request's
+timing list (rendered as the Server-Timing response header). Counters and
+gauges cover upstream retries / 429s, in-flight requests and queue depth.
+
+`render()` produces the Prometheus text exposition format served at /metrics.
+Values are per process; with several workers each one is scraped separately.
+"""
+
+import contextvars
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, Iterator, List, Optional, Sequence, Tuple
+
+# Seconds; spans fast local work (uploads) up to full Imagen / LLM calls
+DEFAULT_BUCKETS = (0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 20.0, 30.0, 60.0, 120.0)
+
+# (stage, seconds) pairs recorded while handling the current request
+request_timings_var: contextvars.ContextVar[Optional[List[Tuple[str, float]]]] = contextvars.ContextVar(
+    "request_timings", default=None
+)
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    pairs = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if not float(value).is_integer() else str(int(value))
+
+
+class _Metric:
+    """Base class: a named metric family keyed by label values"""
+
+    kind = ""
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        self._children: Dict[Tuple[str, ...], object] = {}
+
+    def _key(self, labels: Dict[str, str]) -> Tuple[str, ...]:
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f"{self.name} expects labels {self.labelnames}, got {tuple(labels)}")
+        return tuple(str(labels[n]) for n in self.labelnames)
+
+    def header(self) -> List[str]:
+        return [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+
+
+class Counter(_Metric):
+    """Monotonically increasing count"""
+
+    kind = "counter"
+
+    def inc(self, amount: float = 1.0, **labels: str) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._children[key] = self._children.get(key, 0.0) + amount
+
+    def value(self, **labels: str) -> float:
+        with self._lock:
+            return self._children.get(self._key(labels), 0.0)
+
+    def render(self) -> List[str]:
+        with self._lock:
+            items = sorted(self._children.items())
+        return self.header() + [
+            f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(v)}" for key, v in items
+        ]
+
+
+class Gauge(_Metric):
+    """Value that can go up and down"""
+
+    kind = "gauge"
+
+    def set(self, value: float, **labels: str) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._children[key] = float(value)
+
+    def inc(self, amount: float = 1.0, **labels: str) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._children[key] = self._children.get(key, 0.0) + amount
+
+    def dec(self, amount: float = 1.0, **labels: str) -> None:
+        self.inc(-amount, **labels)
+
+    def value(self, **labels: str) -> float:
+        with self._lock:
+            return self._children.get(self._key(labels), 0.0)
+
+    def render(self) -> List[str]:
+        with self._lock:
+            items = sorted(self._children.items())
+        return self.header() + [
+            f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(v)}" for key, v in items
+        ]
+
+
+class Histogram(_Metric):
+    """Cumulative-bucket latency histogram"""
+
+    kind = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: Sequence[str] = (),
+        buckets: Sequence[float] = DEFAULT_BUCKETS,
+    ):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets)) + (float("inf"),)
+
+    def observe(self, value: float, **labels: str) -> None:
+        key = self._key(labels)
+        with self._lock:
+            state = self._children.get(key)
+            if state is None:
+                state = self._children[key] = {"buckets": [0] * len(self.buckets), "sum": 0.0, "count": 0}
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    state["buckets"][i] += 1
+                    break
+            state["sum"] += value
+            state["count"] += 1
+
+    def render(self) -> List[str]:
+        with self._lock:
+            items = sorted((k, {**v, "buckets": list(v["buckets"])}) for k, v in self._children.items())
+        lines = self.header()
+        for key, state in items:
+            cumulative = 0
+            for bound, count in zip(self.buckets, state["buckets"]):
+                cumulative += count
+                le = f'le="{_format_value(bound)}"'
+                lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, key, le)} {cumulative}")
+            labels = _format_labels(self.labelnames, key)
+            lines.append(f"{self.name}_sum{labels} {_format_value(state['sum'])}")
+            lines.append(f"{self.name}_count{labels} {state['count']}")
+        return lines
+
+
+# ---------------------------------------------------------------------------
+# Service metrics
+# ---------------------------------------------------------------------------
+
+STAGE_DURATION = Histogram(
+    "storytopia_stage_duration_seconds",
+    "Latency of pipeline stages (GCS upload, vision, Imagen, quest generation, AgentOps, TTS)",
+    ["stage"],
+)
+UPSTREAM_RETRIES = Counter(
+    "storytopia_upstream_retries_total",
+    "Retries of upstream API calls",
+    ["service"],
+)
+UPSTREAM_RATE_LIMITED = Counter(
+    "storytopia_upstream_rate_limited_total",
+    "Upstream responses rejected with 429 / RESOURCE_EXHAUSTED",
+    ["service"],
+)
+REQUESTS_IN_FLIGHT = Gauge(
+    "storytopia_http_requests_in_flight",
+    "HTTP requests currently being handled",
+)
+QUEUE_DEPTH = Gauge(
+    "storytopia_queue_depth",
+    "Items waiting in in-process work queues",
+    ["queue"],
+)
+ADMISSION_IN_FLIGHT = Gauge(
+    "storytopia_admission_in_flight",
+    "Requests admitted and running, per admission pool",
+    ["pool"],
+)
+ADMISSION_QUEUED = Gauge(
+    "storytopia_admission_queued",
+    "Requests waiting for an admission slot, per pool",
+    ["pool"],
+)
+ADMISSION_REJECTED = Counter(
+    "storytopia_admission_rejected_total",
+    "Requests shed by admission control (queue_full -> 429, queue_timeout -> 503)",
+    ["pool", "reason"],
+)
+SCHEDULER_WAIT = Histogram(
+    "storytopia_image_scheduler_wait_seconds",
+    "Time scene renders wait in the image scheduler, per priority (scene number)",
+    ["priority"],
+)
+SINGLEFLIGHT_CALLS = Counter(
+    "storytopia_singleflight_calls_total",
+    "Coalescable external calls: role=leader made the call, role=coalesced reused an in-flight one",
+    ["operation", "role"],
+)
+STORAGE_UPLOADS = Counter(
+    "storytopia_storage_uploads_total",
+    "GCS asset uploads: result=uploaded wrote a new object, result=deduplicated found it already stored",
+    ["result"],
+)
+UPLOAD_BYTES = Histogram(
+    "storytopia_upload_request_bytes",
+    "Size of uploaded drawings as sent on the wire, per encoding (multipart or base64)",
+    ["encoding"],
+    buckets=(16_384, 65_536, 262_144, 524_288, 1_048_576, 2_097_152, 4_194_304, 8_388_608, 16_777_216),
+)
+PROMPT_TOKENS = Histogram(
+    "storytopia_prompt_tokens",
+    "Estimated size of assembled prompts (about 4 characters per token), per stage",
+    ["stage"],
+    buckets=(64, 128, 256, 480, 1024, 2048, 4096, 8192, 16384),
+)
+PROMPT_TRIMMED = Counter(
+    "storytopia_prompt_trimmed_total",
+    "Prompt segments removed by the prompt builder (deduplicated, dropped or truncated "
+    "for the budget) and prompts left over budget",
+    ["stage", "action"],
+)
+MODEL_USAGE = Counter(
+    "storytopia_model_usage_total",
+    "Live model usage per stage: unit=input_tokens|output_tokens (Gemini), images (Imagen), characters (TTS)",
+    ["stage", "model", "unit"],
+)
+MODEL_COST = Counter(
+    "storytopia_model_cost_usd_total",
+    "Estimated model spend in USD per stage, from the price table in observability/costs.py",
+    ["stage", "model"],
+)
+REQUEST_COST = Histogram(
+    "storytopia_request_cost_usd",
+    "Estimated model spend per request in USD, per endpoint",
+    ["path"],
+    buckets=(0.0001, 0.001, 0.005, 0.01, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5),
+)
+SCENE_REGENERATIONS = Counter(
+    "storytopia_scene_regenerations_total",
+    "Scenes re-rendered by /regenerate-scenes: result=success got an image, result=failed did not",
+    ["result"],
+)
+CHECKPOINT_RESUMES = Counter(
+    "storytopia_checkpoint_resumes_total",
+    "Pipeline stages skipped because a retried run resumed from their checkpoint "
+    "(quest_text, scene_image per scene, quest, evaluations)",
+    ["stage"],
+)
+IDEMPOTENCY_DUPLICATES = Counter(
+    "storytopia_idempotency_duplicates_total",
+    "Repeated Idempotency-Key requests that did not run the pipeline again: "
+    "outcome=attached joined a running execution, outcome=replayed got a stored response, "
+    "outcome=mismatch reused the key for a different request (422)",
+    ["path", "outcome"],
+)
+IDEMPOTENCY_SAVED_COST = Counter(
+    "storytopia_idempotency_saved_cost_usd_total",
+    "Estimated model spend of the duplicate executions avoided by Idempotency-Key handling",
+    ["path"],
+)
+
+REGISTRY: List[_Metric] = [
+    STAGE_DURATION,
+    UPSTREAM_RETRIES,
+    UPSTREAM_RATE_LIMITED,
+    REQUESTS_IN_FLIGHT,
+    QUEUE_DEPTH,
+    ADMISSION_IN_FLIGHT,
+    ADMISSION_QUEUED,
+    ADMISSION_REJECTED,
+    SCHEDULER_WAIT,
+    SINGLEFLIGHT_CALLS,
+    STORAGE_UPLOADS,
+    UPLOAD_BYTES,
+    PROMPT_TOKENS,
+    PROMPT_TRIMMED,
+    MODEL_USAGE,
+    MODEL_COST,
+    REQUEST_COST,
+    SCENE_REGENERATIONS,
+    CHECKPOINT_RESUMES,
+    IDEMPOTENCY_DUPLICATES,
+    IDEMPOTENCY_SAVED_COST,
+]
+
+
+def render() -> str:
+    """Prometheus text exposition of every registered metric"""
+    lines: List[str] = []
+    for metric in REGISTRY:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+
+# ---------------------------------------------------------------------------
+# Stage timing
+# ---------------------------------------------------------------------------
+
+def record_stage(name: str, seconds: float) -> None:
+    """Records a finished stage in the histogram and the current request's timings"""
+    STAGE_DURATION.observe(seconds, stage=name)
+    timings = request_timings_var.get()
+    if timings is not None:
+        timings.append((name, seconds))
+
+
+@contextmanager
+def timed_stage(name: str) -> Iterator[None]:
+    """Times the enclosed block as stage `name` (also when it raises)"""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        record_stage(name, time.perf_counter() - start)
+
+
+def start_request_timings() -> contextvars.Token:
+    """Starts collecting stage timings for the current request"""
+    return request_timings_var.set([])
+
+
+def server_timing_header(timings: List[Tuple[str, float]], total: Optional[float] = None) -> str:
+    """
+    Formats stage timings as a Server-Timing header value
+
+    Repeated stages (e.g. one Imagen call per scene) are summed into a single
+    entry whose description carries the call count.
+    """
+    totals: Dict[str, List[float]] = {}
+    for name, seconds in timings:
+        entry = totals.setdefault(name, [0.0, 0])
+        entry[0] += seconds
+        entry[1] += 1
+    parts = []
+    for name, (seconds, count) in totals.items():
+        part = f"{name};dur={seconds * 1000:.1f}"
+        if count > 1:
+            part += f';desc="{count} calls"'
+        parts.append(part)
+    if total is not None:
+        parts.append(f"total;dur={total * 1000:.1f}")
+    return ", ".join(parts)
@@ -0,0 +1,3 @@
+# Pipeline module
+# Runtime infrastructure shared by the API handlers: admission control,
+# quota coordination and scheduling of upstream work
@@ -0,0 +1,233 @@
+"""
+Admission Control
+Per-endpoint concurrency limits with bounded FIFO wait queues
+
+Every expensive request shares the same upstream quotas (Imagen: 30 RPM), so
+letting an unbounded number of pipelines start only makes all of them slow
+down, retry and time out together. Each endpoint is mapped to a pool with a
+concurrency limit; excess requests wait in a bounded queue for at most
+`queue_timeout` seconds. Requests that cannot be served are shed early:
+
+    queue full      -> 429 Too Many Requests   + Retry-After
+    queue timeout   -> 503 Service Unavailable + Retry-After
+
+Cheap endpoints (/text-to-speech, /health) use their own pool so they keep
+answering while quest pipelines are saturated. /metrics and / are never limited.
+
+Environment (per pool, e.g. ADMISSION_CREATE_QUEST_CONCURRENCY):
+    ADMISSION_<POOL>_CONCURRENCY   requests running at once
+    ADMISSION_<POOL>_QUEUE         requests allowed to wait
+    ADMISSION_<POOL>_TIMEOUT       seconds a request may wait for a slot
+    ADMISSION_ENABLED              0 disables admission control entirely
+"""
+
+import asyncio
+import math
+import os
+import time
+from collections import deque
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Deque, Dict, Optional
+
+from observability.metrics import ADMISSION_IN_FLIGHT, ADMISSION_QUEUED, ADMISSION_REJECTED
+
+ADMISSION_ENABLED = os.getenv("ADMISSION_ENABLED", "1") != "0"
+
+# Smoothing factor for the service-time average used to compute Retry-After
+_EWMA_ALPHA = 0.2
+
+
+class AdmissionRejected(Exception):
+    """Raised when a request is shed; carries the HTTP status and Retry-After"""
+
+    def __init__(self, pool: str, reason: str, status_code: int, retry_after: int):
+        super().__init__(f"{pool}: {reason}")
+        self.pool = pool
+        self.reason = reason
+        self.status_code = status_code
+        self.retry_after = retry_after
+
+
+class AdmissionPool:
+    """Concurrency limiter with a bounded FIFO queue and queue timeout"""
+
+    def __init__(
+        self,
+        name: str,
+        concurrency: int,
+        max_queue: int,
+        queue_timeout: float,
+        initial_service_time: float = 1.0,
+    ):
+        self.name = name
+        self.concurrency = concurrency
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self.in_flight = 0
+        self._waiters: Deque[asyncio.Future] = deque()
+        self._service_time = initial_service_time
+        self.admitted = 0
+        self.rejected = {"queue_full": 0, "queue_timeout": 0}
+
+    @classmethod
+    def from_env(cls, name: str, concurrency: int, max_queue: int, queue_timeout: float, **kwargs) -> "AdmissionPool":
+        prefix = f"ADMISSION_{name.upper()}_"
+        return cls(
+            name,
+            concurrency=int(os.getenv(prefix + "CONCURRENCY", concurrency)),
+            max_queue=int(os.getenv(prefix + "QUEUE", max_queue)),
+            queue_timeout=float(os.getenv(prefix + "TIMEOUT", queue_timeout)),
+            **kwargs,
+        )
+
+    @property
+    def queued(self) -> int:
+        return len(self._waiters)
+
+    def retry_after(self) -> int:
+        """Seconds until a slot is likely free: queued work ahead / concurrency * service time"""
+        backlog = (self.queued + 1) / max(1, self.concurrency)
+        return max(1, math.ceil(backlog * self._service_time))
+
+    def _update_gauges(self) -> None:
+        ADMISSION_IN_FLIGHT.set(self.in_flight, pool=self.name)
+        ADMISSION_QUEUED.set(self.queued, pool=self.name)
+
+    def _reject(self, reason: str, status_code: int) -> AdmissionRejected:
+        self.rejected[reason] += 1
+        ADMISSION_REJECTED.inc(pool=self.name, reason=reason)
+        return AdmissionRejected(self.name, reason, status_code, self.retry_after())
+
+    async def acquire(self) -> None:
+        """
+        Waits for a slot
+
+        Raises:
+            AdmissionRejected: queue full (429) or queue timeout (503)
+        """
+        if self.in_flight < self.concurrency and not self._waiters:
+            self.in_flight += 1
+            self.admitted += 1
+            self._update_gauges()
+            return
+
+        if self.queued >= self.max_queue:
+            raise self._reject("queue_full", 429)
+
+        waiter = asyncio.get_running_loop().create_future()
+        self._waiters.append(waiter)
+        self._update_gauges()
+        try:
+            # asyncio.wait does not cancel the future on timeout, so a slot handed
+            # over at the last moment is never lost
+            await asyncio.wait({waiter}, timeout=self.queue_timeout)
+        except BaseException:
+            # Client went away while queued
+            self._abandon(waiter)
+            raise
+        if not waiter.done():
+            self._abandon(waiter)
+            raise self._reject("queue_timeout", 503)
+        self.admitted += 1
+
+    def _abandon(self, waiter: asyncio.Future) -> None:
+        if waiter.done() and not waiter.cancelled():
+            # The slot was already transferred to this waiter; pass it on
+            self.release()
+        else:
+            waiter.cancel()
+            try:
+                self._waiters.remove(waiter)
+            except ValueError:
+                pass
+        self._update_gauges()
+
+    def release(self, service_time: Optional[float] = None) -> None:
+        """Frees a slot, handing it straight to the oldest waiter if there is one"""
+        if service_time is not None:
+            self._service_time += _EWMA_ALPHA * (service_time - self._service_time)
+        while self._waiters:
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                # in_flight stays the same: the slot moves to the waiter
+                waiter.set_result(None)
+                self._update_gauges()
+                return
+        self.in_flight -= 1
+        self._update_gauges()
+
+    def stats(self) -> Dict[str, object]:
+        return {
+            "concurrency": self.concurrency,
+            "in_flight": self.in_flight,
+            "queued": self.queued,
+            "max_queue": self.max_queue,
+            "queue_timeout": self.queue_timeout,
+            "admitted": self.admitted,
+            "rejected": dict(self.rejected),
+            "avg_service_seconds": round(self._service_time, 3),
+        }
+
+
+class AdmissionController:
+    """Maps request paths to admission pools"""
+
+    def __init__(self, pools: Dict[str, AdmissionPool], routes: Dict[str, str], enabled: bool = True):
+        self.pools = pools
+        self.routes = routes
+        self.enabled = enabled
+
+    def pool_for(self, path: str) -> Optional[AdmissionPool]:
+        if not self.enabled:
+            return None
+        name = self.routes.get(path.rstrip("/") or "/")
+        return self.pools.get(name) if name else None
+
+    def stats(self) -> Dict[str, object]:
+        return {"enabled": self.enabled, "pools": {name: pool.stats() for name, pool in self.pools.items()}}
+
+
+def _default_controller() -> AdmissionController:
+    pools = {
+        # The image scheduler gives scene n the deadline start + (n-1) * 10s
+        # (IMAGE_SCHEDULER_SCENE_SLACK), so a quest needs 8 renders in ~70s
+        # (~7 Imagen RPM). Two pipelines (~14 RPM) plus four character renders
+        # (~15s each, ~16 RPM) fill the 30 RPM quota; a third pipeline would
+        # push scenes past their deadlines
+        "create_quest": AdmissionPool.from_env("create_quest", 2, 4, 30.0, initial_service_time=60.0),
+        "generate_character": AdmissionPool.from_env("generate_character", 4, 8, 15.0, initial_service_time=15.0),
+        # One to a few Imagen calls, rendered ahead of queued quest scenes
+        "regenerate_scenes": AdmissionPool.from_env("regenerate_scenes", 4, 8, 15.0, initial_service_time=12.0),
+        "cheap": AdmissionPool.from_env("cheap", 32, 64, 2.0, initial_service_time=1.0),
+    }
+    routes = {
+        "/create-quest": "create_quest",
+        "/generate-character": "generate_character",
+        "/regenerate-scenes": "regenerate_scenes",
+        "/text-to-speech": "cheap",
+        "/health": "cheap",
+    }
+    return AdmissionController(pools, routes, enabled=ADMISSION_ENABLED)
+
+
+admission = _default_controller()
+
+
+@asynccontextmanager
+async def admitted(path: str, controller: Optional[AdmissionController] = None) -> AsyncIterator[None]:
+    """
+    Holds an admission slot for `path` for the duration of the block
+
+    Raises:
+        AdmissionRejected: when the request is shed
+    """
+    pool = (controller or admission).pool_for(path)
+    if pool is None:
+        yield
+        return
+    await pool.acquire()
+    start = time.monotonic()
+    try:
+        yield
+    finally:
+        pool.release(time.monotonic() - start)
@@ -0,0 +1,500 @@
+"""
+Idempotency Keys
+Deduplicates retried POSTs to the expensive endpoints by Idempotency-Key header
+
+Clients that retry /generate-character or /create-quest after a timeout would
+otherwise start a second pipeline (and spend the Imagen quota twice). When a
+request carries an `Idempotency-Key` header:
+
+    first request           runs normally; a 2xx response is stored under the key
+    repeat, still running   attaches to the running execution and receives
+                            its response (same worker: immediately; another
+                            worker: by polling the shared store)
+    repeat, completed       replays the stored response without running anything
+
+Replayed responses carry `Idempotent-Replayed: true`. Non-2xx responses are
+not stored, so a retry after a failure runs again (and /create-quest resumes
+from its checkpoints, see pipeline/run_store.py).
+
+Each claim stores a fingerprint of the request: the SHA-256 of its method,
+query string and body (multipart boundaries, which clients pick at random
+per attempt, are left out). Reusing a key for a different request is
+rejected with 422 instead of replaying the first request's response.
+
+Keys are scoped per endpoint and client address, so clients cannot collide;
+IDEMPOTENCY_SCOPE=endpoint shares keys between clients. The address is the
+X-Forwarded-For hop appended by the trusted proxy (IDEMPOTENCY_TRUSTED_PROXIES
+counted from the right, since a client can put anything in the hops before
+it), or the peer address when the header has fewer hops or no proxy is trusted.
+Stored responses expire after IDEMPOTENCY_TTL seconds and at most
+IDEMPOTENCY_MAX_KEYS are kept (oldest first out). State lives in a SQLite
+file shared by every serve.py worker, falling back to a per-process store.
+
+Avoided duplicates are counted in storytopia_idempotency_duplicates_total and
+the model spend they would have repeated in
+storytopia_idempotency_saved_cost_usd_total.
+
+Environment:
+    IDEMPOTENCY_ENABLED   0 ignores Idempotency-Key headers
+    IDEMPOTENCY_SCOPE     client (default) | endpoint
+    IDEMPOTENCY_TRUSTED_PROXIES
+                          proxies in front of the service that append to
+                          X-Forwarded-For (default 1, 0 uses the peer address)
+    IDEMPOTENCY_TTL       seconds a completed response is replayed (default 86400)
+    IDEMPOTENCY_MAX_KEYS  stored responses kept (default 10000)
+    IDEMPOTENCY_WAIT      seconds a repeat waits for a running execution; claims
+                          older than this are considered abandoned (default 300)
+    IDEMPOTENCY_PATH      SQLite database (default <tmp>/storytopia-idempotency.sqlite3)
+"""
+
+import asyncio
+import hashlib
+import json
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import BinaryIO, Dict, List, Optional, Tuple
+
+import orjson
+from starlette.datastructures import Headers
+from starlette.types import ASGIApp, Receive, Scope, Send
+
+from observability import costs
+from observability.log import get_logger
+from observability.metrics import IDEMPOTENCY_DUPLICATES, IDEMPOTENCY_SAVED_COST
+
+logger = get_logger("idempotency")
+
+IDEMPOTENCY_ENABLED = os.getenv("IDEMPOTENCY_ENABLED", "1") != "0"
+IDEMPOTENCY_SCOPE = os.getenv("IDEMPOTENCY_SCOPE", "client").lower()
+IDEMPOTENCY_TRUSTED_PROXIES = int(os.getenv("IDEMPOTENCY_TRUSTED_PROXIES", "1"))
+IDEMPOTENCY_TTL = float(os.getenv("IDEMPOTENCY_TTL", "86400"))
+IDEMPOTENCY_MAX_KEYS = int(os.getenv("IDEMPOTENCY_MAX_KEYS", "10000"))
+IDEMPOTENCY_WAIT = float(os.getenv("IDEMPOTENCY_WAIT", "300"))
+
+IDEMPOTENT_PATHS = ("/generate-character", "/create-quest")
+MAX_KEY_LENGTH = 255
+
+# How often a repeat checks the shared store for another worker's result
+POLL_SECONDS = 0.5
+# Request bodies are buffered for fingerprinting; larger ones spill to a temp file
+BODY_SPOOL_BYTES = 1024 * 1024
+BODY_CHUNK_SIZE = 64 * 1024
+
+LEADER, PENDING, DONE, MISMATCH = "leader", "pending", "done", "mismatch"
+
+
+@dataclass
+class StoredResponse:
+    status: int
+    headers: List[Tuple[str, str]]
+    body: bytes
+    # Model spend of the execution, i.e. what each avoided duplicate saves
+    cost_usd: float = 0.0
+
+
+class IdempotencyStore:
+    """Claims and stored responses per scoped key; SQLite-backed, or in-memory when path is None"""
+
+    def __init__(
+        self,
+        path: Optional[str],
+        ttl: float = IDEMPOTENCY_TTL,
+        max_keys: int = IDEMPOTENCY_MAX_KEYS,
+        pending_timeout: float = IDEMPOTENCY_WAIT,
+    ):
+        self.path = path
+        self.ttl = ttl
+        self.max_keys = max_keys
+        self.pending_timeout = pending_timeout
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        # key -> (state, updated, fingerprint, response)
+        self._memory: "OrderedDict[str, Tuple[str, float, str, Optional[StoredResponse]]]" = OrderedDict()
+        if path is None:
+            return
+        if hasattr(os, "register_at_fork"):
+            # SQLite connections must not be shared with forked workers
+            os.register_at_fork(after_in_child=self._forget_connections)
+        with self._connect() as conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS responses ("
+                "key TEXT PRIMARY KEY, state TEXT NOT NULL, updated REAL NOT NULL, "
+                "status INTEGER, headers TEXT, body BLOB, cost REAL, fingerprint TEXT)"
+            )
+            columns = {row[1] for row in conn.execute("PRAGMA table_info(responses)")}
+            if "fingerprint" not in columns:
+                # Databases created before fingerprints were stored
+                conn.execute("ALTER TABLE responses ADD COLUMN fingerprint TEXT")
+            conn.execute("CREATE INDEX IF NOT EXISTS responses_updated ON responses (state, updated)")
+
+    def _forget_connections(self) -> None:
+        self._local = threading.local()
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30.0, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            self._local.conn = conn
+        return conn
+
+    def _live(self, state: str, updated: float, now: float) -> bool:
+        return updated >= now - (self.ttl if state == DONE else self.pending_timeout)
+
+    def claim(self, key: str, fingerprint: str) -> Tuple[str, Optional[StoredResponse]]:
+        """
+        Claims a key for execution of the request with the given fingerprint
+
+        Returns:
+            (LEADER, None): the caller runs the request and must complete() or release()
+            (PENDING, None): another execution of the same request holds the key
+            (DONE, response): the stored response of a completed execution
+            (MISMATCH, None): the key is held by a different request
+        """
+        now = time.time()
+        if self.path is None:
+            with self._lock:
+                entry = self._memory.get(key)
+                if entry is not None and self._live(entry[0], entry[1], now):
+                    if entry[2] != fingerprint:
+                        return MISMATCH, None
+                    return entry[0], entry[3]
+                self._memory[key] = (PENDING, now, fingerprint, None)
+                self._memory.move_to_end(key)
+                return LEADER, None
+
+        conn = self._connect()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = conn.execute(
+                "SELECT state, updated, status, headers, body, cost, fingerprint FROM responses WHERE key = ?", (key,)
+            ).fetchone()
+            if row is not None and self._live(row[0], row[1], now):
+                conn.execute("COMMIT")
+                if row[6] != fingerprint:
+                    return MISMATCH, None
+                if row[0] == PENDING:
+                    return PENDING, None
+                headers = [tuple(item) for item in json.loads(row[3])]
+                return DONE, StoredResponse(row[2], headers, row[4], row[5] or 0.0)
+            conn.execute(
+                "INSERT OR REPLACE INTO responses (key, state, updated, fingerprint) VALUES (?, ?, ?, ?)",
+                (key, PENDING, now, fingerprint),
+            )
+            conn.execute("COMMIT")
+            return LEADER, None
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+
+    def complete(self, key: str, fingerprint: str, response: StoredResponse) -> None:
+        """Stores the leader's response and evicts expired / surplus entries"""
+        now = time.time()
+        if self.path is None:
+            with self._lock:
+                self._memory[key] = (DONE, now, fingerprint, response)
+                self._memory.move_to_end(key)
+                while len(self._memory) > self.max_keys:
+                    self._memory.popitem(last=False)
+            return
+
+        conn = self._connect()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            conn.execute(
+                "INSERT OR REPLACE INTO responses (key, state, updated, status, headers, body, cost, fingerprint) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (
+                    key, DONE, now, response.status, json.dumps(response.headers), response.body,
+                    response.cost_usd, fingerprint,
+                ),
+            )
+            conn.execute("DELETE FROM responses WHERE state = ? AND updated < ?", (DONE, now - self.ttl))
+            conn.execute(
+                "DELETE FROM responses WHERE key IN ("
+                "SELECT key FROM responses WHERE state = ? ORDER BY updated DESC LIMIT -1 OFFSET ?)",
+                (DONE, self.max_keys),
+            )
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+
+    def release(self, key: str) -> None:
+        """Drops an unfinished claim so the next repeat runs again"""
+        if self.path is None:
+            with self._lock:
+                entry = self._memory.get(key)
+                if entry is not None and entry[0] == PENDING:
+                    del self._memory[key]
+            return
+        self._connect().execute("DELETE FROM responses WHERE key = ? AND state = ?", (key, PENDING))
+
+
+def _store_from_env() -> IdempotencyStore:
+    path = os.getenv("IDEMPOTENCY_PATH", os.path.join(tempfile.gettempdir(), "storytopia-idempotency.sqlite3"))
+    try:
+        return IdempotencyStore(path)
+    except sqlite3.Error as e:
+        logger.warning("Cannot open idempotency database %s (%s); keys are tracked per process", path, e)
+        return IdempotencyStore(None)
+
+
+idempotency_store = _store_from_env()
+
+
+def _client_address(scope: Scope) -> str:
+    if IDEMPOTENCY_TRUSTED_PROXIES > 0:
+        # Only the hops appended by our own proxies can be trusted; the leftmost ones come from the client
+        hops = [hop.strip() for hop in ",".join(Headers(scope=scope).getlist("x-forwarded-for")).split(",")]
+        hops = [hop for hop in hops if hop]
+        if len(hops) >= IDEMPOTENCY_TRUSTED_PROXIES:
+            return hops[-IDEMPOTENCY_TRUSTED_PROXIES]
+    client = scope.get("client")
+    return client[0] if client else ""
+
+
+def _multipart_boundary(scope: Scope) -> Optional[bytes]:
+    content_type = Headers(scope=scope).get("content-type", "")
+    if not content_type.lower().startswith("multipart/"):
+        return None
+    for param in content_type.split(";")[1:]:
+        name, _, value = param.strip().partition("=")
+        if name.lower() == "boundary" and value:
+            return value.strip('"').encode("latin-1")
+    return None
+
+
+class RequestFingerprint:
+    """
+    SHA-256 of a request's method, query string and body, fed chunk by chunk
+
+    The multipart boundary is removed from the body before hashing, so a retry
+    that rebuilt its form data (new random boundary) matches the first attempt.
+    """
+
+    def __init__(self, scope: Scope):
+        self._sha256 = hashlib.sha256()
+        self._sha256.update(scope["method"].encode() + b"\n" + scope.get("query_string", b"") + b"\n")
+        self._boundary = _multipart_boundary(scope)
+        # Tail kept back in case it starts a boundary completed by the next chunk
+        self._pending = b""
+
+    def update(self, chunk: bytes) -> None:
+        if not self._boundary:
+            self._sha256.update(chunk)
+            return
+        data = (self._pending + chunk).replace(self._boundary, b"")
+        keep = len(self._boundary) - 1
+        self._sha256.update(data[:len(data) - keep] if len(data) > keep else b"")
+        self._pending = data[len(data) - keep:] if len(data) > keep else data
+
+    def hexdigest(self) -> str:
+        if self._pending:
+            self._sha256.update(self._pending)
+            self._pending = b""
+        return self._sha256.hexdigest()
+
+
+async def _buffer_body(scope: Scope, receive: Receive) -> Optional[Tuple[BinaryIO, str]]:
+    """
+    Reads the whole request body into a spooled file while fingerprinting it
+
+    Returns:
+        (body file rewound to the start, fingerprint), or None if the client disconnected
+    """
+    fingerprint = RequestFingerprint(scope)
+    body = tempfile.SpooledTemporaryFile(max_size=BODY_SPOOL_BYTES)
+    while True:
+        message = await receive()
+        if message["type"] == "http.disconnect":
+            body.close()
+            return None
+        chunk = message.get("body", b"")
+        fingerprint.update(chunk)
+        body.write(chunk)
+        if not message.get("more_body", False):
+            break
+    body.seek(0)
+    return body, fingerprint.hexdigest()
+
+
+def _replay_body(body: BinaryIO, receive: Receive) -> Receive:
+    """A receive() that serves the buffered body, then defers to the client's (disconnects)"""
+    size = body.seek(0, os.SEEK_END)
+    body.seek(0)
+    sent = False
+
+    async def replay():
+        nonlocal sent
+        if sent:
+            return await receive()
+        chunk = body.read(BODY_CHUNK_SIZE)
+        more = body.tell() < size
+        sent = not more
+        return {"type": "http.request", "body": chunk, "more_body": more}
+
+    return replay
+
+
+async def _send_json(send: Send, status: int, content: dict, headers: Optional[List[Tuple[str, str]]] = None) -> None:
+    body = orjson.dumps(content)
+    raw = [(b"content-type", b"application/json"), (b"content-length", str(len(body)).encode())]
+    raw += [(name.encode("latin-1"), value.encode("latin-1")) for name, value in headers or []]
+    await send({"type": "http.response.start", "status": status, "headers": raw})
+    await send({"type": "http.response.body", "body": body})
+
+
+class IdempotencyMiddleware:
+    """
+    Applies Idempotency-Key semantics to POSTs on `paths`
+
+    Sits inside the request-context middleware (so replays still get their
+    own X-Request-ID) and outside admission control, so repeats that attach
+    or replay never take an admission slot.
+    """
+
+    def __init__(
+        self,
+        app: ASGIApp,
+        paths: Tuple[str, ...] = IDEMPOTENT_PATHS,
+        store: Optional[IdempotencyStore] = None,
+        scope: str = IDEMPOTENCY_SCOPE,
+        wait: float = IDEMPOTENCY_WAIT,
+        enabled: bool = IDEMPOTENCY_ENABLED,
+    ):
+        self.app = app
+        self.paths = paths
+        self.store = store or idempotency_store
+        self.scope = scope
+        self.wait = wait
+        self.enabled = enabled
+        # Executions led by this worker, with their request fingerprints;
+        # repeats in the same worker await these directly
+        self._inflight: Dict[str, Tuple[asyncio.Future, str]] = {}
+
+    def scoped_key(self, scope: Scope, key: str) -> str:
+        parts = [scope["path"], key]
+        if self.scope != "endpoint":
+            parts.append(_client_address(scope))
+        return hashlib.sha256("\n".join(parts).encode()).hexdigest()
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if (
+            not self.enabled
+            or scope["type"] != "http"
+            or scope["method"] != "POST"
+            or scope["path"] not in self.paths
+        ):
+            await self.app(scope, receive, send)
+            return
+        key = Headers(scope=scope).get("idempotency-key")
+        if not key:
+            await self.app(scope, receive, send)
+            return
+        if len(key) > MAX_KEY_LENGTH:
+            await _send_json(send, 400, {"detail": f"Idempotency-Key must be at most {MAX_KEY_LENGTH} characters"})
+            return
+
+        buffered = await _buffer_body(scope, receive)
+        if buffered is None:
+            return
+        body, fingerprint = buffered
+        try:
+            await self._handle(scope, _replay_body(body, receive), send, self.scoped_key(scope, key), fingerprint)
+        finally:
+            body.close()
+
+    async def _handle(self, scope: Scope, receive: Receive, send: Send, store_key: str, fingerprint: str) -> None:
+        path = scope["path"]
+        deadline = time.monotonic() + self.wait
+        while True:
+            inflight = self._inflight.get(store_key)
+            if inflight is not None:
+                future, inflight_fingerprint = inflight
+                if inflight_fingerprint != fingerprint:
+                    await self._reject_mismatch(send, path)
+                    return
+                # Shielded: a repeat that disconnects must not cancel the execution it attached to
+                response = await asyncio.shield(future)
+                if response is not None:
+                    await self._replay(send, path, response, outcome="attached")
+                    return
+                # The execution failed without a response: claim the key again
+                continue
+
+            state, stored = await asyncio.to_thread(self.store.claim, store_key, fingerprint)
+            if state == MISMATCH:
+                await self._reject_mismatch(send, path)
+                return
+            if state == DONE:
+                await self._replay(send, path, stored, outcome="replayed")
+                return
+            if state == LEADER:
+                await self._lead(scope, receive, send, store_key, fingerprint)
+                return
+            if time.monotonic() > deadline:
+                await _send_json(
+                    send, 409, {"detail": "A request with this Idempotency-Key is still in progress"},
+                    headers=[("retry-after", "5")],
+                )
+                return
+            await asyncio.sleep(POLL_SECONDS)
+
+    async def _lead(self, scope: Scope, receive: Receive, send: Send, store_key: str, fingerprint: str) -> None:
+        future = asyncio.get_running_loop().create_future()
+        self._inflight[store_key] = (future, fingerprint)
+        status: Optional[int] = None
+        headers: List[Tuple[str, str]] = []
+        chunks: List[bytes] = []
+
+        async def capture(message) -> None:
+            nonlocal status
+            if message["type"] == "http.response.start":
+                # Copied now: the outer middlewares add their own headers to the same list
+                status = message["status"]
+                headers.extend((name.decode("latin-1"), value.decode("latin-1")) for name, value in message["headers"])
+            elif message["type"] == "http.response.body":
+                chunks.append(message.get("body", b""))
+            await send(message)
+
+        response = None
+        try:
+            await self.app(scope, receive, capture)
+            if status is not None:
+                ledger = costs.ledger_var.get()
+                response = StoredResponse(
+                    status=status,
+                    headers=headers,
+                    body=b"".join(chunks),
+                    cost_usd=ledger.total() if ledger is not None else 0.0,
+                )
+        finally:
+            del self._inflight[store_key]
+            future.set_result(response)
+            try:
+                if response is not None and 200 <= response.status < 300:
+                    await asyncio.to_thread(self.store.complete, store_key, fingerprint, response)
+                else:
+                    await asyncio.to_thread(self.store.release, store_key)
+            except Exception:
+                logger.exception("Could not record idempotent response for %s", scope["path"])
+
+    async def _reject_mismatch(self, send: Send, path: str) -> None:
+        IDEMPOTENCY_DUPLICATES.inc(path=path, outcome="mismatch")
+        logger.warning("Idempotency-Key reused with a different request for %s", path)
+        await _send_json(send, 422, {"detail": "Idempotency-Key was already used for a different request"})
+
+    async def _replay(self, send: Send, path: str, response: StoredResponse, outcome: str) -> None:
+        IDEMPOTENCY_DUPLICATES.inc(path=path, outcome=outcome)
+        IDEMPOTENCY_SAVED_COST.inc(response.cost_usd, path=path)
+        logger.info("Idempotent %s response for %s (saved ~$%.4f)", outcome, path, response.cost_usd)
+        headers = [(name.encode("latin-1"), value.encode("latin-1")) for name, value in response.headers]
+        headers.append((b"idempotent-replayed", b"true"))
+        await send({"type": "http.response.start", "status": response.status, "headers": headers})
+        await send({"type": "http.response.body", "body": response.body})
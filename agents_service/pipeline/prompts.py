@@ -0,0 +1,253 @@
+"""
+Prompt Builder
+De-duplicated, budgeted prompt assembly with per-stage size reporting
+
+Prompts are assembled from segments. The builder
+- drops sentences that already appeared earlier in the prompt (the character
+  description used to reach Imagen up to three times per scene: inside the
+  Quest-Creator's image_prompt, as a "consistency note" and as "Include this
+  character"),
+- keeps each stage within its budget: optional segments are dropped, least
+  important first, then truncatable segments are cut at a sentence boundary.
+  Prompts that still do not fit are sent unchanged and counted as over_budget,
+- records the estimated size of every prompt per stage
+  (storytopia_prompt_tokens) and what it removed (storytopia_prompt_trimmed_total).
+
+Token counts are estimated at 4 characters per token; Imagen 3 accepts up to
+480 prompt tokens. judge_quest() / judge_analysis() trim the AgentOps payloads
+to the fields each judge scores.
+
+Environment:
+    PROMPT_IMAGEN_MAX_TOKENS  Imagen prompt budget (default 480)
+    PROMPT_JUDGE_MAX_TOKENS   AgentOps prompt budget (default 4096)
+    PROMPT_QUEST_MAX_TOKENS   Quest-Creator / Quest-Specializer prompt budget (default 16384)
+"""
+
+import json
+import math
+import os
+import re
+from dataclasses import dataclass, replace
+from typing import Any, Dict, List, Optional
+
+from observability.log import get_logger
+from observability.metrics import PROMPT_TOKENS, PROMPT_TRIMMED
+
+logger = get_logger("prompts")
+
+CHARS_PER_TOKEN = 4
+
+# Sentences shorter than this are only removed on an exact repeat, never as a substring
+MIN_SUBSTRING_CHARS = 24
+
+IMAGEN_MAX_TOKENS = int(os.getenv("PROMPT_IMAGEN_MAX_TOKENS", "480"))
+JUDGE_MAX_TOKENS = int(os.getenv("PROMPT_JUDGE_MAX_TOKENS", "4096"))
+QUEST_MAX_TOKENS = int(os.getenv("PROMPT_QUEST_MAX_TOKENS", "16384"))
+
+STAGE_BUDGETS: Dict[str, int] = {
+    "imagen_scene": IMAGEN_MAX_TOKENS,
+    "imagen_character": IMAGEN_MAX_TOKENS,
+    "agent_ops": JUDGE_MAX_TOKENS,
+    "agent_ops_quest": JUDGE_MAX_TOKENS,
+    "quest_creator": QUEST_MAX_TOKENS,
+    "quest_specializer": QUEST_MAX_TOKENS,
+}
+
+_SENTENCE_END = re.compile(r"(?<=[.!?])\s+")
+
+
+def estimate_tokens(text: str) -> int:
+    return math.ceil(len(text) / CHARS_PER_TOKEN)
+
+
+def compact_json(value: Any) -> str:
+    """JSON without indentation or spaces after separators (indentation alone is ~30% of a quest)"""
+    return json.dumps(value, separators=(",", ":"), ensure_ascii=False)
+
+
+def _normalize(text: str) -> str:
+    return re.sub(r"\s+", " ", text).strip().lower().rstrip(".!?,;: ")
+
+
+@dataclass
+class Segment:
+    text: str
+    prefix: str = ""
+    # Lower is more important; ties keep the order segments were added in
+    priority: int = 0
+    optional: bool = False
+    truncatable: bool = False
+    dedupe: bool = True
+
+    def render(self) -> str:
+        return f"{self.prefix}{self.text}"
+
+
+class PromptBuilder:
+    """Assembles one prompt for a stage; see the module docstring for the rules"""
+
+    def __init__(self, stage: str, max_tokens: Optional[int] = None, separator: str = "\n\n"):
+        self.stage = stage
+        self.max_chars = (max_tokens or STAGE_BUDGETS.get(stage, QUEST_MAX_TOKENS)) * CHARS_PER_TOKEN
+        self.separator = separator
+        self.segments: List[Segment] = []
+
+    def add(
+        self,
+        text: str,
+        prefix: str = "",
+        priority: int = 0,
+        optional: bool = False,
+        truncatable: bool = False,
+        dedupe: bool = True,
+    ) -> "PromptBuilder":
+        """
+        Appends a segment
+
+        Args:
+            text: Segment text; with dedupe, whitespace is normalized per line
+            prefix: Label emitted before the text, only if some text survives de-duplication
+            priority: Budget order, lower is more important
+            optional: May be dropped entirely to meet the budget
+            truncatable: May be cut at a sentence boundary to meet the budget
+            dedupe: Remove sentences already present earlier (disable for JSON and code)
+        """
+        if text and text.strip():
+            self.segments.append(Segment(text.strip(), prefix, priority, optional, truncatable, dedupe))
+        return self
+
+    def _deduplicate(self) -> List[Segment]:
+        seen: List[str] = []
+        kept = []
+        for segment in self.segments:
+            if not segment.dedupe:
+                seen.append(_normalize(segment.text))
+                kept.append(replace(segment))
+                continue
+            lines, removed = [], 0
+            for line in segment.text.splitlines():
+                sentences = []
+                for sentence in _SENTENCE_END.split(line.strip()):
+                    normalized = _normalize(sentence)
+                    if not normalized:
+                        continue
+                    earlier = " ".join(seen)
+                    repeated = normalized in seen or (len(normalized) >= MIN_SUBSTRING_CHARS and normalized in earlier)
+                    if repeated:
+                        removed += 1
+                        continue
+                    seen.append(normalized)
+                    sentences.append(re.sub(r"\s+", " ", sentence).strip())
+                if sentences or not line.strip():
+                    lines.append(" ".join(sentences))
+            text = re.sub(r"\n{3,}", "\n\n", "\n".join(lines)).strip()
+            if removed:
+                PROMPT_TRIMMED.inc(removed, stage=self.stage, action="deduplicated")
+            if text:
+                kept.append(replace(segment, text=text))
+        return kept
+
+    def _length(self, segments: List[Segment]) -> int:
+        return len(self.separator.join(segment.render() for segment in segments))
+
+    def build(self) -> str:
+        """Returns the assembled prompt and records its size"""
+        segments = self._deduplicate()
+        # Least important first; later-added segments lose ties
+        by_importance = sorted(range(len(segments)), key=lambda i: (segments[i].priority, i), reverse=True)
+
+        for i in by_importance:
+            if self._length([s for s in segments if s is not None]) <= self.max_chars:
+                break
+            if segments[i].optional:
+                segments[i] = None
+                PROMPT_TRIMMED.inc(stage=self.stage, action="dropped")
+        segments = [s for s in segments if s is not None]
+
+        by_importance = sorted(range(len(segments)), key=lambda i: (segments[i].priority, i), reverse=True)
+        for i in by_importance:
+            excess = self._length(segments) - self.max_chars
+            if excess <= 0:
+                break
+            segment = segments[i]
+            if not segment.truncatable:
+                continue
+            segment.text = _truncate(segment.text, len(segment.text) - excess)
+            PROMPT_TRIMMED.inc(stage=self.stage, action="truncated")
+        segments = [s for s in segments if s.text]
+
+        prompt = self.separator.join(segment.render() for segment in segments)
+        tokens = estimate_tokens(prompt)
+        PROMPT_TOKENS.observe(tokens, stage=self.stage)
+        if len(prompt) > self.max_chars:
+            PROMPT_TRIMMED.inc(stage=self.stage, action="over_budget")
+            logger.warning("%s prompt is ~%d tokens, over its %d token budget", self.stage, tokens, self.max_chars // CHARS_PER_TOKEN)
+        return prompt
+
+
+def _truncate(text: str, max_chars: int) -> str:
+    """Cuts at the last sentence end (or else the last word) that fits"""
+    if max_chars <= 0:
+        return ""
+    if len(text) <= max_chars:
+        return text
+    head = text[:max_chars]
+    cut = max(head.rfind(". "), head.rfind("! "), head.rfind("? "), head.rfind("\n"))
+    if cut > 0:
+        return head[:cut + 1].rstrip()
+    return head.rsplit(" ", 1)[0].rstrip()
+
+
+# ---------------------------------------------------------------------------
+# Imagen prompts
+# ---------------------------------------------------------------------------
+
+CONSISTENCY_RULES = """CRITICAL CHARACTER CONSISTENCY REQUIREMENTS:
+- The character MUST maintain EXACT visual consistency with the description
+- Keep the SAME colors, proportions, features, and style as described
+- The character should be instantly recognizable as the same character
+- Do NOT change, morph, or alter the character's appearance
+- Maintain consistent: body shape, facial features, color palette, clothing/markings
+- Follow the character description PRECISELY without deviation"""
+
+
+def scene_prompt(image_prompt: str, character_description: Optional[str] = None, enforce_consistency: bool = False) -> str:
+    """
+    Imagen prompt for one scene
+
+    Description sentences already in the Quest-Creator's image_prompt are not
+    repeated; the consistency rules are the first thing dropped for the budget.
+    """
+    builder = PromptBuilder("imagen_scene")
+    builder.add(image_prompt, truncatable=True)
+    if character_description:
+        builder.add(character_description, prefix="Include this character: ", priority=1, truncatable=True)
+        if enforce_consistency:
+            builder.add(CONSISTENCY_RULES, priority=2, optional=True)
+    return builder.build()
+
+
+# ---------------------------------------------------------------------------
+# AgentOps judge payloads
+# ---------------------------------------------------------------------------
+
+# Scored by the lesson-alignment judge; image prompts, URIs and srcsets are not
+JUDGE_QUEST_FIELDS = ("quest_title", "lesson", "character_name")
+JUDGE_SCENE_FIELDS = ("scene_number", "scenario", "question", "option_a", "option_b")
+
+# Compared with the character description by the creative-intent judge; the
+# description itself is its own (truncatable) prompt segment, so it is not repeated here
+JUDGE_ANALYSIS_FIELDS = ("character_type", "colors_used", "artistic_style", "mood", "details")
+
+
+def judge_quest(quest_data: Dict[str, Any]) -> Dict[str, Any]:
+    payload = {key: quest_data[key] for key in JUDGE_QUEST_FIELDS if key in quest_data}
+    payload["scenes"] = [
+        {key: scene[key] for key in JUDGE_SCENE_FIELDS if key in scene}
+        for scene in quest_data.get("scenes", [])
+    ]
+    return payload
+
+
+def judge_analysis(analysis: Dict[str, Any]) -> Dict[str, Any]:
+    return {key: analysis[key] for key in JUDGE_ANALYSIS_FIELDS if analysis.get(key)}
@@ -0,0 +1,313 @@
+"""
+Quota Coordinator
+Shared token buckets for the Imagen / Gemini per-model quotas
+
+Every uvicorn worker (and, with the HTTP backend, every instance) consults the
+same buckets before calling a model, so the 30 RPM Imagen quota holds for the
+whole deployment instead of per process. A caller reserves its token in one
+atomic step: the bucket may go negative, and the deficit divided by the rate is
+how long the caller sleeps before its slot. Later reservations queue behind
+earlier ones, so callers are served first-come first-served without polling.
+A slot further than QUOTA_MAX_WAIT away is not reserved; the caller gets
+QuotaTimeout (HTTP 429 with Retry-After) instead of an unbounded wait.
+
+Backends:
+    memory   single process (tests, local runs)
+    sqlite   all workers on one host; state lives in a SQLite file whose
+             write lock serializes updates across processes (default)
+    http     several hosts; talks to `python -m pipeline.quota_server`
+
+The backend is created on first use, not at import.
+
+Environment:
+    QUOTA_BACKEND        memory | sqlite | http | off (default sqlite)
+    QUOTA_SQLITE_PATH    bucket database (default <tmp>/storytopia-quota.sqlite3)
+    QUOTA_SERVER_URL     base URL of the quota server (http backend)
+    QUOTA_IMAGEN_RPM     Imagen requests per minute (default 30)
+    QUOTA_GEMINI_RPM     Gemini requests per minute (default 60)
+    QUOTA_GEMINI_LITE_RPM  Gemini Flash-Lite requests per minute (default 120)
+    QUOTA_BURST          bucket capacity in requests (default 2)
+    QUOTA_MAX_WAIT       longest wait for a slot before QuotaTimeout is raised (default 120)
+"""
+
+import asyncio
+import math
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+from dataclasses import dataclass
+from typing import Callable, Dict, Optional, Tuple
+
+import requests
+
+from observability.log import get_logger
+from observability.metrics import record_stage
+
+logger = get_logger("quota")
+
+IMAGEN_MODEL = "imagen-3.0-generate-001"
+GEMINI_MODEL = "gemini-2.0-flash-exp"
+GEMINI_LITE_MODEL = "gemini-2.0-flash-lite"
+
+
+@dataclass
+class BucketConfig:
+    rate: float       # tokens per second
+    capacity: float   # burst size
+
+    @classmethod
+    def per_minute(cls, rpm: float, burst: float) -> "BucketConfig":
+        return cls(rate=rpm / 60.0, capacity=burst)
+
+
+class QuotaTimeout(Exception):
+    """A caller's slot was more than QUOTA_MAX_WAIT away; carries a Retry-After hint"""
+
+    def __init__(self, model: str, wait: float, retry_after: int):
+        super().__init__(f"{model} quota slot is {wait:.1f}s away")
+        self.model = model
+        self.wait = wait
+        self.retry_after = retry_after
+
+
+# ---------------------------------------------------------------------------
+# Backends
+# ---------------------------------------------------------------------------
+
+class QuotaBackend:
+    """
+    Atomic token-bucket reservations
+
+    reserve returns the seconds until the caller's slot (0 when a token was
+    available). The tokens are taken only when that wait is at most
+    `max_wait`; otherwise the bucket is left unchanged.
+    """
+
+    def reserve(self, bucket: str, tokens: float, rate: float, capacity: float, max_wait: float) -> float:
+        raise NotImplementedError
+
+
+def _refill(tokens: float, updated: float, now: float, rate: float, capacity: float) -> float:
+    return min(capacity, tokens + max(0.0, now - updated) * rate)
+
+
+def _reserve(
+    available: float, updated: float, now: float, tokens: float, rate: float, capacity: float, max_wait: float
+) -> Tuple[float, float]:
+    """(wait, tokens left in the bucket) for one reservation; the bucket goes negative for future slots"""
+    available = _refill(available, updated, now, rate, capacity)
+    wait = max(0.0, (tokens - available) / rate)
+    if wait <= max_wait:
+        available -= tokens
+    return wait, available
+
+
+class MemoryBackend(QuotaBackend):
+    """Process-local buckets"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        # bucket -> (tokens, updated)
+        self._buckets: Dict[str, Tuple[float, float]] = {}
+
+    def reserve(self, bucket: str, tokens: float, rate: float, capacity: float, max_wait: float) -> float:
+        with self._lock:
+            now = time.time()
+            available, updated = self._buckets.get(bucket, (capacity, now))
+            wait, available = _reserve(available, updated, now, tokens, rate, capacity, max_wait)
+            self._buckets[bucket] = (available, now)
+            return wait
+
+
+class SQLiteBackend(QuotaBackend):
+    """Host-wide buckets in a SQLite file; BEGIN IMMEDIATE serializes all workers"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._local = threading.local()
+        if hasattr(os, "register_at_fork"):
+            # SQLite connections must not be shared with forked workers
+            os.register_at_fork(after_in_child=self._forget_connections)
+        with self._connect() as conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS buckets (name TEXT PRIMARY KEY, tokens REAL NOT NULL, updated REAL NOT NULL)"
+            )
+
+    def _forget_connections(self) -> None:
+        self._local = threading.local()
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30.0, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            self._local.conn = conn
+        return conn
+
+    def reserve(self, bucket: str, tokens: float, rate: float, capacity: float, max_wait: float) -> float:
+        conn = self._connect()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            now = time.time()
+            row = conn.execute("SELECT tokens, updated FROM buckets WHERE name = ?", (bucket,)).fetchone()
+            wait, available = _reserve(*(row or (capacity, now)), now, tokens, rate, capacity, max_wait)
+            conn.execute("INSERT OR REPLACE INTO buckets (name, tokens, updated) VALUES (?, ?, ?)",
+                         (bucket, available, now))
+            conn.execute("COMMIT")
+            return wait
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+
+
+class HTTPBackend(QuotaBackend):
+    """Client for pipeline.quota_server (one shared coordinator for several hosts)"""
+
+    def __init__(self, base_url: str, timeout: float = 5.0):
+        self.base_url = base_url.rstrip("/")
+        self.timeout = timeout
+        self._session = requests.Session()
+        if hasattr(os, "register_at_fork"):
+            # Pooled keep-alive connections must not be shared with forked workers
+            os.register_at_fork(after_in_child=self._new_session)
+
+    def _new_session(self) -> None:
+        self._session = requests.Session()
+
+    def _post(self, path: str, payload: dict) -> dict:
+        response = self._session.post(f"{self.base_url}{path}", json=payload, timeout=self.timeout)
+        response.raise_for_status()
+        return response.json()
+
+    def reserve(self, bucket: str, tokens: float, rate: float, capacity: float, max_wait: float) -> float:
+        return self._post("/reserve", {
+            "bucket": bucket, "tokens": tokens, "rate": rate, "capacity": capacity, "max_wait": max_wait,
+        })["wait"]
+
+
+# ---------------------------------------------------------------------------
+# Coordinator
+# ---------------------------------------------------------------------------
+
+class QuotaCoordinator:
+    """Blocks callers until their model's reserved slot"""
+
+    def __init__(
+        self,
+        backend: Optional[QuotaBackend],
+        buckets: Dict[str, BucketConfig],
+        max_wait: float = 120.0,
+        backend_factory: Optional[Callable[[], Optional[QuotaBackend]]] = None,
+    ):
+        self._backend = backend
+        self._backend_factory = backend_factory
+        self._lock = threading.Lock()
+        self.buckets = buckets
+        self.max_wait = max_wait
+
+    @property
+    def backend(self) -> Optional[QuotaBackend]:
+        """The bucket backend, created by backend_factory on first use"""
+        if self._backend_factory is not None:
+            with self._lock:
+                if self._backend_factory is not None:
+                    self._backend = self._backend_factory()
+                    self._backend_factory = None
+        return self._backend
+
+    @backend.setter
+    def backend(self, backend: Optional[QuotaBackend]) -> None:
+        with self._lock:
+            self._backend = backend
+            self._backend_factory = None
+
+    @property
+    def enabled(self) -> bool:
+        return self.backend is not None
+
+    def acquire(self, model: str, tokens: float = 1.0) -> float:
+        """
+        Reserves `tokens` from the model's bucket and sleeps until the slot (blocking; call from a worker thread)
+
+        A coordinator outage fails open: the call proceeds and a warning is logged,
+        so a broken quota backend degrades to the old per-process behavior.
+
+        Returns:
+            Seconds spent waiting
+
+        Raises:
+            QuotaTimeout: when the slot is more than max_wait seconds away
+        """
+        config = self.buckets.get(model)
+        backend = self.backend
+        if backend is None or config is None:
+            return 0.0
+
+        try:
+            wait = backend.reserve(model, tokens, config.rate, config.capacity, self.max_wait)
+        except Exception as e:
+            logger.warning("Quota backend unavailable, proceeding without coordination: %s", e)
+            return 0.0
+
+        if wait > self.max_wait:
+            retry_after = max(1, math.ceil(wait - self.max_wait))
+            logger.warning("%s quota slot is %.1fs away (limit %.0fs), refusing", model, wait, self.max_wait)
+            raise QuotaTimeout(model, wait, retry_after)
+        if wait > 0:
+            logger.debug("Waiting %.2fs for %s quota", wait, model)
+            time.sleep(wait)
+        record_stage("quota_wait", wait)
+        return wait
+
+    def stats(self) -> Dict[str, object]:
+        backend = self.backend
+        return {
+            "backend": type(backend).__name__ if backend else "off",
+            "buckets": {name: {"rpm": round(c.rate * 60, 2), "burst": c.capacity} for name, c in self.buckets.items()},
+        }
+
+
+def _backend_from_env() -> Optional[QuotaBackend]:
+    kind = os.getenv("QUOTA_BACKEND", "sqlite").lower()
+    if kind == "off":
+        return None
+    if kind == "memory":
+        return MemoryBackend()
+    if kind == "http":
+        return HTTPBackend(os.getenv("QUOTA_SERVER_URL", "http://127.0.0.1:8790"))
+    if kind == "sqlite":
+        path = os.getenv("QUOTA_SQLITE_PATH", os.path.join(tempfile.gettempdir(), "storytopia-quota.sqlite3"))
+        try:
+            return SQLiteBackend(path)
+        except sqlite3.Error as e:
+            logger.warning("Cannot open quota database %s (%s); using per-process buckets", path, e)
+            return MemoryBackend()
+    raise ValueError(f"Unknown QUOTA_BACKEND {kind!r}")
+
+
+def _default_buckets() -> Dict[str, BucketConfig]:
+    burst = float(os.getenv("QUOTA_BURST", "2"))
+    return {
+        IMAGEN_MODEL: BucketConfig.per_minute(float(os.getenv("QUOTA_IMAGEN_RPM", "30")), burst),
+        GEMINI_MODEL: BucketConfig.per_minute(float(os.getenv("QUOTA_GEMINI_RPM", "60")), burst),
+        GEMINI_LITE_MODEL: BucketConfig.per_minute(float(os.getenv("QUOTA_GEMINI_LITE_RPM", "120")), burst),
+    }
+
+
+quota = QuotaCoordinator(
+    None, _default_buckets(), float(os.getenv("QUOTA_MAX_WAIT", "120")), backend_factory=_backend_from_env
+)
+
+
+async def acquire_model_quota(callback_context, llm_request) -> None:
+    """
+    ADK before_model_callback: waits for a Gemini token before each agent LLM call
+
+    Returning None lets the model call proceed.
+    """
+    model = getattr(llm_request, "model", None) or GEMINI_MODEL
+    if quota.enabled and model in quota.buckets:
+        await asyncio.to_thread(quota.acquire, model)
+    return None
@@ -0,0 +1,72 @@
+"""
+Quota Server
+Stand-in HTTP coordinator for sharing the model quotas across hosts
+
+Wraps a SQLiteBackend behind the JSON endpoint used by HTTPBackend:
+
+    POST /reserve  {"bucket", "tokens", "rate", "capacity", "max_wait"} -> {"wait"}
+
+Intended for local multi-host testing; a production deployment would put the
+same backend interface in front of a shared store (e.g. Redis).
+
+Usage:
+    python -m pipeline.quota_server --port 8790 --db /tmp/storytopia-quota.sqlite3
+    QUOTA_BACKEND=http QUOTA_SERVER_URL=http://127.0.0.1:8790 uvicorn main:app
+"""
+
+import argparse
+import json
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from observability.log import get_logger
+from pipeline.quota import SQLiteBackend
+
+logger = get_logger("quota_server")
+
+
+def make_handler(backend: SQLiteBackend):
+    class QuotaHandler(BaseHTTPRequestHandler):
+        def do_POST(self):
+            try:
+                length = int(self.headers.get("Content-Length", 0))
+                body = json.loads(self.rfile.read(length) or b"{}")
+                if self.path == "/reserve":
+                    result = {"wait": backend.reserve(
+                        body["bucket"], float(body["tokens"]), float(body["rate"]),
+                        float(body["capacity"]), float(body["max_wait"]),
+                    )}
+                else:
+                    self._reply(404, {"error": f"unknown path {self.path}"})
+                    return
+            except (KeyError, ValueError) as e:
+                self._reply(400, {"error": str(e)})
+                return
+            self._reply(200, result)
+
+        def _reply(self, status: int, payload: dict) -> None:
+            data = json.dumps(payload).encode()
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def log_message(self, format, *args):
+            logger.debug(format, *args)
+
+    return QuotaHandler
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Storytopia shared quota server")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8790)
+    parser.add_argument("--db", default="storytopia-quota.sqlite3", help="SQLite file holding the buckets")
+    args = parser.parse_args()
+
+    server = ThreadingHTTPServer((args.host, args.port), make_handler(SQLiteBackend(args.db)))
+    logger.info("Quota server listening on http://%s:%d (db=%s)", args.host, args.port, args.db)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
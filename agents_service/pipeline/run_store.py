@@ -0,0 +1,203 @@
+"""
+Run Store
+Pipeline results kept per run ID, shared by every worker on the host
+
+/create-quest checkpoints the output of each pipeline stage under its run ID
+(which is also the quest_id it returns):
+
+    quest_text    validated quest JSON from the Quest-Creator / Specializer
+    scene_<n>     each successfully rendered scene image, as it completes
+    quest         the quest with images merged in (scene prompts, character
+                  description); /regenerate-scenes re-renders failed scenes
+                  from it
+    evaluations   consistency / lesson-alignment results, once emitted
+
+A retried request with the same run_id resumes after the last completed
+stage, so a failure late in the pipeline costs seconds instead of a full
+regeneration. Entries are keyed by (run_id, stage) and expire after
+RUN_STORE_TTL seconds.
+
+State lives in a SQLite file so every serve.py worker sees the same runs.
+If the file cannot be opened the store falls back to a per-process dict.
+
+Environment:
+    RUN_STORE_PATH  SQLite database (default <tmp>/storytopia-runs.sqlite3)
+    RUN_STORE_TTL   seconds a stored run is kept (default 86400)
+"""
+
+import json
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+from typing import Any, Callable, Dict, Optional, Tuple
+
+from observability.log import get_logger
+
+logger = get_logger("run_store")
+
+RUN_STORE_TTL = float(os.getenv("RUN_STORE_TTL", "86400"))
+
+# Expired rows are deleted on every Nth save
+_PURGE_EVERY = 100
+
+
+def _encode(payload: Dict[str, Any]) -> str:
+    return json.dumps(payload, separators=(",", ":"), ensure_ascii=False)
+
+
+class RunStore:
+    """(run_id, stage) -> JSON payload with a TTL; SQLite-backed, or in-memory when path is None"""
+
+    def __init__(self, path: Optional[str], ttl: float = RUN_STORE_TTL):
+        self.path = path
+        self.ttl = ttl
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._memory: Dict[Tuple[str, str], Tuple[float, str]] = {}
+        self._saves = 0
+        if path is None:
+            return
+        if hasattr(os, "register_at_fork"):
+            # SQLite connections must not be shared with forked workers
+            os.register_at_fork(after_in_child=self._forget_connections)
+        with self._connect() as conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS runs ("
+                "run_id TEXT NOT NULL, stage TEXT NOT NULL, payload TEXT NOT NULL, updated REAL NOT NULL, "
+                "PRIMARY KEY (run_id, stage))"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS runs_updated ON runs (updated)")
+
+    def _forget_connections(self) -> None:
+        self._local = threading.local()
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30.0, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            self._local.conn = conn
+        return conn
+
+    def save(self, run_id: str, stage: str, payload: Dict[str, Any]) -> None:
+        """Stores (or replaces) a stage's payload; it expires `ttl` seconds from now"""
+        data = _encode(payload)
+        now = time.time()
+        with self._lock:
+            self._saves += 1
+            purge = self._saves % _PURGE_EVERY == 0
+            if self.path is None:
+                self._memory[(run_id, stage)] = (now, data)
+        if self.path is not None:
+            self._connect().execute(
+                "INSERT OR REPLACE INTO runs (run_id, stage, payload, updated) VALUES (?, ?, ?, ?)",
+                (run_id, stage, data, now),
+            )
+        if purge:
+            self.purge()
+
+    def update(
+        self,
+        run_id: str,
+        stage: str,
+        apply: Callable[[Dict[str, Any]], Optional[Dict[str, Any]]],
+    ) -> Optional[Dict[str, Any]]:
+        """
+        Read-modify-write of a stored stage, atomic across threads and workers
+
+        `apply` receives the current (unexpired) payload and returns the new one,
+        or None to leave it unchanged. Nothing is written when the stage is
+        missing or expired.
+
+        Returns:
+            The payload now stored, or None when the stage is missing or expired
+        """
+        cutoff = time.time() - self.ttl
+        if self.path is None:
+            with self._lock:
+                row = self._memory.get((run_id, stage))
+                if row is None or row[0] < cutoff:
+                    return None
+                current = json.loads(row[1])
+                payload = apply(current)
+                if payload is None:
+                    return current
+                self._memory[(run_id, stage)] = (time.time(), _encode(payload))
+                return payload
+
+        conn = self._connect()
+        # BEGIN IMMEDIATE takes the write lock before reading, so concurrent updates serialize
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = conn.execute(
+                "SELECT updated, payload FROM runs WHERE run_id = ? AND stage = ?", (run_id, stage)
+            ).fetchone()
+            if row is None or row[0] < cutoff:
+                conn.execute("COMMIT")
+                return None
+            current = json.loads(row[1])
+            payload = apply(current)
+            if payload is not None:
+                conn.execute(
+                    "UPDATE runs SET payload = ?, updated = ? WHERE run_id = ? AND stage = ?",
+                    (_encode(payload), time.time(), run_id, stage),
+                )
+            conn.execute("COMMIT")
+            return current if payload is None else payload
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+
+    def load(self, run_id: str, stage: str) -> Optional[Dict[str, Any]]:
+        """A stage's payload, or None if it was never stored or has expired"""
+        cutoff = time.time() - self.ttl
+        if self.path is None:
+            with self._lock:
+                row = self._memory.get((run_id, stage))
+        else:
+            row = self._connect().execute(
+                "SELECT updated, payload FROM runs WHERE run_id = ? AND stage = ?", (run_id, stage)
+            ).fetchone()
+        if row is None or row[0] < cutoff:
+            return None
+        return json.loads(row[1])
+
+    def load_run(self, run_id: str) -> Dict[str, Dict[str, Any]]:
+        """Every unexpired stage payload of a run, keyed by stage"""
+        cutoff = time.time() - self.ttl
+        if self.path is None:
+            with self._lock:
+                rows = [(stage, updated, data) for (rid, stage), (updated, data) in self._memory.items() if rid == run_id]
+        else:
+            rows = self._connect().execute(
+                "SELECT stage, updated, payload FROM runs WHERE run_id = ?", (run_id,)
+            ).fetchall()
+        return {stage: json.loads(data) for stage, updated, data in rows if updated >= cutoff}
+
+    def purge(self) -> int:
+        """Deletes expired entries; returns how many were removed"""
+        cutoff = time.time() - self.ttl
+        if self.path is None:
+            with self._lock:
+                expired = [key for key, (updated, _) in self._memory.items() if updated < cutoff]
+                for key in expired:
+                    del self._memory[key]
+            return len(expired)
+        removed = self._connect().execute("DELETE FROM runs WHERE updated < ?", (cutoff,)).rowcount
+        if removed:
+            logger.debug("Purged %d expired run entries", removed)
+        return removed
+
+
+def _store_from_env() -> RunStore:
+    path = os.getenv("RUN_STORE_PATH", os.path.join(tempfile.gettempdir(), "storytopia-runs.sqlite3"))
+    try:
+        return RunStore(path)
+    except sqlite3.Error as e:
+        logger.warning("Cannot open run store %s (%s); runs are kept per process", path, e)
+        return RunStore(None)
+
+
+run_store = _store_from_env()
@@ -0,0 +1,145 @@
+"""
+Image Scheduler
+Process-wide priority queue for Imagen scene renders
+
+Every quest submits its scenes here instead of rendering them on its own
+thread, so the Imagen quota is spent on whichever scene a reader needs first
+across all users. Work is served earliest-deadline-first, where a scene's
+deadline is
+
+    request start + (scene_number - 1) * SCENE_SLACK_SECONDS
+
+Scene 1 of every quest is due as soon as its request starts, and later scenes
+are due progressively later while the child reads. So a new user's first page
+goes ahead of another user's scene 7, but a late scene that has waited long
+enough is not starved by a stream of new quests.
+
+The order holds within one process. Across workers, the shared buckets in
+pipeline.quota keep the total rate within quota.
+
+Environment:
+    IMAGE_SCHEDULER_WORKERS      renders running at once (default 4)
+    IMAGE_SCHEDULER_SCENE_SLACK  seconds of deadline per scene index (default 10)
+"""
+
+import contextvars
+import heapq
+import itertools
+import os
+import threading
+import time
+from concurrent.futures import Future
+from dataclasses import dataclass, field
+from typing import Any, Callable, Dict, List
+
+from observability.log import get_logger
+from observability.metrics import QUEUE_DEPTH, SCHEDULER_WAIT
+
+logger = get_logger("scheduler")
+
+SCENE_SLACK_SECONDS = float(os.getenv("IMAGE_SCHEDULER_SCENE_SLACK", "10"))
+
+
+@dataclass(order=True)
+class _Job:
+    deadline: float
+    sequence: int
+    priority: str = field(compare=False)
+    submitted: float = field(compare=False)
+    run: Callable[[], Any] = field(compare=False)
+    future: Future = field(compare=False)
+
+
+class ImageScheduler:
+    """Earliest-deadline-first job queue served by a fixed pool of worker threads"""
+
+    def __init__(self, workers: int = 4, name: str = "image_scheduler"):
+        self.workers = workers
+        self.name = name
+        self._heap: List[_Job] = []
+        self._sequence = itertools.count()
+        self._condition = threading.Condition()
+        self._threads: List[threading.Thread] = []
+        self.running = 0
+        self.completed = 0
+
+    def deadline_for(self, scene_number: int, request_started: float) -> float:
+        """Monotonic deadline of a scene in a request that started at `request_started`"""
+        return request_started + (max(1, scene_number) - 1) * SCENE_SLACK_SECONDS
+
+    def submit(self, fn: Callable[..., Any], *args, deadline: float, priority: str = "default") -> Future:
+        """
+        Queues fn(*args) to run in the caller's context
+
+        Args:
+            deadline: time.monotonic() value by which the result is wanted
+            priority: metric label for the job's priority class (e.g. the scene number)
+
+        Returns:
+            Future for the result; cancelling it before it starts drops the job
+        """
+        context = contextvars.copy_context()
+        job = _Job(
+            deadline=deadline,
+            sequence=next(self._sequence),
+            priority=priority,
+            submitted=time.monotonic(),
+            run=lambda: context.run(fn, *args),
+            future=Future(),
+        )
+        with self._condition:
+            self._ensure_workers()
+            heapq.heappush(self._heap, job)
+            QUEUE_DEPTH.set(len(self._heap), queue=self.name)
+            self._condition.notify()
+        return job.future
+
+    def _ensure_workers(self) -> None:
+        self._threads = [t for t in self._threads if t.is_alive()]
+        while len(self._threads) < self.workers:
+            thread = threading.Thread(
+                target=self._work, name=f"{self.name}-{len(self._threads)}", daemon=True
+            )
+            thread.start()
+            self._threads.append(thread)
+
+    def _next_job(self) -> _Job:
+        with self._condition:
+            while not self._heap:
+                self._condition.wait()
+            job = heapq.heappop(self._heap)
+            QUEUE_DEPTH.set(len(self._heap), queue=self.name)
+            return job
+
+    def _work(self) -> None:
+        while True:
+            job = self._next_job()
+            if not job.future.set_running_or_notify_cancel():
+                continue
+            waited = time.monotonic() - job.submitted
+            SCHEDULER_WAIT.observe(waited, priority=job.priority)
+            if waited > 1.0:
+                logger.debug("Scheduled %s job after %.1fs in queue", job.priority, waited)
+            with self._condition:
+                self.running += 1
+            try:
+                job.future.set_result(job.run())
+            except BaseException as e:
+                job.future.set_exception(e)
+            finally:
+                with self._condition:
+                    self.running -= 1
+                    self.completed += 1
+
+    def stats(self) -> Dict[str, object]:
+        with self._condition:
+            return {
+                "workers": self.workers,
+                "running": self.running,
+                "queued": len(self._heap),
+                "completed": self.completed,
+                "scene_slack_seconds": SCENE_SLACK_SECONDS,
+            }
+
+
+image_scheduler = ImageScheduler(workers=int(os.getenv("IMAGE_SCHEDULER_WORKERS", "4")))
@@ -0,0 +1,102 @@
+"""
+Single-Flight
+Coalesces identical in-flight external calls
+
+When a child double-clicks "play" or the frontend retries, the same TTS text,
+drawing or scene prompt can arrive several times at once. The first caller
+for a content key (the leader) makes the external call; concurrent callers
+with the same key wait for the leader's result (or exception) instead of
+calling Imagen / Gemini / TTS again. Keys are released as soon as the call
+finishes, so nothing is cached beyond the in-flight window.
+
+Coalescing is per process; callers are threads (tools run in worker threads).
+"""
+
+import copy
+import functools
+import hashlib
+import inspect
+import json
+import threading
+from concurrent.futures import Future
+from typing import Any, Callable, Dict, Tuple
+
+from observability.log import get_logger
+from observability.metrics import SINGLEFLIGHT_CALLS
+
+logger = get_logger("singleflight")
+
+
+def content_key(request: Dict[str, Any]) -> str:
+    """Stable hash of a JSON-serializable request description"""
+    return hashlib.sha256(json.dumps(request, sort_keys=True, default=str).encode()).hexdigest()
+
+
+class SingleFlight:
+    """Per-key leader election over concurrent.futures.Future"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._in_flight: Dict[Tuple[str, str], Future] = {}
+
+    def do(self, operation: str, request: Dict[str, Any], fn: Callable[[], Any]) -> Any:
+        """
+        Runs fn() unless an identical call is already in flight, then shares its outcome
+
+        Args:
+            operation: Call family, used in the key and as the metric label (e.g. "tts")
+            request: Everything that determines the result; hashed into the key
+            fn: Performs the call
+
+        Returns:
+            fn()'s result, from this call or from the concurrent leader
+        """
+        key = (operation, content_key(request))
+        with self._lock:
+            future = self._in_flight.get(key)
+            leader = future is None
+            if leader:
+                future = self._in_flight[key] = Future()
+
+        if not leader:
+            SINGLEFLIGHT_CALLS.inc(operation=operation, role="coalesced")
+            logger.debug("Coalesced %s call onto the in-flight request", operation)
+            # Callers may mutate what they get back (e.g. analysis dicts)
+            return copy.deepcopy(future.result())
+
+        SINGLEFLIGHT_CALLS.inc(operation=operation, role="leader")
+        try:
+            result = fn()
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        else:
+            future.set_result(result)
+            return result
+        finally:
+            with self._lock:
+                del self._in_flight[key]
+
+    def in_flight(self) -> int:
+        with self._lock:
+            return len(self._in_flight)
+
+
+single_flight = SingleFlight()
+
+
+def coalesced(operation: str) -> Callable:
+    """Decorator: coalesces concurrent calls whose bound arguments (defaults applied) are identical"""
+
+    def decorator(fn: Callable) -> Callable:
+        signature = inspect.signature(fn)
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            bound = signature.bind(*args, **kwargs)
+            bound.apply_defaults()
+            return single_flight.do(operation, dict(bound.arguments), lambda: fn(*args, **kwargs))
+
+        return wrapper
+
+    return decorator
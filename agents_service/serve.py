@@ -0,0 +1,265 @@
+"""
+Storytopia Production Server
+Pre-forking multi-process entry point for the agents service
+
+    python serve.py --workers 4
+    ddtrace-run python serve.py
+
+The master binds the listening socket once and forks the workers; each worker
+runs its own uvicorn server and event loop on the shared socket, and the
+kernel spreads connections across them. With preloading, main.py (ADK agents,
+schemas, Pillow) and the lesson library are loaded once in the master, so
+workers start fast and share those pages copy-on-write. Network clients
+(Vertex AI, TTS, GCS) are created lazily and therefore only ever exist in
+workers; each worker warms them up before it accepts traffic.
+
+SIGTERM / SIGINT: the master forwards SIGTERM to every worker. A worker stops
+accepting connections, lets in-flight pipelines finish for up to
+SERVE_GRACEFUL_TIMEOUT seconds and then runs the app's lifespan shutdown
+(which drains the evaluation emitter). Workers still alive after the timeout
+are killed. Workers that die unexpectedly are replaced.
+
+Environment:
+    HOST                    bind address (default 0.0.0.0)
+    PORT                    listen port (default 8080)
+    WEB_CONCURRENCY         worker processes (default: CPU count)
+    SERVE_PRELOAD           1 (default) loads the app in the master before forking
+    SERVE_WARMUP            1 (default) warms up clients in each worker before serving
+    SERVE_GRACEFUL_TIMEOUT  seconds to drain in-flight requests on shutdown (default 120)
+"""
+
+import argparse
+import os
+import signal
+import socket
+import sys
+import threading
+import time
+import traceback
+from typing import Dict, List, Optional
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+from observability.log import get_logger
+
+logger = get_logger("serve")
+
+# A worker that exits sooner than this after starting is crash-looping; respawns are delayed
+MIN_WORKER_LIFETIME = 5.0
+
+
+def load_app():
+    """Imports the FastAPI app and the data it reads on every request"""
+    from agents.lesson_library import lesson_library
+    from main import app
+
+    lesson_library.load()
+    return app
+
+
+def warm_up() -> None:
+    """Creates this worker's model / TTS clients before it accepts traffic (failures are logged, not fatal)"""
+    from tools.imagen_tool import ensure_vertex_ai_initialized
+    from tools.tts_tool import get_tts_client
+    from tools.vision_tool import ensure_vertexai_initialized
+
+    steps = {
+        "aiplatform": ensure_vertex_ai_initialized,
+        "vertexai": ensure_vertexai_initialized,
+        "tts_client": get_tts_client,
+    }
+    for name, step in steps.items():
+        started = time.perf_counter()
+        try:
+            step()
+        except Exception as e:
+            logger.warning("Warm-up step %s failed: %s", name, e)
+            continue
+        logger.debug("Warm-up step %s took %.2fs", name, time.perf_counter() - started)
+
+
+def shared_state_warnings(workers: int) -> List[str]:
+    """Process-local state whose behavior changes once requests are spread over several workers"""
+    if workers <= 1:
+        return []
+
+    from pipeline.admission import admission
+    from pipeline.idempotency import idempotency_store
+    from pipeline.quota import MemoryBackend, quota
+    from pipeline.scheduler import image_scheduler
+    from tools.cassette import cassette
+
+    warnings = []
+    if quota.backend is None:
+        warnings.append("QUOTA_BACKEND=off: model calls are not rate limited at all")
+    elif isinstance(quota.backend, MemoryBackend):
+        warnings.append(
+            f"QUOTA_BACKEND=memory keeps per-worker buckets: up to {workers}x the configured model RPM "
+            "can be sent; use the sqlite (default) or http backend"
+        )
+    if idempotency_store.path is None:
+        warnings.append("Idempotency keys are tracked per worker: repeats reaching another worker run again")
+    if admission.enabled:
+        limits = ", ".join(f"{name} {workers * pool.concurrency}" for name, pool in admission.pools.items())
+        warnings.append(f"Admission limits apply per worker; deployment-wide concurrency is {limits}")
+    warnings.append(
+        f"Each worker renders up to {image_scheduler.workers} images at once ({workers * image_scheduler.workers} "
+        "in total); deadline ordering and single-flight coalescing only see one worker's requests"
+    )
+    warnings.append("/metrics and /health only report the worker that answers the request")
+    if cassette.recording:
+        warnings.append(f"Cassette recording from {workers} workers writes to {cassette.directory} concurrently")
+    return warnings
+
+
+def bind_socket(host: str, port: int) -> socket.socket:
+    family = socket.AF_INET6 if ":" in host else socket.AF_INET
+    sock = socket.socket(family, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((host, port))
+    sock.listen(2048)
+    sock.set_inheritable(True)
+    return sock
+
+
+def _exit_with_master(master_pid: int) -> None:
+    """Stops the worker gracefully if the master dies without signalling it"""
+    while os.getppid() == master_pid:
+        time.sleep(1.0)
+    os.kill(os.getpid(), signal.SIGTERM)
+
+
+def run_worker(index: int, sock: socket.socket, app, args: argparse.Namespace, master_pid: int) -> None:
+    """Forked worker body; never returns"""
+    import uvicorn
+
+    # Ctrl+C reaches only the master, which forwards a single SIGTERM
+    os.setpgid(0, 0)
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    signal.signal(signal.SIGINT, signal.SIG_DFL)
+    threading.Thread(target=_exit_with_master, args=(master_pid,), name="master-watch", daemon=True).start()
+
+    status = 0
+    try:
+        started = time.perf_counter()
+        if app is None:
+            app = load_app()
+        if args.warmup:
+            warm_up()
+        logger.info("Worker %d (pid %d) ready in %.2fs", index, os.getpid(), time.perf_counter() - started)
+
+        config = uvicorn.Config(
+            app,
+            host=args.host,
+            port=args.port,
+            timeout_graceful_shutdown=args.graceful_timeout,
+        )
+        uvicorn.Server(config).run(sockets=[sock])
+    except BaseException:
+        traceback.print_exc()
+        status = 1
+    finally:
+        sys.stdout.flush()
+        sys.stderr.flush()
+        os._exit(status)
+
+
+class Master:
+    """Forks, supervises and drains the worker processes"""
+
+    def __init__(self, sock: socket.socket, app, args: argparse.Namespace):
+        self.sock = sock
+        self.app = app
+        self.args = args
+        self.workers: Dict[int, tuple] = {}  # pid -> (index, started)
+        self.stopping = False
+        self.deadline: Optional[float] = None
+
+    def spawn(self, index: int) -> None:
+        master_pid = os.getpid()
+        pid = os.fork()
+        if pid == 0:
+            run_worker(index, self.sock, self.app, self.args, master_pid)
+        self.workers[pid] = (index, time.monotonic())
+
+    def stop(self, signum, frame) -> None:
+        if self.stopping:
+            return
+        self.stopping = True
+        # Uvicorn's own shutdown waits graceful_timeout; allow a little extra for lifespan shutdown
+        self.deadline = time.monotonic() + self.args.graceful_timeout + 10.0
+        logger.info("Received %s, draining %d workers", signal.Signals(signum).name, len(self.workers))
+        for pid in self.workers:
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    def run(self) -> int:
+        signal.signal(signal.SIGTERM, self.stop)
+        signal.signal(signal.SIGINT, self.stop)
+        for index in range(self.args.workers):
+            self.spawn(index)
+
+        while self.workers:
+            try:
+                pid, status = os.waitpid(-1, os.WNOHANG)
+            except ChildProcessError:
+                break
+            if pid == 0:
+                if self.stopping and time.monotonic() > self.deadline:
+                    logger.warning("Killing %d workers that did not drain in time", len(self.workers))
+                    for pid in self.workers:
+                        os.kill(pid, signal.SIGKILL)
+                    self.deadline = float("inf")
+                time.sleep(0.2)
+                continue
+
+            index, started = self.workers.pop(pid)
+            if self.stopping:
+                continue
+            logger.warning("Worker %d (pid %d) exited with status %d; replacing it", index, pid, os.waitstatus_to_exitcode(status))
+            if time.monotonic() - started < MIN_WORKER_LIFETIME:
+                time.sleep(1.0)
+            self.spawn(index)
+
+        logger.info("All workers stopped")
+        return 0
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Run the Storytopia agents service with several worker processes")
+    parser.add_argument("--host", default=os.getenv("HOST", "0.0.0.0"))
+    parser.add_argument("--port", type=int, default=int(os.getenv("PORT", 8080)))
+    parser.add_argument("--workers", type=int, default=int(os.getenv("WEB_CONCURRENCY", os.cpu_count() or 1)))
+    parser.add_argument(
+        "--preload", action=argparse.BooleanOptionalAction, default=os.getenv("SERVE_PRELOAD", "1") != "0",
+        help="Load the app in the master before forking",
+    )
+    parser.add_argument(
+        "--warmup", action=argparse.BooleanOptionalAction, default=os.getenv("SERVE_WARMUP", "1") != "0",
+        help="Create model / TTS clients in each worker before it serves",
+    )
+    parser.add_argument(
+        "--graceful-timeout", type=float, default=float(os.getenv("SERVE_GRACEFUL_TIMEOUT", "120")),
+        help="Seconds in-flight requests may take to finish on shutdown",
+    )
+    args = parser.parse_args()
+
+    sock = bind_socket(args.host, args.port)
+    app = None
+    if args.preload:
+        started = time.perf_counter()
+        app = load_app()
+        logger.info("Preloaded the app in %.2fs", time.perf_counter() - started)
+    for warning in shared_state_warnings(args.workers):
+        logger.warning(warning)
+
+    logger.info("Serving on %s:%d with %d workers (pid %d)", args.host, args.port, args.workers, os.getpid())
+    sys.exit(Master(sock, app, args).run())
+
+
+if __name__ == "__main__":
+    main()
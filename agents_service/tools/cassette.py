@@ -0,0 +1,259 @@
+"""
+Cassette Tool
+Record/replay layer for every external call (Gemini, Imagen, TTS, GCS, ADK runners)
+
+In record mode each live call is executed and its response, latency and
+request fingerprint are written to a cassette directory. In replay mode the
+recorded response is served instead - no credentials, no cost - after
+sleeping for the recorded latency times a scale factor.
+
+ADK runs are recorded as whole event streams (with per-event timing), so in
+replay the tools an agent called (e.g. the Visionizer's vision + Imagen
+calls) are not executed again.
+
+Environment:
+    STORYTOPIA_CASSETTE_MODE           off (default) | record | replay
+    STORYTOPIA_CASSETTE_DIR            cassette directory (default ./cassettes)
+    STORYTOPIA_CASSETTE_LATENCY_SCALE  replay latency multiplier (default 1.0, 0 = instant)
+    STORYTOPIA_CASSETTE_STRICT         1 = fail on unmatched requests instead of
+                                       falling back to the next recording of that call
+
+Layout:
+    <dir>/index.jsonl                       one line per recorded call, in order
+    <dir>/<service>.<operation>/<key>.json  request summary, latency, JSON response
+    <dir>/<service>.<operation>/<key>.bin   binary response (images, audio)
+"""
+
+import asyncio
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import defaultdict
+from typing import Any, AsyncIterator, Callable, Dict, List, Optional
+
+from google.genai import types
+
+from observability.log import get_logger
+
+logger = get_logger("cassette")
+
+MODES = ("off", "record", "replay")
+
+
+class CassetteMiss(LookupError):
+    """No recording matches a call made in replay mode"""
+
+
+def digest(data: bytes) -> str:
+    """Short content fingerprint for large request fields (images, uploads)"""
+    return hash_digest(hashlib.sha256(data))
+
+
+def hash_digest(sha256: "hashlib._Hash") -> str:
+    """digest() of bytes already fed to a SHA-256 hasher (e.g. a streamed upload)"""
+    return sha256.hexdigest()[:16]
+
+
+class ReplayedEvent:
+    """Minimal stand-in for an ADK Event: the fields the API handlers read"""
+
+    def __init__(self, content: Optional[types.Content], partial: bool = False):
+        self.content = content
+        self.partial = partial
+
+
+class Cassette:
+    """Records or replays external calls keyed by (service, operation, request)"""
+
+    def __init__(self, mode: str = "off", directory: str = "cassettes", latency_scale: float = 1.0, strict: bool = False):
+        if mode not in MODES:
+            raise ValueError(f"Unknown cassette mode {mode!r}; expected one of {MODES}")
+        self.mode = mode
+        self.directory = directory
+        self.latency_scale = latency_scale
+        self.strict = strict
+        self._lock = threading.Lock()
+        self._sequence: Dict[str, List[str]] = defaultdict(list)
+        self._cursor: Dict[str, int] = defaultdict(int)
+        if mode == "replay":
+            self._load_index()
+
+    @property
+    def recording(self) -> bool:
+        return self.mode == "record"
+
+    @property
+    def replaying(self) -> bool:
+        return self.mode == "replay"
+
+    # ------------------------------------------------------------------
+    # Storage
+    # ------------------------------------------------------------------
+
+    @staticmethod
+    def _key(request: Dict[str, Any]) -> str:
+        return hashlib.sha256(json.dumps(request, sort_keys=True, default=str).encode()).hexdigest()[:20]
+
+    def _path(self, name: str, key: str, ext: str) -> str:
+        return os.path.join(self.directory, name, f"{key}.{ext}")
+
+    def _load_index(self) -> None:
+        index = os.path.join(self.directory, "index.jsonl")
+        if not os.path.exists(index):
+            raise FileNotFoundError(f"Cassette index not found: {index} (record first)")
+        with open(index) as f:
+            for line in f:
+                entry = json.loads(line)
+                self._sequence[entry["name"]].append(entry["key"])
+
+    def _save(self, name: str, key: str, request: Dict[str, Any], response: Any, latency: float) -> None:
+        record = {"request": request, "latency": latency}
+        if isinstance(response, (bytes, bytearray)):
+            record["binary"] = True
+        else:
+            record["response"] = response
+        with self._lock:
+            os.makedirs(os.path.join(self.directory, name), exist_ok=True)
+            if record.get("binary"):
+                with open(self._path(name, key, "bin"), "wb") as f:
+                    f.write(response)
+            with open(self._path(name, key, "json"), "w") as f:
+                json.dump(record, f, indent=2, default=str)
+            with open(os.path.join(self.directory, "index.jsonl"), "a") as f:
+                f.write(json.dumps({"name": name, "key": key, "recorded_at": time.time()}) + "\n")
+
+    def _load(self, name: str, key: str) -> Dict[str, Any]:
+        path = self._path(name, key, "json")
+        if not os.path.exists(path):
+            if self.strict or not self._sequence[name]:
+                raise CassetteMiss(f"No recording for {name} request {key}")
+            # Fall back to the recordings of this call in their original order
+            with self._lock:
+                keys = self._sequence[name]
+                fallback = keys[self._cursor[name] % len(keys)]
+                self._cursor[name] += 1
+            logger.debug("Cassette miss for %s %s; replaying %s", name, key, fallback)
+            key, path = fallback, self._path(name, fallback, "json")
+        with open(path) as f:
+            record = json.load(f)
+        if record.get("binary"):
+            with open(self._path(name, key, "bin"), "rb") as f:
+                record["response"] = f.read()
+        return record
+
+    # ------------------------------------------------------------------
+    # Synchronous calls (tools)
+    # ------------------------------------------------------------------
+
+    def call(self, service: str, operation: str, request: Dict[str, Any], live: Callable[[], Any]) -> Any:
+        """
+        Runs `live()` (off/record) or serves its recorded result (replay)
+
+        Args:
+            service: e.g. "imagen"
+            operation: e.g. "generate_images"
+            request: JSON-serializable fingerprint of the call; use digest() for bytes
+            live: Performs the real call; must return JSON data, str or bytes
+
+        Returns:
+            The live or recorded response
+        """
+        if self.mode == "off":
+            return live()
+
+        name = f"{service}.{operation}"
+        key = self._key(request)
+        if self.replaying:
+            record = self._load(name, key)
+            if self.latency_scale > 0:
+                time.sleep(record["latency"] * self.latency_scale)
+            return record["response"]
+
+        start = time.perf_counter()
+        response = live()
+        self._save(name, key, request, response, time.perf_counter() - start)
+        return response
+
+    # ------------------------------------------------------------------
+    # ADK runners
+    # ------------------------------------------------------------------
+
+    async def run_agent(self, runner, **kwargs) -> AsyncIterator[Any]:
+        """
+        Wraps Runner.run_async; events are recorded / replayed with their timing
+
+        Accepts the same keyword arguments as Runner.run_async.
+        """
+        if self.mode == "off":
+            async for event in runner.run_async(**kwargs):
+                yield event
+            return
+
+        message = kwargs.get("new_message")
+        request = {
+            "agent": runner.agent.name,
+            "message": "".join(part.text or "" for part in (message.parts if message else [])),
+            "streaming": bool(kwargs.get("run_config") and kwargs["run_config"].streaming_mode),
+        }
+        name = f"adk.{runner.agent.name}"
+        key = self._key(request)
+
+        if self.replaying:
+            record = await asyncio.to_thread(self._load, name, key)
+            last = 0.0
+            for entry in record["response"]:
+                if self.latency_scale > 0:
+                    await asyncio.sleep(max(0.0, entry["offset"] - last) * self.latency_scale)
+                last = entry["offset"]
+                content = None
+                if entry["parts"] is not None:
+                    content = types.Content(
+                        role=entry.get("role") or "model",
+                        parts=[types.Part.model_validate(p) for p in entry["parts"]],
+                    )
+                yield ReplayedEvent(content, entry["partial"])
+            return
+
+        start = time.perf_counter()
+        events = []
+        async for event in runner.run_async(**kwargs):
+            content = event.content
+            events.append({
+                "offset": time.perf_counter() - start,
+                "partial": bool(event.partial),
+                "role": content.role if content else None,
+                "parts": [p.model_dump(exclude_none=True, mode="json") for p in content.parts]
+                if content and content.parts else None,
+            })
+            yield event
+        await asyncio.to_thread(self._save, name, key, request, events, time.perf_counter() - start)
+
+
+def _from_env() -> Cassette:
+    return Cassette(
+        mode=os.getenv("STORYTOPIA_CASSETTE_MODE", "off").lower(),
+        directory=os.getenv("STORYTOPIA_CASSETTE_DIR", "cassettes"),
+        latency_scale=float(os.getenv("STORYTOPIA_CASSETTE_LATENCY_SCALE", "1.0")),
+        strict=os.getenv("STORYTOPIA_CASSETTE_STRICT", "0") == "1",
+    )
+
+
+cassette = _from_env()
+
+
+def configure(mode: str, directory: str = "cassettes", latency_scale: float = 1.0, strict: bool = False) -> Cassette:
+    """Replaces the process-wide cassette (used by benchmarks and profiling scripts)"""
+    global cassette
+    cassette = Cassette(mode, directory, latency_scale, strict)
+    return cassette
+
+
+def get_cassette() -> Cassette:
+    return cassette
+
+
+def run_agent(runner, **kwargs) -> AsyncIterator[Any]:
+    """Module-level shortcut for get_cassette().run_agent"""
+    return cassette.run_agent(runner, **kwargs)
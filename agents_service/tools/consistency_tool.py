@@ -0,0 +1,357 @@
+"""
+Consistency Tool
+Scores how well each Illustrator scene preserves the generated character
+Runs locally with NumPy/Pillow - no LLM call, all scenes scored as one batch
+"""
+
+import io
+import re
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+from PIL import Image
+
+from .storage_tool import download_from_gcs
+
+# Working resolution for histogram / palette comparisons
+ANALYSIS_SIZE = 64
+# pHash works on a 32x32 grayscale image and keeps the 8x8 low-frequency block
+PHASH_SIZE = 32
+PHASH_BLOCK = 8
+# 2 bits per channel -> 64 color bins; coarse enough to survive the lighting
+# changes between the character sheet and a scene
+HIST_BITS = 2
+# A palette color counts as present if this share of pixels is close to it
+PALETTE_MIN_COVERAGE = 0.005
+PALETTE_MAX_DISTANCE = 80.0
+
+# Character images are cropped to the pixels that differ from their border
+# (the plain background characters are drawn on) before they are compared
+FOREGROUND_DISTANCE = 48.0
+FOREGROUND_MIN_SHARE = 0.01
+FOREGROUND_MAX_SHARE = 0.95
+# A character color counts as fully present once the scene has this share of
+# the character's own amount of it (characters cover roughly 5-15% of a scene's pixels)
+SCENE_CHARACTER_SHARE = 0.05
+# Scenes are searched for the character with windows of these heights (share of
+# the scene height), stepped by half a window; the character may face either way
+SEARCH_HEIGHT = 96
+SEARCH_SCALES = (1.0, 0.75, 0.5)
+# Best-window pHash similarity of unrelated images; only the part above it counts
+PHASH_CHANCE = 0.65
+
+# Weights for the combined score (palette weight is redistributed when no palette
+# is known) and the pass threshold used for the illustrator_consistency
+# evaluation; calibrated with benchmarks/consistency_calibration.py. The color
+# histogram separates best on its own (balanced accuracy 0.79); palette and
+# pHash are still reported per scene but do not count towards the score
+WEIGHTS = {"histogram": 1.0, "palette": 0.0, "phash": 0.0}
+PASS_THRESHOLD = 0.6
+
+# Common color names used by the Visionizer analysis ("colors_used") and descriptions
+NAMED_COLORS = {
+    "red": (220, 40, 40),
+    "orange": (245, 140, 30),
+    "yellow": (250, 220, 50),
+    "gold": (212, 175, 55),
+    "green": (60, 170, 70),
+    "lime": (150, 220, 60),
+    "teal": (0, 128, 128),
+    "turquoise": (64, 224, 208),
+    "cyan": (0, 200, 220),
+    "blue": (40, 90, 210),
+    "navy": (20, 30, 100),
+    "purple": (130, 60, 170),
+    "violet": (150, 90, 200),
+    "magenta": (220, 40, 180),
+    "pink": (245, 150, 190),
+    "brown": (130, 80, 40),
+    "tan": (210, 180, 140),
+    "beige": (230, 215, 180),
+    "black": (20, 20, 20),
+    "gray": (128, 128, 128),
+    "grey": (128, 128, 128),
+    "silver": (192, 192, 192),
+    "white": (245, 245, 245),
+}
+
+_COLOR_WORD = re.compile(r"[a-z]+")
+
+
+def extract_palette(colors_used: Optional[List[str]] = None, description: str = "") -> np.ndarray:
+    """
+    Maps color names to an RGB palette array of shape (K, 3)
+    Uses colors_used when available, otherwise color words found in the description
+    """
+    words: List[str] = []
+    for color in colors_used or []:
+        words.extend(_COLOR_WORD.findall(str(color).lower()))
+    if not words and description:
+        words = _COLOR_WORD.findall(description.lower())
+
+    palette = []
+    seen = set()
+    for word in words:
+        rgb = NAMED_COLORS.get(word)
+        if rgb and rgb not in seen:
+            seen.add(rgb)
+            palette.append(rgb)
+
+    return np.asarray(palette, dtype=np.float32).reshape(-1, 3)
+
+
+def _decode(image_bytes: bytes) -> Image.Image:
+    """Decode image bytes into an RGB Pillow image, box-reduced to about twice ANALYSIS_SIZE on its short side"""
+    image = Image.open(io.BytesIO(image_bytes)).convert("RGB")
+    return image.reduce(max(1, min(image.size) // (2 * ANALYSIS_SIZE)))
+
+
+def _load_scene(image_bytes: bytes) -> Tuple[np.ndarray, Image.Image]:
+    """
+    Decodes a scene straight to the sizes the scorer uses (Pillow releases the GIL, so scenes decode in parallel)
+
+    Returns:
+        ((S, S, 3) uint8 RGB at ANALYSIS_SIZE, grayscale image SEARCH_HEIGHT pixels high)
+    """
+    image = Image.open(io.BytesIO(image_bytes))
+    # JPEGs decode at a reduced scale; PNGs (Imagen's format) are decoded in full
+    image.draft("RGB", (max(1, image.width * SEARCH_HEIGHT // max(1, image.height)), SEARCH_HEIGHT))
+    image = image.convert("RGB")
+    # Box-reduce to about SEARCH_HEIGHT first; filtered resizes of the full-size scene dominate otherwise
+    image = image.reduce(max(1, image.height // SEARCH_HEIGHT))
+    rgb = np.asarray(image.resize((ANALYSIS_SIZE, ANALYSIS_SIZE), Image.BILINEAR), dtype=np.uint8)
+    width = max(1, round(image.width * SEARCH_HEIGHT / image.height))
+    return rgb, image.convert("L").resize((width, SEARCH_HEIGHT), Image.BILINEAR)
+
+
+def foreground(image: Image.Image) -> Tuple[Image.Image, np.ndarray]:
+    """
+    Crops a character image to its foreground
+
+    The background color is the median of the border pixels. Images whose
+    foreground is (almost) empty or fills the frame are returned unchanged.
+
+    Returns:
+        (cropped image, (S, S) boolean foreground mask of the crop at ANALYSIS_SIZE)
+    """
+    def mask_of(img: Image.Image, background: np.ndarray) -> np.ndarray:
+        small = np.asarray(img.resize((ANALYSIS_SIZE, ANALYSIS_SIZE), Image.BILINEAR), dtype=np.float32)
+        return np.linalg.norm(small - background, axis=-1) > FOREGROUND_DISTANCE
+
+    small = np.asarray(image.resize((ANALYSIS_SIZE, ANALYSIS_SIZE), Image.BILINEAR), dtype=np.float32)
+    border = np.concatenate([small[0], small[-1], small[:, 0], small[:, -1]])
+    background = np.median(border, axis=0)
+    mask = mask_of(image, background)
+    if not FOREGROUND_MIN_SHARE <= mask.mean() <= FOREGROUND_MAX_SHARE:
+        return image, np.ones((ANALYSIS_SIZE, ANALYSIS_SIZE), dtype=bool)
+
+    ys, xs = np.nonzero(mask)
+    sx, sy = image.width / ANALYSIS_SIZE, image.height / ANALYSIS_SIZE
+    crop = image.crop((int(xs.min() * sx), int(ys.min() * sy), int((xs.max() + 1) * sx), int((ys.max() + 1) * sy)))
+    return crop, mask_of(crop, background)
+
+
+def _rgb_array(images: List[Image.Image]) -> np.ndarray:
+    """(N, S, S, 3) uint8 at ANALYSIS_SIZE"""
+    return np.stack([
+        np.asarray(img.resize((ANALYSIS_SIZE, ANALYSIS_SIZE), Image.BILINEAR), dtype=np.uint8)
+        for img in images
+    ])
+
+
+def _gray_array(images: List[Image.Image]) -> np.ndarray:
+    """(N, P, P) float32 grayscale at PHASH_SIZE"""
+    return np.stack([
+        np.asarray(img.convert("L").resize((PHASH_SIZE, PHASH_SIZE), Image.BILINEAR), dtype=np.float32)
+        for img in images
+    ])
+
+
+def color_histograms(rgb: np.ndarray, mask: Optional[np.ndarray] = None) -> np.ndarray:
+    """Normalized joint RGB histograms, shape (N, 2**(3*HIST_BITS)); `mask` (N, S, S) limits the counted pixels"""
+    n = rgb.shape[0]
+    bins = 1 << (3 * HIST_BITS)
+    q = (rgb >> (8 - HIST_BITS)).astype(np.int64)
+    idx = (q[..., 0] << (2 * HIST_BITS)) | (q[..., 1] << HIST_BITS) | q[..., 2]
+    idx = idx.reshape(n, -1) + (np.arange(n, dtype=np.int64) * bins)[:, None]
+    weights = None if mask is None else mask.reshape(-1).astype(np.float32)
+    hist = np.bincount(idx.ravel(), weights=weights, minlength=n * bins).reshape(n, bins).astype(np.float32)
+    return hist / np.maximum(hist.sum(axis=1, keepdims=True), 1e-9)
+
+
+def character_color_coverage(character_hist: np.ndarray, scene_hists: np.ndarray) -> np.ndarray:
+    """
+    Share of the character's colors found in each scene, shape (N,)
+
+    Each color bin counts fully once the scene holds SCENE_CHARACTER_SHARE of
+    the character's amount of it, so the score does not depend on how much of
+    the scene the character fills.
+    """
+    wanted = SCENE_CHARACTER_SHARE * character_hist[None, :]
+    present = np.minimum(1.0, scene_hists / np.maximum(wanted, 1e-9))
+    return (present * character_hist[None, :]).sum(axis=1)
+
+
+def _dct_matrix(size: int) -> np.ndarray:
+    """Orthonormal DCT-II basis matrix"""
+    k = np.arange(size)[:, None]
+    x = np.arange(size)[None, :]
+    mat = np.cos(np.pi * (2 * x + 1) * k / (2 * size)) * np.sqrt(2.0 / size)
+    mat[0, :] = np.sqrt(1.0 / size)
+    return mat.astype(np.float32)
+
+
+_DCT = _dct_matrix(PHASH_SIZE)
+
+
+def perceptual_hashes(gray: np.ndarray) -> np.ndarray:
+    """pHash per image: the 8x8 low-frequency DCT block without its DC term, as a boolean array of shape (N, 63)"""
+    coeffs = _DCT @ gray @ _DCT.T
+    low = coeffs[:, :PHASH_BLOCK, :PHASH_BLOCK].reshape(gray.shape[0], -1)[:, 1:]  # drop DC term
+    return low > np.median(low, axis=1, keepdims=True)
+
+
+def search_windows(scene_gray: Image.Image, aspect: float) -> np.ndarray:
+    """
+    Windows of a scene with the character's aspect ratio, resampled to PHASH_SIZE, shape (M, P, P)
+
+    scene_gray is the SEARCH_HEIGHT-high grayscale scene. Windows are taken at
+    every SEARCH_SCALES height, stepped by half a window: the scene is resized
+    once per scale so that a window becomes P x P pixels, and the windows are
+    strided views of that image.
+    """
+    height, width = scene_gray.height, scene_gray.width
+    windows = []
+    for scale in SEARCH_SCALES:
+        h = max(8, round(height * scale))
+        w = max(8, min(width, round(h * aspect)))
+        size = (max(PHASH_SIZE, round(width * PHASH_SIZE / w)), max(PHASH_SIZE, round(height * PHASH_SIZE / h)))
+        scaled = np.asarray(scene_gray.resize(size, Image.BILINEAR), dtype=np.float32)
+        views = np.lib.stride_tricks.sliding_window_view(scaled, (PHASH_SIZE, PHASH_SIZE))
+        step = PHASH_SIZE // 2
+        windows.append(views[::step, ::step].reshape(-1, PHASH_SIZE, PHASH_SIZE))
+    return np.concatenate(windows)
+
+
+def window_phash_similarity(character: Image.Image, scene_grays: List[Image.Image]) -> np.ndarray:
+    """
+    Best pHash similarity between the (mirrored) character and any search window of each scene, shape (N,)
+
+    The windows of all scenes are hashed and compared as one batch. Rescaled so
+    PHASH_CHANCE (what unrelated images reach) maps to 0.
+    """
+    aspect = character.width / max(1, character.height)
+    character_hashes = perceptual_hashes(_gray_array([character, character.transpose(Image.FLIP_LEFT_RIGHT)]))
+    windows = [search_windows(scene, aspect) for scene in scene_grays]
+    offsets = np.cumsum([0] + [len(w) for w in windows[:-1]])
+    hashes = perceptual_hashes(np.concatenate(windows)).astype(np.float32)
+    ref = character_hashes.astype(np.float32)
+    # Matching bits = both set + both clear, for each (window, orientation)
+    matches = hashes @ ref.T + (1.0 - hashes) @ (1.0 - ref).T
+    raw = np.maximum.reduceat(matches.max(axis=1), offsets) / ref.shape[1]
+    return np.clip((raw - PHASH_CHANCE) / (1.0 - PHASH_CHANCE), 0.0, 1.0)
+
+
+def palette_coverage(rgb: np.ndarray, palette: np.ndarray) -> np.ndarray:
+    """Share of palette colors present in each image, shape (N,)"""
+    n = rgb.shape[0]
+    if palette.shape[0] == 0:
+        return np.zeros(n, dtype=np.float32)
+    pixels = rgb.reshape(n, -1, 3).astype(np.float32)
+    distances = np.linalg.norm(pixels[:, :, None, :] - palette[None, None, :, :], axis=-1)
+    coverage = (distances < PALETTE_MAX_DISTANCE).mean(axis=1)  # (N, K)
+    return (coverage >= PALETTE_MIN_COVERAGE).mean(axis=1)
+
+
+def score_images(
+    character_bytes: bytes,
+    scene_bytes: List[bytes],
+    palette: Optional[np.ndarray] = None,
+) -> List[Dict[str, float]]:
+    """
+    Scores every scene against the character image
+
+    Scenes are decoded in parallel threads; color terms and the pHash search
+    windows of all scenes are then computed as vectorized batches.
+
+    Args:
+        character_bytes: Encoded character image
+        scene_bytes: Encoded scene images
+        palette: Optional (K, 3) RGB palette from extract_palette
+
+    Returns:
+        One dict per scene with histogram, palette, phash and combined score (0.0-1.0)
+    """
+    if not scene_bytes:
+        return []
+    if palette is None:
+        palette = np.zeros((0, 3), dtype=np.float32)
+
+    with ThreadPoolExecutor(max_workers=min(8, len(scene_bytes))) as pool:
+        loaded = pool.map(_load_scene, scene_bytes)
+        character, character_mask = foreground(_decode(character_bytes))
+        scene_rgb, scene_grays = zip(*loaded)
+    scene_rgb = np.stack(scene_rgb)
+
+    character_hist = color_histograms(_rgb_array([character]), character_mask[None])[0]
+    histogram_sim = character_color_coverage(character_hist, color_histograms(scene_rgb))
+
+    phash_sim = window_phash_similarity(character, list(scene_grays))
+
+    weights = dict(WEIGHTS)
+    if palette.shape[0]:
+        palette_sim = palette_coverage(scene_rgb, palette)
+    else:
+        palette_sim = np.zeros(len(scene_bytes), dtype=np.float32)
+        weights["histogram"] += weights.pop("palette")
+        weights["palette"] = 0.0
+
+    combined = (
+        weights["histogram"] * histogram_sim
+        + weights["palette"] * palette_sim
+        + weights["phash"] * phash_sim
+    )
+    combined = np.clip(combined, 0.0, 1.0)
+
+    return [
+        {
+            "score": float(combined[i]),
+            "histogram": float(histogram_sim[i]),
+            "palette": float(palette_sim[i]),
+            "phash": float(phash_sim[i]),
+        }
+        for i in range(len(scene_bytes))
+    ]
+
+
+def score_scene_consistency(
+    character_image_uri: str,
+    scene_uris: Dict[int, str],
+    colors_used: Optional[List[str]] = None,
+    character_description: str = "",
+) -> Dict[int, Dict[str, float]]:
+    """
+    Downloads the character and scene images once and scores every scene
+
+    Args:
+        character_image_uri: Public URI of the generated character image
+        scene_uris: Mapping of scene_number -> scene image URI (empty URIs are skipped)
+        colors_used: Visionizer colors for the palette match
+        character_description: Fallback source of color words
+
+    Returns:
+        Mapping of scene_number -> score breakdown (see score_images)
+    """
+    scenes = sorted((num, uri) for num, uri in scene_uris.items() if uri)
+    if not character_image_uri or not scenes:
+        return {}
+
+    uris = [character_image_uri] + [uri for _, uri in scenes]
+    with ThreadPoolExecutor(max_workers=min(8, len(uris))) as pool:
+        blobs = list(pool.map(download_from_gcs, uris))
+
+    palette = extract_palette(colors_used, character_description)
+    scores = score_images(blobs[0], blobs[1:], palette)
+
+    return {num: score for (num, _), score in zip(scenes, scores)}
@@ -0,0 +1,156 @@
+"""
+Creative Intent Tool
+Deterministic local pre-scorer for the Visionizer's character_description
+Only borderline descriptions are escalated to the AgentOps LLM judge
+"""
+
+import os
+import re
+import threading
+from typing import Any, Dict, List, Optional
+
+# Descriptions scoring outside [LOW, HIGH] are decided locally
+LOW_THRESHOLD = float(os.getenv("CREATIVE_INTENT_LOW_THRESHOLD", "0.3"))
+HIGH_THRESHOLD = float(os.getenv("CREATIVE_INTENT_HIGH_THRESHOLD", "0.75"))
+# Share of confident (LOW and HIGH band) cases still sent to the LLM so the
+# agreement rate covers the locally decided cases the thresholds are tuned on
+AUDIT_RATE = float(os.getenv("CREATIVE_INTENT_AUDIT_RATE", "0.05"))
+
+# Same pass mark as the creative_intent_score evaluation
+PASS_THRESHOLD = 0.5
+
+# Word count at which the length signal saturates
+TARGET_WORDS = 60
+# Distinct specificity terms at which the specificity signal saturates
+TARGET_SPECIFIC_TERMS = 8
+
+WEIGHTS = {
+    "length": 0.25,
+    "specificity": 0.35,
+    "colors": 0.2,
+    "character_type": 0.1,
+    "mood": 0.1,
+}
+
+# Concrete visual vocabulary: shapes, body features, clothing, expression and pose
+SPECIFICITY_TERMS = {
+    "round", "square", "tall", "tiny", "small", "big", "fluffy", "fuzzy", "spiky", "striped",
+    "spotted", "sparkly", "shiny", "curly", "long", "short", "pointy", "soft", "stripes", "spots",
+    "eyes", "ears", "tail", "wings", "horns", "paws", "claws", "whiskers", "nose", "mouth",
+    "smile", "smiling", "grin", "hair", "fur", "feathers", "scales", "legs", "arms", "hands",
+    "hat", "cape", "dress", "shirt", "boots", "shoes", "scarf", "bow", "crown", "glasses",
+    "backpack", "belt", "pattern", "patterns", "markings", "stars", "hearts", "waving",
+    "standing", "jumping", "flying", "holding", "happy", "cheerful", "curious", "friendly",
+}
+
+_WORD = re.compile(r"[a-z']+")
+
+
+def _words(text: str) -> List[str]:
+    return _WORD.findall((text or "").lower())
+
+
+def _term_match(field: Any, words: set) -> float:
+    """Share of the field's words that appear in the description (0.0 when the field is missing or empty)"""
+    field_words = [w for w in _words(str(field or "")) if len(w) > 2]
+    if not field_words:
+        return 0.0
+    return sum(1 for w in field_words if w in words) / len(field_words)
+
+
+def prescore(character_description: str, analysis: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+    """
+    Scores a character_description without calling an LLM
+
+    Args:
+        character_description: Visionizer character description
+        analysis: Visionizer analysis (colors_used, character_type, mood); a
+            missing or empty field scores 0 for its signal, since there is
+            nothing the description can be checked against
+
+    Returns:
+        Dict with score (0.0-1.0), per-signal breakdown and decision:
+        "local" when the score is confidently low/high, "escalate" when borderline
+    """
+    analysis = analysis if isinstance(analysis, dict) else {}
+    words = _words(character_description)
+    if not words:
+        return {"score": 0.0, "signals": {}, "decision": "local"}
+
+    word_set = set(words)
+    colors = [str(c).lower() for c in analysis.get("colors_used") or []]
+    if colors:
+        color_coverage = sum(
+            1 for c in colors if any(w in word_set for w in _words(c))
+        ) / len(colors)
+    else:
+        color_coverage = 0.0
+
+    signals = {
+        "length": min(1.0, len(words) / TARGET_WORDS),
+        "specificity": min(1.0, len(word_set & SPECIFICITY_TERMS) / TARGET_SPECIFIC_TERMS),
+        "colors": color_coverage,
+        "character_type": _term_match(analysis.get("character_type"), word_set),
+        "mood": _term_match(analysis.get("mood"), word_set),
+    }
+    score = sum(WEIGHTS[name] * value for name, value in signals.items())
+    score = max(0.0, min(1.0, score))
+
+    decision = "local" if score < LOW_THRESHOLD or score > HIGH_THRESHOLD else "escalate"
+    return {"score": score, "signals": signals, "decision": decision}
+
+
+def build_reasoning(result: Dict[str, Any]) -> str:
+    """Human-readable summary of a local pre-score for the LLMObs evaluation"""
+    signals = result.get("signals") or {}
+    if not signals:
+        return "Local pre-scorer: empty character_description."
+    parts = ", ".join(f"{name}={value:.2f}" for name, value in signals.items())
+    return f"Local pre-scorer ({parts})."
+
+
+class AgreementTracker:
+    """
+    Tracks agreement between the local pre-score and the LLM judge
+    Used to tune LOW_THRESHOLD / HIGH_THRESHOLD from real traffic
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.local_decisions = 0
+        self.escalations = 0
+        self.compared = 0
+        self.agreements = 0
+        self.total_abs_error = 0.0
+
+    def record_decision(self, escalated: bool) -> None:
+        with self._lock:
+            if escalated:
+                self.escalations += 1
+            else:
+                self.local_decisions += 1
+
+    def record_comparison(self, local_score: float, llm_score: float) -> bool:
+        """Records one local vs. LLM pair; returns True when both agree on pass/fail"""
+        agree = (local_score >= PASS_THRESHOLD) == (llm_score >= PASS_THRESHOLD)
+        with self._lock:
+            self.compared += 1
+            self.agreements += int(agree)
+            self.total_abs_error += abs(local_score - llm_score)
+        return agree
+
+    def snapshot(self) -> Dict[str, float]:
+        with self._lock:
+            decided = self.local_decisions + self.escalations
+            return {
+                "local_decisions": self.local_decisions,
+                "escalations": self.escalations,
+                "local_share": self.local_decisions / decided if decided else 0.0,
+                "agreement_rate": self.agreements / self.compared if self.compared else 0.0,
+                "mean_abs_error": self.total_abs_error / self.compared if self.compared else 0.0,
+                "low_threshold": LOW_THRESHOLD,
+                "high_threshold": HIGH_THRESHOLD,
+            }
+
+
+agreement_tracker = AgreementTracker()
@@ -0,0 +1,116 @@
+"""
+Image Variants Tool
+Transcodes generated images into responsive WebP / JPEG variants
+
+Imagen returns full-size PNGs (1408x768 scenes, 1024x1024 characters). The
+quest book only needs a thumbnail and a display-size image per page, so each
+generated image is transcoded once with Pillow. The variants are uploaded in
+parallel, together with the original PNG, and returned as a srcset-style map:
+
+    {"480w": ".../scene_480w.webp", "960w": ".../scene_960w.webp", "1408w": ".../scene_1408w.webp"}
+
+The original PNG stays available as image_uri, for consistency scoring and
+for clients that do not use the variants.
+
+Environment:
+    IMAGE_VARIANT_FORMAT   webp (default) | jpeg
+    IMAGE_VARIANT_QUALITY  encoder quality (default 80 for WebP, 85 for JPEG)
+"""
+
+import contextvars
+import io
+import os
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Optional, Tuple
+
+from PIL import Image
+
+from observability.log import get_logger
+from observability.metrics import timed_stage
+from .storage_tool import upload_to_gcs
+
+logger = get_logger("image_variants")
+
+VARIANT_FORMAT = os.getenv("IMAGE_VARIANT_FORMAT", "webp").lower()
+
+# Target widths per image kind; None = original width (still transcoded)
+VARIANT_WIDTHS: Dict[str, Tuple[Optional[int], ...]] = {
+    "scene": (480, 960, None),
+    "character": (256, 512, None),
+}
+
+_FORMATS = {
+    # format -> (Pillow format, extension, content type, default quality)
+    "webp": ("WEBP", "webp", "image/webp", 80),
+    "jpeg": ("JPEG", "jpg", "image/jpeg", 85),
+}
+
+# Shared by every request: encodes and uploads run concurrently across images
+_executor = ThreadPoolExecutor(max_workers=8, thread_name_prefix="image-variants")
+
+
+def encode_variant(image: Image.Image, width: Optional[int], fmt: str = VARIANT_FORMAT) -> Tuple[bytes, int]:
+    """
+    Resizes (keeping the aspect ratio, never upscaling) and encodes one variant
+
+    Returns:
+        (encoded bytes, actual width)
+    """
+    pil_format, _, _, default_quality = _FORMATS[fmt]
+    quality = int(os.getenv("IMAGE_VARIANT_QUALITY", default_quality))
+    if width is not None and width < image.width:
+        height = round(image.height * width / image.width)
+        image = image.resize((width, height), Image.Resampling.LANCZOS)
+    if pil_format == "JPEG" and image.mode != "RGB":
+        image = image.convert("RGB")
+
+    buffer = io.BytesIO()
+    if pil_format == "WEBP":
+        image.save(buffer, format="WEBP", quality=quality, method=4)
+    else:
+        image.save(buffer, format="JPEG", quality=quality, optimize=True, progressive=True)
+    return buffer.getvalue(), image.width
+
+
+def _encode_and_upload(image: Image.Image, width: Optional[int], kind: str, fmt: str) -> Tuple[str, str]:
+    data, actual_width = encode_variant(image, width, fmt)
+    _, extension, content_type, _ = _FORMATS[fmt]
+    uri = upload_to_gcs(file_data=data, filename=f"{kind}_{actual_width}w.{extension}", content_type=content_type)
+    return f"{actual_width}w", uri
+
+
+def publish_image(image_bytes: bytes, kind: str) -> Dict[str, object]:
+    """
+    Uploads a generated PNG and its responsive variants in parallel
+
+    Variant failures are logged and skipped; only the original upload is required.
+
+    Args:
+        image_bytes: PNG returned by Imagen
+        kind: "scene" or "character" (selects the variant widths)
+
+    Returns:
+        {"image_uri": original PNG URI, "srcset": {"<width>w": variant URI}}
+    """
+    run_in_context = lambda fn, *args: _executor.submit(contextvars.copy_context().run, fn, *args)
+
+    original = run_in_context(upload_to_gcs, image_bytes, f"{kind}.png", "image/png")
+    srcset: Dict[str, str] = {}
+    with timed_stage("image_variants"):
+        try:
+            image = Image.open(io.BytesIO(image_bytes))
+            image.load()
+            futures = [
+                run_in_context(_encode_and_upload, image, width, kind, VARIANT_FORMAT)
+                for width in VARIANT_WIDTHS[kind]
+            ]
+            for future in futures:
+                try:
+                    descriptor, uri = future.result()
+                    srcset[descriptor] = uri
+                except Exception as e:
+                    logger.warning("%s variant failed: %s", kind, e)
+        except Exception as e:
+            logger.warning("Could not decode %s image for variants: %s", kind, e)
+
+    return {"image_uri": original.result(), "srcset": srcset}
@@ -7,8 +7,17 @@ import os
 import base64
 from google.cloud import aiplatform
 from vertexai.preview.vision_models import ImageGenerationModel
-from typing import Optional
-from .storage_tool import upload_to_gcs
+from typing import Any, Dict, Optional
+from .image_variants import publish_image
+from observability.log import get_logger
+from observability.metrics import UPSTREAM_RATE_LIMITED, UPSTREAM_RETRIES, timed_stage
+from .cassette import get_cassette
+from observability.costs import record_usage
+from pipeline.prompts import scene_prompt
+from pipeline.quota import IMAGEN_MODEL, QuotaTimeout, quota
+from pipeline.singleflight import coalesced
+
+logger = get_logger("imagen_tool")
 
 _initialized = False
 
@@ -22,18 +31,52 @@ def ensure_vertex_ai_initialized():
         _initialized = True
 
 
+def _generate_image_bytes(stage: str, **params) -> bytes:
+    """
+    Live Imagen call; returns the PNG bytes of the first generated image
+    
+    Recorded / replayed as "imagen.generate_images" when a cassette is active.
+    """
+    # Ensure Vertex AI is initialized
+    ensure_vertex_ai_initialized()
+    
+    # Wait for the deployment-wide Imagen quota (shared across workers)
+    quota.acquire(IMAGEN_MODEL)
+    model = ImageGenerationModel.from_pretrained(IMAGEN_MODEL)
+    images = model.generate_images(number_of_images=1, **params)
+    
+    # Check if images were actually generated
+    # Note: images is an ImageGenerationResponse object, not a list
+    if not images or not hasattr(images, 'images') or len(images.images) == 0:
+        raise Exception("Imagen returned no images. This may be due to safety filters blocking the content.")
+    
+    record_usage(stage, IMAGEN_MODEL, images=1)
+    return images.images[0]._image_bytes
+
+
+def _imagen_call(stage: str, **params) -> bytes:
+    """Imagen call for `stage` ("imagen_character" / "imagen_scene"); the stage only labels usage"""
+    return get_cassette().call("imagen", "generate_images", params, lambda: _generate_image_bytes(stage, **params))
+
+
 def generate_character_image(prompt: str, negative_prompt: Optional[str] = None) -> str:
     """
     Generates a character image using Imagen 3.0
     Returns GCS URI of generated image
     """
+    return generate_character_asset(prompt, negative_prompt)["image_uri"]
+
+
+@coalesced("imagen_character")
+def generate_character_asset(prompt: str, negative_prompt: Optional[str] = None) -> Dict[str, Any]:
+    """
+    Generates a character image using Imagen 3.0, plus its responsive variants
+    Shared by concurrent identical requests
+    
+    Returns:
+        {"image_uri": PNG URI, "srcset": {"<width>w": variant URI}}
+    """
     try:
-        # Ensure Vertex AI is initialized
-        ensure_vertex_ai_initialized()
-        
-        # Initialize Imagen model
-        model = ImageGenerationModel.from_pretrained("imagen-3.0-generate-001")
-        
         # Set default negative prompt for child-safe content
         # Note: Mild sadness/crying is OK for teaching empathy
         if negative_prompt is None:
@@ -43,50 +86,40 @@ def generate_character_image(prompt: str, negative_prompt: Optional[str] = None)
         max_retries = 3
         retry_delay = 2
         
-        for attempt in range(max_retries):
-            try:
-                images = model.generate_images(
-                    prompt=prompt,
-                    number_of_images=1,
-                    negative_prompt=negative_prompt,
-                    aspect_ratio="1:1",
-                    safety_filter_level="block_some",
-                    person_generation="allow_adult"
-                )
-                break  # Success
-            except Exception as api_error:
-                error_str = str(api_error)
-                if "429" in error_str or "Resource exhausted" in error_str or "RESOURCE_EXHAUSTED" in error_str:
-                    if attempt < max_retries - 1:
-                        import time
-                        wait_time = retry_delay * (2 ** attempt)
-                        print(f"[Imagen Tool] Rate limit hit, waiting {wait_time}s before retry {attempt + 1}/{max_retries}...")
-                        time.sleep(wait_time)
-                        continue
+        with timed_stage("imagen_character"):
+            for attempt in range(max_retries):
+                try:
+                    image_bytes = _imagen_call(
+                        "imagen_character",
+                        prompt=prompt,
+                        negative_prompt=negative_prompt,
+                        aspect_ratio="1:1",
+                        safety_filter_level="block_some",
+                        person_generation="allow_adult"
+                    )
+                    break  # Success
+                except Exception as api_error:
+                    error_str = str(api_error)
+                    if "429" in error_str or "Resource exhausted" in error_str or "RESOURCE_EXHAUSTED" in error_str:
+                        UPSTREAM_RATE_LIMITED.inc(service="imagen")
+                        if attempt < max_retries - 1:
+                            import time
+                            wait_time = retry_delay * (2 ** attempt)
+                            logger.warning("Rate limit hit, waiting %ss before retry %d/%d", wait_time, attempt + 1, max_retries)
+                            UPSTREAM_RETRIES.inc(service="imagen")
+                            time.sleep(wait_time)
+                            continue
+                        else:
+                            raise Exception(f"Rate limit exceeded after {max_retries} attempts. Please wait a few minutes and try again.")
                     else:
-                        raise Exception(f"Rate limit exceeded after {max_retries} attempts. Please wait a few minutes and try again.")
-                else:
-                    raise
-        
-        # Get the first generated image
-        # images is an ImageGenerationResponse object with .images attribute
-        if not images or not hasattr(images, 'images') or len(images.images) == 0:
-            raise Exception("Oops, try drawing a different type of character!")
-        
-        generated_image = images.images[0]
-        
-        # Convert to bytes
-        image_bytes = generated_image._image_bytes
+                        raise
         
-        # Upload to GCS
-        image_uri = upload_to_gcs(
-            file_data=image_bytes,
-            filename="character.png",
-            content_type="image/png"
-        )
-        
-        return image_uri
+        # Upload the PNG and its WebP / JPEG variants to GCS
+        return publish_image(image_bytes, "character")
         
+    except QuotaTimeout:
+        # Surfaced as 429 by the endpoint, not as a drawing problem
+        raise
     except Exception as e:
         error_msg = str(e)
         # If it's already our user-friendly message, pass it through
@@ -99,6 +132,16 @@ def generate_character_image(prompt: str, negative_prompt: Optional[str] = None)
 def generate_scene_image(prompt: str, character_description: Optional[str] = None, enforce_consistency: bool = False) -> str:
     """
     Generates a scene/setting image using Imagen 3.0
+    Returns GCS URI of generated image
+    """
+    return generate_scene_asset(prompt, character_description, enforce_consistency)["image_uri"]
+
+
+@coalesced("imagen_scene")
+def generate_scene_asset(prompt: str, character_description: Optional[str] = None, enforce_consistency: bool = False) -> Dict[str, Any]:
+    """
+    Generates a scene/setting image using Imagen 3.0, plus its responsive variants
+    Concurrent identical requests share one Imagen call and upload
     
     Args:
         prompt: Scene description
@@ -106,78 +149,47 @@ def generate_scene_image(prompt: str, character_description: Optional[str] = Non
         enforce_consistency: If True, adds strict consistency requirements to prompt
     
     Returns:
-        GCS URI of generated image
+        {"image_uri": PNG URI, "srcset": {"<width>w": variant URI}}
     """
     try:
-        # Ensure Vertex AI is initialized
-        ensure_vertex_ai_initialized()
-        
-        model = ImageGenerationModel.from_pretrained("imagen-3.0-generate-001")
-        
-        # Enhance prompt with character if provided
-        if character_description:
-            full_prompt = f"{prompt}\n\nInclude this character: {character_description}"
-        else:
-            full_prompt = prompt
-        
-        # Add strong character consistency instruction if enforcing
-        if enforce_consistency and character_description:
-            full_prompt = f"""{full_prompt}
-
-CRITICAL CHARACTER CONSISTENCY REQUIREMENTS:
-- The character MUST maintain EXACT visual consistency with the description
-- Keep the SAME colors, proportions, features, and style as described
-- The character should be instantly recognizable as the same character
-- Do NOT change, morph, or alter the character's appearance
-- Maintain consistent: body shape, facial features, color palette, clothing/markings
-- Follow the character description PRECISELY without deviation
-"""
+        # Scene + character details not already in it + consistency rules, within the Imagen budget
+        full_prompt = scene_prompt(prompt, character_description, enforce_consistency)
         
         # Generate image with retry logic for rate limits
         max_retries = 3
         retry_delay = 2
         
-        for attempt in range(max_retries):
-            try:
-                images = model.generate_images(
-                    prompt=full_prompt,
-                    number_of_images=1,
-                    negative_prompt="violence, weapons, fighting, blood, gore, death, killing, scary monsters, horror, adult content, character inconsistency, different character, morphing",
-                    aspect_ratio="16:9",
-                    safety_filter_level="block_some"
-                )
-                
-                # Check if images were actually generated
-                # Note: images is an ImageGenerationResponse object, not a list
-                if not images or not hasattr(images, 'images') or len(images.images) == 0:
-                    raise Exception("Imagen returned no images. This may be due to safety filters blocking the content.")
-                
-                break  # Success
-            except Exception as api_error:
-                error_str = str(api_error)
-                if "429" in error_str or "Resource exhausted" in error_str or "RESOURCE_EXHAUSTED" in error_str:
-                    if attempt < max_retries - 1:
-                        import time
-                        wait_time = retry_delay * (2 ** attempt)
-                        print(f"[Imagen Tool] Rate limit hit, waiting {wait_time}s before retry {attempt + 1}/{max_retries}...")
-                        time.sleep(wait_time)
-                        continue
+        with timed_stage("imagen_scene"):
+            for attempt in range(max_retries):
+                try:
+                    image_bytes = _imagen_call(
+                        "imagen_scene",
+                        prompt=full_prompt,
+                        negative_prompt="violence, weapons, fighting, blood, gore, death, killing, scary monsters, horror, adult content, character inconsistency, different character, morphing",
+                        aspect_ratio="16:9",
+                        safety_filter_level="block_some"
+                    )
+                    break  # Success
+                except Exception as api_error:
+                    error_str = str(api_error)
+                    if "429" in error_str or "Resource exhausted" in error_str or "RESOURCE_EXHAUSTED" in error_str:
+                        UPSTREAM_RATE_LIMITED.inc(service="imagen")
+                        if attempt < max_retries - 1:
+                            import time
+                            wait_time = retry_delay * (2 ** attempt)
+                            logger.warning("Rate limit hit, waiting %ss before retry %d/%d", wait_time, attempt + 1, max_retries)
+                            UPSTREAM_RETRIES.inc(service="imagen")
+                            time.sleep(wait_time)
+                            continue
+                        else:
+                            raise Exception(f"Rate limit exceeded after {max_retries} attempts. Please wait a few minutes and try again.")
                     else:
-                        raise Exception(f"Rate limit exceeded after {max_retries} attempts. Please wait a few minutes and try again.")
-                else:
-                    raise
-        
-        generated_image = images.images[0]
-        image_bytes = generated_image._image_bytes
-        
-        # Upload to GCS
-        image_uri = upload_to_gcs(
-            file_data=image_bytes,
-            filename="scene.png",
-            content_type="image/png"
-        )
+                        raise
         
-        return image_uri
+        # Upload the PNG and its WebP / JPEG variants to GCS
+        return publish_image(image_bytes, "scene")
         
+    except QuotaTimeout:
+        raise
     except Exception as e:
         raise Exception(f"Failed to generate scene image: {str(e)}")
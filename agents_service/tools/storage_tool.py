@@ -1,41 +1,198 @@
 """
 Cloud Storage Tool
 Handles uploads and downloads from GCS
+
+Uploads are content-addressed: an object is named after the SHA-256 of its
+bytes (assets/<sha256>.<ext>), so identical drawings, images and audio are
+stored once, and a URL always refers to the same bytes. That makes every
+asset safe to cache forever (Cache-Control: immutable). Existing objects are
+detected and not uploaded again.
 """
 
+import hashlib
 import os
-import uuid
+import threading
+from collections import OrderedDict
+from google.api_core.exceptions import PreconditionFailed
 from google.cloud import storage
-from typing import Optional
+from typing import BinaryIO, Callable, Optional, Tuple
 import base64
 
+from observability.metrics import STORAGE_UPLOADS, timed_stage
+from .cassette import digest, get_cassette, hash_digest
+
 BUCKET_NAME = os.getenv("GCS_BUCKET_NAME", "storytopia-media-2025")
+ASSET_PREFIX = "assets/"
+# Content-addressed objects never change, so browsers and CDNs may keep them for a year
+ASSET_CACHE_CONTROL = "public, max-age=31536000, immutable"
+# ACL applied with the upload itself, so no object is ever left private
+PUBLIC_READ = "publicRead"
+
+# Object names known to exist in the bucket (skips the existence round-trip)
+_KNOWN_OBJECTS_MAX = 4096
+_known_objects: "OrderedDict[str, None]" = OrderedDict()
+_known_lock = threading.Lock()
+
+# Read size for streamed uploads (hashing pass)
+UPLOAD_CHUNK_SIZE = 64 * 1024
+
+# Supported drawing formats (detected from magic bytes) and their object extensions
+IMAGE_EXTENSIONS = {"image/png": ".png", "image/jpeg": ".jpg", "image/webp": ".webp"}
+
+
+def sniff_image_type(head: bytes) -> Optional[str]:
+    """Content type from the first bytes of an image, or None if it is not PNG / JPEG / WebP"""
+    if head.startswith(b"\x89PNG\r\n\x1a\n"):
+        return "image/png"
+    if head.startswith(b"\xff\xd8\xff"):
+        return "image/jpeg"
+    if head[:4] == b"RIFF" and head[8:12] == b"WEBP":
+        return "image/webp"
+    return None
+
 
 def get_storage_client():
     """Get or create storage client"""
     return storage.Client(project=os.getenv("GOOGLE_CLOUD_PROJECT"))
 
 
+def asset_name(file_data: bytes, filename: str) -> str:
+    """Content-addressed object name; the extension comes from `filename`"""
+    extension = os.path.splitext(filename)[1].lower()
+    return f"{ASSET_PREFIX}{hashlib.sha256(file_data).hexdigest()}{extension}"
+
+
+def _remember(name: str) -> None:
+    with _known_lock:
+        _known_objects[name] = None
+        _known_objects.move_to_end(name)
+        while len(_known_objects) > _KNOWN_OBJECTS_MAX:
+            _known_objects.popitem(last=False)
+
+
+def _store_object(name: str, write: Callable[[storage.Blob], None]) -> str:
+    """
+    Writes a content-addressed object unless it already exists
+    
+    Args:
+        name: Object name from asset_name / the streamed SHA-256
+        write: Uploads the bytes to the given blob, with if_generation_match=0
+            and predefined_acl=PUBLIC_READ so the object is public as it is created
+    
+    Returns:
+        Public URI of the (new or existing) object
+    """
+    storage_client = get_storage_client()
+    bucket = storage_client.bucket(BUCKET_NAME)
+    blob = bucket.blob(name)
+    
+    with _known_lock:
+        known = name in _known_objects
+    if known or blob.exists():
+        STORAGE_UPLOADS.inc(result="deduplicated")
+        _remember(name)
+        return blob.public_url
+    
+    # Upload with content type, public ACL and long-lived cache headers in one
+    # request (an existing object is therefore always public); the generation
+    # precondition makes a concurrent upload of the same bytes a no-op
+    blob.cache_control = ASSET_CACHE_CONTROL
+    try:
+        write(blob)
+    except PreconditionFailed:
+        STORAGE_UPLOADS.inc(result="deduplicated")
+        _remember(name)
+        return blob.public_url
+    
+    STORAGE_UPLOADS.inc(result="uploaded")
+    _remember(name)
+    
+    return blob.public_url
+
+
 def upload_to_gcs(file_data: bytes, filename: str, content_type: str = "image/png") -> str:
     """
-    Uploads file to Google Cloud Storage
+    Uploads file to Google Cloud Storage under the SHA-256 of its bytes
+    Skips the upload when the object already exists
     Returns public URI
     """
+    def upload() -> str:
+        return _store_object(
+            asset_name(file_data, filename),
+            lambda blob: blob.upload_from_string(
+                file_data, content_type=content_type, if_generation_match=0, predefined_acl=PUBLIC_READ
+            ),
+        )
+    
     try:
-        storage_client = get_storage_client()
-        bucket = storage_client.bucket(BUCKET_NAME)
-        
-        # Generate unique filename
-        unique_filename = f"{uuid.uuid4()}_{filename}"
-        blob = bucket.blob(unique_filename)
-        
-        # Upload with content type
-        blob.upload_from_string(file_data, content_type=content_type)
-        
-        # Make publicly accessible
-        blob.make_public()
-        
-        return blob.public_url
+        with timed_stage("gcs_upload"):
+            # Recorded / replayed when a cassette is active (see tools/cassette.py)
+            return get_cassette().call(
+                "gcs",
+                "upload",
+                {"filename": filename, "content_type": content_type, "data": digest(file_data)},
+                upload,
+            )
+    except Exception as e:
+        raise Exception(f"Failed to upload to GCS: {str(e)}")
+
+
+class UploadTooLarge(ValueError):
+    """A streamed upload exceeded its size limit"""
+
+
+def upload_stream_to_gcs(
+    stream: BinaryIO,
+    filename: str,
+    content_type: str = "image/png",
+    max_bytes: Optional[int] = None,
+    chunk_size: int = UPLOAD_CHUNK_SIZE,
+) -> Tuple[str, int]:
+    """
+    Uploads a seekable file object (e.g. an UploadFile's spooled file) in chunks
+    
+    The stream is read twice, chunk by chunk: once to hash it (and enforce
+    max_bytes), once by the GCS client to upload it. The whole file is never
+    held in memory.
+    
+    Returns:
+        (public URI, size in bytes)
+    
+    Raises:
+        UploadTooLarge: the stream is larger than max_bytes
+    """
+    sha256 = hashlib.sha256()
+    size = 0
+    stream.seek(0)
+    for chunk in iter(lambda: stream.read(chunk_size), b""):
+        size += len(chunk)
+        if max_bytes is not None and size > max_bytes:
+            raise UploadTooLarge(f"Upload exceeds {max_bytes} bytes")
+        sha256.update(chunk)
+    stream.seek(0)
+    
+    extension = os.path.splitext(filename)[1].lower()
+    name = f"{ASSET_PREFIX}{sha256.hexdigest()}{extension}"
+    
+    def upload() -> str:
+        return _store_object(
+            name,
+            lambda blob: blob.upload_from_file(
+                stream, content_type=content_type, size=size, if_generation_match=0, rewind=True,
+                predefined_acl=PUBLIC_READ,
+            ),
+        )
+    
+    try:
+        with timed_stage("gcs_upload"):
+            # Recorded / replayed when a cassette is active (see tools/cassette.py)
+            uri = get_cassette().call(
+                "gcs",
+                "upload",
+                {"filename": filename, "content_type": content_type, "data": hash_digest(sha256)},
+                upload,
+            )
+        return uri, size
     except Exception as e:
         raise Exception(f"Failed to upload to GCS: {str(e)}")
 
@@ -64,7 +221,6 @@ def download_from_gcs(uri: str) -> bytes:
     Returns file data
     """
     try:
-        storage_client = get_storage_client()
         # Extract bucket and blob name from URI
         if "storage.googleapis.com" in uri:
             parts = uri.split("/")
@@ -73,9 +229,13 @@ def download_from_gcs(uri: str) -> bytes:
         else:
             raise ValueError("Invalid GCS URI format")
         
-        bucket = storage_client.bucket(bucket_name)
-        blob = bucket.blob(blob_name)
+        def download() -> bytes:
+            storage_client = get_storage_client()
+            bucket = storage_client.bucket(bucket_name)
+            blob = bucket.blob(blob_name)
+            return blob.download_as_bytes()
         
-        return blob.download_as_bytes()
+        # Recorded / replayed when a cassette is active (see tools/cassette.py)
+        return get_cassette().call("gcs", "download", {"uri": uri}, download)
     except Exception as e:
         raise Exception(f"Failed to download from GCS: {str(e)}")
@@ -7,10 +7,16 @@ import base64
 from typing import Optional
 
 from google.cloud import texttospeech
-from ddtrace.llmobs import LLMObs
+from observability.costs import record_usage
+from observability.evaluations import emit_evaluation
+from observability.metrics import timed_stage
+from pipeline.singleflight import coalesced
 
+from .cassette import get_cassette
 from .storage_tool import upload_to_gcs
 
+TTS_MODEL = "gemini-2.5-flash-tts"
+
 _tts_client = None
 
 def get_tts_client():
@@ -20,10 +26,78 @@ def get_tts_client():
         _tts_client = texttospeech.TextToSpeechClient()
     return _tts_client
 
+
+def _synthesize(synthesis_input, voice, audio_config) -> bytes:
+    """Live Gemini-TTS call; returns the MP3 bytes"""
+    audio_content = get_tts_client().synthesize_speech(
+        input=synthesis_input,
+        voice=voice,
+        audio_config=audio_config,
+    ).audio_content
+    record_usage("tts", TTS_MODEL, characters=len(synthesis_input.text) + len(synthesis_input.prompt))
+    return audio_content
+
+
+@coalesced("tts")
+def synthesize_to_gcs(text: str, voice_name: str = "Kore") -> str:
+    """
+    Synthesize text with Gemini-TTS and upload the MP3 to GCS
+    
+    Concurrent requests for the same text and voice share one synthesis.
+    
+    Args:
+        text: Text to convert to speech
+        voice_name: Gemini-TTS voice
+    
+    Returns:
+        GCS URI of the uploaded audio
+    """
+    # Create child-friendly prompt for storytelling
+    prompt = "You are a friendly storyteller reading to children. Speak in a warm, engaging, and clear voice with appropriate emotion and pacing for young listeners."
+    
+    # Set up the synthesis input with Gemini-TTS prompt
+    synthesis_input = texttospeech.SynthesisInput(
+        text=text,
+        prompt=prompt
+    )
+    
+    # Build the voice request using Gemini-TTS model
+    voice = texttospeech.VoiceSelectionParams(
+        language_code="en-US",
+        name=voice_name,  # Use Gemini-TTS voices like "Kore", "Aoede", "Zephyr"
+        model_name=TTS_MODEL  # Use Gemini-TTS model
+    )
+    
+    # Select the type of audio file
+    audio_config = texttospeech.AudioConfig(
+        audio_encoding=texttospeech.AudioEncoding.MP3
+    )
+    
+    # Perform the text-to-speech request
+    with timed_stage("tts"):
+        # Recorded / replayed when a cassette is active (see tools/cassette.py)
+        audio_content = get_cassette().call(
+            "tts",
+            "synthesize_speech",
+            {"text": text, "voice_name": voice_name, "prompt": prompt, "model": TTS_MODEL},
+            lambda: _synthesize(synthesis_input, voice, audio_config),
+        )
+
+    # Upload audio to GCS
+    return upload_to_gcs(
+        file_data=audio_content,
+        filename="audio.mp3",
+        content_type="audio/mpeg",
+    )
+
+
 def text_to_speech(text: str, voice_name: str = "Kore") -> dict:
     """
     Convert text to speech using Gemini-TTS and return GCS URI with duration
     
+    Every caller emits its own tts_status evaluation, including callers whose
+    synthesis was coalesced onto a concurrent identical request.
+    
     Args:
         text: Text to convert to speech
         voice_name: Voice to use (default: Kore - child-friendly female voice)
@@ -32,67 +106,20 @@ def text_to_speech(text: str, voice_name: str = "Kore") -> dict:
         Dictionary with audio_uri and estimated_duration_seconds
     """
     try:
-        client = get_tts_client()
-        
-        # Create child-friendly prompt for storytelling
-        prompt = "You are a friendly storyteller reading to children. Speak in a warm, engaging, and clear voice with appropriate emotion and pacing for young listeners."
-        
-        # Set up the synthesis input with Gemini-TTS prompt
-        synthesis_input = texttospeech.SynthesisInput(
-            text=text,
-            prompt=prompt
-        )
-        
-        # Build the voice request using Gemini-TTS model
-        voice = texttospeech.VoiceSelectionParams(
-            language_code="en-US",
-            name=voice_name,  # Use Gemini-TTS voices like "Kore", "Aoede", "Zephyr"
-            model_name="gemini-2.5-flash-tts"  # Use Gemini-TTS model
-        )
-        
-        # Select the type of audio file
-        audio_config = texttospeech.AudioConfig(
-            audio_encoding=texttospeech.AudioEncoding.MP3
-        )
-        
-        # Perform the text-to-speech request
-        response = client.synthesize_speech(
-            input=synthesis_input,
-            voice=voice,
-            audio_config=audio_config,
-        )
-
-        # Upload audio to GCS
-        audio_uri = upload_to_gcs(
-            file_data=response.audio_content,
-            filename="audio.mp3",
-            content_type="audio/mpeg",
-        )
+        audio_uri = synthesize_to_gcs(text, voice_name=voice_name)
         
         # Estimate duration: average speaking rate is ~150 words per minute for children's content
         word_count = len(text.split())
         estimated_duration = (word_count / 150) * 60  # Convert to seconds
 
         # Datadog LLM Observability: submit TTS success evaluation
-        try:
-            span_ctx = LLMObs.export_span(span=None)
-            LLMObs.submit_evaluation(
-                span=span_ctx,
-                ml_app="storytopia-backend",
-                label="tts_status",
-                metric_type="score",
-                value=1.0,
-                tags={
-                    "component": "tts_tool",
-                    "voice": str(voice_name),
-                    "status": "success",
-                },
-                assessment="pass",
-                reasoning="Text-to-speech synthesis and upload to GCS succeeded.",
-            )
-        except Exception:
-            # Never fail the request due to observability issues
-            pass
+        emit_evaluation(
+            "tts_status",
+            1.0,
+            tags={"component": "tts_tool", "voice": voice_name, "status": "success"},
+            assessment="pass",
+            reasoning="Text-to-speech synthesis and upload to GCS succeeded.",
+        )
 
         return {
             "audio_uri": audio_uri,
@@ -102,24 +129,13 @@ def text_to_speech(text: str, voice_name: str = "Kore") -> dict:
 
     except Exception as e:
         # Datadog LLM Observability: submit TTS failure evaluation
-        try:
-            span_ctx = LLMObs.export_span(span=None)
-            LLMObs.submit_evaluation(
-                span=span_ctx,
-                ml_app="storytopia-backend",
-                label="tts_status",
-                metric_type="score",
-                value=0.0,
-                tags={
-                    "component": "tts_tool",
-                    "voice": str(voice_name),
-                    "status": "failure",
-                },
-                assessment="fail",
-                reasoning=f"Text-to-speech synthesis failed: {str(e)}",
-            )
-        except Exception:
-            pass
+        emit_evaluation(
+            "tts_status",
+            0.0,
+            tags={"component": "tts_tool", "voice": voice_name, "status": "failure"},
+            assessment="fail",
+            reasoning=f"Text-to-speech synthesis failed: {str(e)}",
+        )
 
         raise Exception(f"Failed to generate speech: {str(e)}")
 
@@ -5,9 +5,19 @@ Wrapper for Gemini Vision API to analyze images
 
 import os
 import vertexai
-from vertexai.generative_models import GenerativeModel, Part
+from vertexai.generative_models import GenerationConfig, GenerativeModel, Part
 from typing import Dict, Any
-import json
+
+from agents.schemas import DrawingAnalysis, parse_model, response_schema
+from tools.cassette import digest, get_cassette
+from observability.log import get_logger
+from observability.metrics import UPSTREAM_RATE_LIMITED, UPSTREAM_RETRIES, timed_stage
+from observability.costs import record_token_usage
+from pipeline.prompts import PromptBuilder
+from pipeline.quota import GEMINI_MODEL, QuotaTimeout, quota
+from pipeline.singleflight import single_flight
+
+logger = get_logger("vision_tool")
 
 _vertex_initialized = False
 
@@ -20,58 +30,91 @@ def ensure_vertexai_initialized():
         vertexai.init(project=project_id, location=location)
         _vertex_initialized = True
 
+
+def _generate_analysis(prompt: str, image_data: bytes, generation_config: GenerationConfig) -> str:
+    """Live Gemini Vision call; returns the schema-constrained JSON text"""
+    # Ensure Vertex AI is initialized
+    ensure_vertexai_initialized()
+    
+    # Wait for the deployment-wide Gemini quota (shared across workers)
+    quota.acquire(GEMINI_MODEL)
+    
+    # Initialize Vertex AI Gemini model
+    model = GenerativeModel(GEMINI_MODEL)
+    
+    # Create image part for Vertex AI
+    from .storage_tool import sniff_image_type
+    image_part = Part.from_data(data=image_data, mime_type=sniff_image_type(image_data[:16]) or "image/png")
+    
+    response = model.generate_content([prompt, image_part], generation_config=generation_config)
+    record_token_usage("vision_analysis", GEMINI_MODEL, getattr(response, "usage_metadata", None))
+    return response.text
+
 def analyze_drawing(image_uri: str) -> Dict[str, Any]:
     """
     Analyzes a child's drawing using Gemini Vision via Vertex AI
     Returns structured data about characters, setting, and style
     """
     try:
-        # Ensure Vertex AI is initialized
-        ensure_vertexai_initialized()
-        
-        # Initialize Vertex AI Gemini model
-        model = GenerativeModel('gemini-2.0-flash-exp')
-        
         # Download image from URI
         from .storage_tool import download_from_gcs
         image_data = download_from_gcs(image_uri)
         
-        # Create prompt for analysis
-        prompt = """
-        Analyze this child's drawing and extract the following information in JSON format:
-        
-        {
-            "character_type": "what type of character is drawn (e.g., person, animal, creature)",
-            "character_description": "detailed description of the character's appearance",
-            "colors_used": ["list of main colors"],
-            "artistic_style": "description of drawing style (e.g., crayon, pencil, marker)",
-            "mood": "overall mood/feeling of the drawing",
-            "age_appropriate": true/false,
-            "details": "any other notable details"
-        }
-        
-        Be creative and encouraging in your descriptions. This is for generating a cute animated character.
-        """
-        
-        # Create image part for Vertex AI
-        image_part = Part.from_data(data=image_data, mime_type="image/png")
-        
-        # Generate response with retry logic for rate limits
-        max_retries = 3
-        retry_delay = 2  # seconds
+        # Identical drawings submitted concurrently share one Gemini call
+        return single_flight.do(
+            "vision_analysis",
+            {"image": digest(image_data)},
+            lambda: _analyze_image(image_data),
+        )
         
+    except QuotaTimeout:
+        # Surfaced as 429 by the endpoint, not as an analysis failure
+        raise
+    except Exception as e:
+        raise Exception(f"Failed to analyze drawing: {str(e)}")
+
+
+def _analyze_image(image_data: bytes) -> Dict[str, Any]:
+    """Runs the Gemini Vision analysis (with rate-limit retries) on PNG bytes"""
+    # Create prompt for analysis (the JSON shape is enforced by the response schema)
+    prompt = """
+    Analyze this child's drawing: the character type, a detailed description of the
+    character's appearance, the main colors, the drawing style, the overall mood,
+    whether it is age appropriate, and any other notable details.
+    
+    Be creative and encouraging in your descriptions. This is for generating a cute animated character.
+    """
+    
+    generation_config = GenerationConfig(
+        response_mime_type="application/json",
+        response_schema=response_schema(DrawingAnalysis),
+    )
+    
+    # Generate response with retry logic for rate limits
+    max_retries = 3
+    retry_delay = 2  # seconds
+    
+    with timed_stage("vision_analysis"):
         for attempt in range(max_retries):
             try:
-                response = model.generate_content([prompt, image_part])
+                # Recorded / replayed when a cassette is active (see tools/cassette.py)
+                response_text = get_cassette().call(
+                    "gemini_vision",
+                    "generate_content",
+                    {"model": "gemini-2.0-flash-exp", "prompt": prompt, "image": digest(image_data)},
+                    lambda: _generate_analysis(prompt, image_data, generation_config),
+                )
                 break  # Success, exit retry loop
             except Exception as api_error:
                 error_str = str(api_error)
                 # Check if it's a rate limit error (429)
                 if "429" in error_str or "Resource exhausted" in error_str or "RESOURCE_EXHAUSTED" in error_str:
+                    UPSTREAM_RATE_LIMITED.inc(service="gemini_vision")
                     if attempt < max_retries - 1:
                         import time
                         wait_time = retry_delay * (2 ** attempt)  # Exponential backoff
-                        print(f"[Vision Tool] Rate limit hit, waiting {wait_time}s before retry {attempt + 1}/{max_retries}...")
+                        logger.warning("Rate limit hit, waiting %ss before retry %d/%d", wait_time, attempt + 1, max_retries)
+                        UPSTREAM_RETRIES.inc(service="gemini_vision")
                         time.sleep(wait_time)
                         continue
                     else:
@@ -79,22 +122,11 @@ def analyze_drawing(image_uri: str) -> Dict[str, Any]:
                 else:
                     # Not a rate limit error, raise immediately
                     raise
-        
-        # Parse JSON response
-        result_text = response.text.strip()
-        
-        # Extract JSON from markdown code blocks if present
-        if "```json" in result_text:
-            result_text = result_text.split("```json")[1].split("```")[0].strip()
-        elif "```" in result_text:
-            result_text = result_text.split("```")[1].split("```")[0].strip()
-        
-        result = json.loads(result_text)
-        
-        return result
-        
-    except Exception as e:
-        raise Exception(f"Failed to analyze drawing: {str(e)}")
+    
+    # Validate the schema-constrained JSON in a single pass
+    result = parse_model(DrawingAnalysis, response_text).model_dump()
+    
+    return result
 
 
 def create_character_prompt(analysis: Dict[str, Any]) -> str:
@@ -107,23 +139,24 @@ def create_character_prompt(analysis: Dict[str, Any]) -> str:
     colors = ", ".join(analysis.get("colors_used", []))
     style = analysis.get("artistic_style", "cartoon")
     
-    prompt = f"""
-    Create a cute, friendly, animated {character_type} character for a children's story.
-    
-    Character details: {description}
-    
-    Style: Pixar-style 3D animation, colorful, child-friendly, expressive, appealing
-    Colors: Incorporate {colors}
-    Mood: Warm, inviting, magical
-    
-    The character should be:
-    - Appropriate for children ages 4-10
-    - Expressive and friendly
-    - High quality, professional animation style
-    - Standing in a neutral pose
-    - On a simple, clean background
-    
-    Art style: Similar to Disney/Pixar animated films, vibrant colors, soft lighting
-    """
-    
-    return prompt.strip()
+    # Over the Imagen budget, the drawing's description is shortened; the style block is always sent
+    return (
+        PromptBuilder("imagen_character")
+        .add(f"Create a cute, friendly, animated {character_type} character for a children's story.")
+        .add(description, prefix="Character details: ", truncatable=True)
+        .add(f"""
+Style: Pixar-style 3D animation, colorful, child-friendly, expressive, appealing
+Colors: Incorporate {colors}
+Mood: Warm, inviting, magical
+
+The character should be:
+- Appropriate for children ages 4-10
+- Expressive and friendly
+- High quality, professional animation style
+- Standing in a neutral pose
+- On a simple, clean background
+
+Art style: Similar to Disney/Pixar animated films, vibrant colors, soft lighting
+""")
+        .build()
+    )
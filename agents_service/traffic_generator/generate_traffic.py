@@ -2,6 +2,7 @@ import base64
 import os
 import random
 import time
+import uuid
 from pathlib import Path
 
 import requests
@@ -20,6 +21,18 @@ LESSON_THEMES = [
 ]
 
 
+def post_idempotent(url: str, retries: int = 1, **kwargs) -> requests.Response:
+    """POST with an Idempotency-Key; a retry after a timeout reuses the key, so the backend runs the pipeline once."""
+    headers = {"Idempotency-Key": uuid.uuid4().hex, **kwargs.pop("headers", {})}
+    for attempt in range(retries + 1):
+        try:
+            return requests.post(url, headers=headers, **kwargs)
+        except (requests.Timeout, requests.ConnectionError) as e:
+            if attempt == retries:
+                raise
+            print(f"[traffic] {url} failed ({e.__class__.__name__}), retrying with the same Idempotency-Key")
+
+
 def load_images() -> list[Path]:
     """Return a list of image paths under traffic_generator/images."""
     if not IMAGES_DIR.exists():
@@ -47,7 +60,7 @@ def call_generate_character(image_path: Path, user_id: str) -> dict | None:
     }
 
     print(f"[traffic] POST {url} (user_id={user_id}, image={image_path.name})")
-    resp = requests.post(url, data=data, timeout=300)
+    resp = post_idempotent(url, data=data, timeout=300)
     print(f"[traffic] /generate-character status={resp.status_code}")
     if not resp.ok:
         print(f"[traffic] Error body: {resp.text[:500]}")
@@ -63,7 +76,7 @@ def call_generate_character(image_path: Path, user_id: str) -> dict | None:
     return payload
 
 
-def call_create_quest(character_description: str, character_name: str, lesson: str, character_image_uri: str | None) -> dict | None:
+def call_create_quest(character_description: str, character_name: str, lesson: str, character_image_uri: str | None, colors_used: list[str] | None = None) -> dict | None:
     """Call /create-quest using data from Visionizer + chosen lesson."""
     url = f"{BACKEND_URL}/create-quest"
     body = {
@@ -71,10 +84,11 @@ def call_create_quest(character_description: str, character_name: str, lesson: s
         "character_name": character_name,
         "lesson": lesson,
         "character_image_uri": character_image_uri,
+        "colors_used": colors_used or [],
     }
 
     print(f"[traffic] POST {url} (name={character_name}, lesson={lesson})")
-    resp = requests.post(url, json=body, timeout=600)
+    resp = post_idempotent(url, json=body, timeout=600)
     print(f"[traffic] /create-quest status={resp.status_code}")
     if not resp.ok:
         print(f"[traffic] Error body: {resp.text[:500]}")
@@ -148,6 +162,7 @@ def generate_traffic(num_iterations: int = 5, sleep_seconds: float = 5.0) -> Non
         character_description = gen_resp.get("analysis", {}).get("character_description") or gen_resp.get("character_description") or "A brave kid hero"
         character_name = gen_resp.get("character_type") or "Coco"
         character_image_uri = gen_resp.get("generated_character_uri") or None
+        colors_used = gen_resp.get("analysis", {}).get("colors_used") or []
 
         # 2) Quest Creator /create-quest
         quest_resp = call_create_quest(
@@ -155,6 +170,7 @@ def generate_traffic(num_iterations: int = 5, sleep_seconds: float = 5.0) -> Non
             character_name=character_name,
             lesson=lesson,
             character_image_uri=character_image_uri,
+            colors_used=colors_used,
         )
 
         narration_text = f"This is a short Storytopia narration about {character_name} learning {lesson}."
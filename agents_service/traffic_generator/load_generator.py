@@ -0,0 +1,288 @@
+import argparse
+import asyncio
+import base64
+import json
+import random
+import time
+from collections import defaultdict
+from dataclasses import dataclass, field
+
+import httpx
+
+from generate_traffic import BACKEND_URL, LESSON_THEMES, load_images
+
+ENDPOINTS = ("generate_character", "create_quest", "text_to_speech")
+
+# Used for /create-quest until a /generate-character call has returned a real character
+DEFAULT_CHARACTER = {
+    "character_description": "A cheerful pink bunny with sparkly star patterns, big curious eyes, and a friendly smile",
+    "character_name": "Mila",
+    "character_image_uri": None,
+    "colors_used": ["pink", "yellow", "white"],
+}
+
+TIMEOUTS = {"generate_character": 300.0, "create_quest": 600.0, "text_to_speech": 120.0}
+
+
+@dataclass
+class Sample:
+    endpoint: str
+    scheduled_at: float
+    latency: float        # scheduled arrival -> response (includes client-side queueing)
+    service_time: float   # request sent -> response
+    status: str           # HTTP status code, "timeout" or "connection_error"
+    retry_after: str | None = None
+
+
+@dataclass
+class LoadState:
+    images: list[str]
+    characters: list[dict] = field(default_factory=lambda: [DEFAULT_CHARACTER])
+    samples: list[Sample] = field(default_factory=list)
+    in_flight: int = 0
+    max_in_flight: int = 0
+
+
+def parse_mix(spec: str) -> dict[str, float]:
+    """Parse "generate_character=1,create_quest=1,text_to_speech=3" into endpoint weights."""
+    weights = {}
+    for item in spec.split(","):
+        name, _, weight = item.partition("=")
+        name = name.strip()
+        if name not in ENDPOINTS:
+            raise argparse.ArgumentTypeError(f"unknown endpoint {name!r}; expected one of {', '.join(ENDPOINTS)}")
+        weights[name] = float(weight or 1)
+    if not any(weights.values()):
+        raise argparse.ArgumentTypeError("mix needs at least one positive weight")
+    return weights
+
+
+def percentile(values: list[float], p: float) -> float | None:
+    if not values:
+        return None
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, round(p / 100 * len(ordered)) - 1))
+    return ordered[index]
+
+
+async def send(client: httpx.AsyncClient, endpoint: str, state: LoadState, user_id: str) -> httpx.Response:
+    """Issue one request for the given endpoint."""
+    if endpoint == "generate_character":
+        return await client.post(
+            "/generate-character",
+            data={"drawing_data": random.choice(state.images), "user_id": user_id},
+            timeout=TIMEOUTS[endpoint],
+        )
+    if endpoint == "create_quest":
+        character = random.choice(state.characters)
+        return await client.post(
+            "/create-quest",
+            json={**character, "lesson": random.choice(LESSON_THEMES)},
+            timeout=TIMEOUTS[endpoint],
+        )
+    character = random.choice(state.characters)
+    return await client.post(
+        "/text-to-speech",
+        json={
+            "text": f"This is a short Storytopia narration about {character['character_name']} learning {random.choice(LESSON_THEMES)}.",
+            "voice_name": "Kore",
+        },
+        timeout=TIMEOUTS[endpoint],
+    )
+
+
+def remember_character(state: LoadState, payload: dict) -> None:
+    """Reuse characters returned by /generate-character for later /create-quest calls."""
+    analysis = payload.get("analysis") or {}
+    description = analysis.get("character_description") or payload.get("character_description")
+    if not description:
+        return
+    state.characters.append({
+        "character_description": description,
+        "character_name": payload.get("character_type") or "Coco",
+        "character_image_uri": payload.get("generated_character_uri") or None,
+        "colors_used": analysis.get("colors_used") or [],
+    })
+    # Keep the pool small so quests keep a realistic mix of characters
+    del state.characters[1:-16]
+
+
+async def request_task(
+    client: httpx.AsyncClient,
+    semaphore: asyncio.Semaphore,
+    state: LoadState,
+    endpoint: str,
+    scheduled_at: float,
+    user_id: str,
+) -> None:
+    async with semaphore:
+        state.in_flight += 1
+        state.max_in_flight = max(state.max_in_flight, state.in_flight)
+        sent_at = time.monotonic()
+        retry_after = None
+        try:
+            response = await send(client, endpoint, state, user_id)
+            status = str(response.status_code)
+            retry_after = response.headers.get("retry-after")
+            if endpoint == "generate_character" and response.is_success:
+                try:
+                    remember_character(state, response.json())
+                except ValueError:
+                    pass
+        except httpx.TimeoutException:
+            status = "timeout"
+        except httpx.TransportError:
+            status = "connection_error"
+        finally:
+            state.in_flight -= 1
+        done_at = time.monotonic()
+        state.samples.append(Sample(endpoint, scheduled_at, done_at - scheduled_at, done_at - sent_at, status, retry_after))
+
+
+async def run_load(
+    backend_url: str,
+    rate: float,
+    concurrency: int,
+    mix: dict[str, float],
+    warmup: float,
+    duration: float,
+    images: list[str],
+    seed: int | None = None,
+) -> dict:
+    """Open-loop load: Poisson arrivals at `rate` req/s, at most `concurrency` requests in flight.
+
+    Arrivals are scheduled independently of responses, so a slow backend builds
+    a client-side queue instead of silently lowering the offered load. Latency is
+    measured from the scheduled arrival time.
+    """
+    rng = random.Random(seed)
+    endpoints, weights = zip(*mix.items())
+    state = LoadState(images=images)
+    semaphore = asyncio.Semaphore(concurrency)
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+
+    async with httpx.AsyncClient(base_url=backend_url, limits=limits) as client:
+        start = time.monotonic()
+        end = start + warmup + duration
+        next_arrival = start
+        tasks = []
+        i = 0
+        while next_arrival < end:
+            delay = next_arrival - time.monotonic()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            endpoint = rng.choices(endpoints, weights)[0]
+            tasks.append(asyncio.create_task(
+                request_task(client, semaphore, state, endpoint, next_arrival, f"load_user_{i % 50}")
+            ))
+            i += 1
+            next_arrival += rng.expovariate(rate)
+
+        print(f"[load] All {len(tasks)} arrivals scheduled; waiting for in-flight requests...")
+        await asyncio.gather(*tasks)
+        finished = time.monotonic()
+
+    steady_start = start + warmup
+    steady = [s for s in state.samples if s.scheduled_at >= steady_start]
+    return build_report(steady, {
+        "backend_url": backend_url,
+        "rate": rate,
+        "concurrency": concurrency,
+        "mix": mix,
+        "warmup_seconds": warmup,
+        "duration_seconds": duration,
+        "seed": seed,
+    }, elapsed=finished - steady_start, warmup_requests=len(state.samples) - len(steady), max_in_flight=state.max_in_flight)
+
+
+def summarize(samples: list[Sample], elapsed: float) -> dict:
+    ok = [s for s in samples if s.status.startswith("2")]
+    statuses: dict[str, int] = defaultdict(int)
+    for s in samples:
+        statuses[s.status] += 1
+    latencies = [s.latency for s in ok]
+    service = [s.service_time for s in ok]
+
+    def ms(value: float | None) -> float | None:
+        return None if value is None else round(value * 1000, 1)
+
+    return {
+        "requests": len(samples),
+        "succeeded": len(ok),
+        "errors": len(samples) - len(ok),
+        "rate_limited_429": statuses.get("429", 0),
+        "status_codes": dict(sorted(statuses.items())),
+        "retry_after_values": sorted({s.retry_after for s in samples if s.retry_after}),
+        "throughput_rps": round(len(ok) / elapsed, 3) if elapsed > 0 else None,
+        "latency_ms": {f"p{p}": ms(percentile(latencies, p)) for p in (50, 90, 99)},
+        "service_time_ms": {f"p{p}": ms(percentile(service, p)) for p in (50, 90, 99)},
+    }
+
+
+def build_report(samples: list[Sample], config: dict, elapsed: float, warmup_requests: int, max_in_flight: int) -> dict:
+    by_endpoint: dict[str, list[Sample]] = defaultdict(list)
+    for s in samples:
+        by_endpoint[s.endpoint].append(s)
+    return {
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "config": config,
+        "steady_state_seconds": round(elapsed, 3),
+        "warmup_requests": warmup_requests,
+        "max_in_flight": max_in_flight,
+        "overall": summarize(samples, elapsed),
+        "endpoints": {name: summarize(by_endpoint[name], elapsed) for name in ENDPOINTS if by_endpoint[name]},
+    }
+
+
+def print_report(report: dict) -> None:
+    print("\n" + "=" * 96)
+    cfg = report["config"]
+    print(f"[load] rate={cfg['rate']}/s concurrency={cfg['concurrency']} steady={report['steady_state_seconds']}s "
+          f"warmup_requests={report['warmup_requests']} max_in_flight={report['max_in_flight']}")
+    header = f"{'endpoint':<20}{'reqs':>6}{'ok':>6}{'err':>6}{'429':>6}{'rps':>8}{'p50 ms':>10}{'p90 ms':>10}{'p99 ms':>10}"
+    print(header)
+    print("-" * len(header))
+    rows = list(report["endpoints"].items()) + [("overall", report["overall"])]
+    for name, r in rows:
+        lat = r["latency_ms"]
+        fmt = lambda v: f"{v:>10.1f}" if v is not None else f"{'-':>10}"
+        print(f"{name:<20}{r['requests']:>6}{r['succeeded']:>6}{r['errors']:>6}{r['rate_limited_429']:>6}"
+              f"{(r['throughput_rps'] or 0):>8.2f}{fmt(lat['p50'])}{fmt(lat['p90'])}{fmt(lat['p99'])}")
+    errors = {k: v for k, v in report["overall"]["status_codes"].items() if not k.startswith("2")}
+    if errors:
+        print(f"[load] Error breakdown: {errors}")
+
+
+def encode_images(paths) -> list[str]:
+    return [base64.b64encode(p.read_bytes()).decode("utf-8") for p in paths]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Storytopia open-loop load generator")
+    parser.add_argument("--backend-url", default=BACKEND_URL, help="Service base URL")
+    parser.add_argument("--rate", type=float, default=0.5, help="Mean arrival rate in requests/second (Poisson)")
+    parser.add_argument("--concurrency", type=int, default=16, help="Max requests in flight (and pooled connections)")
+    parser.add_argument("--mix", type=parse_mix, default=parse_mix("generate_character=1,create_quest=1,text_to_speech=2"),
+                        help="Weighted endpoint mix, e.g. generate_character=1,create_quest=1,text_to_speech=2")
+    parser.add_argument("--warmup", type=float, default=30.0, help="Warm-up seconds excluded from the report")
+    parser.add_argument("--duration", type=float, default=120.0, help="Steady-state seconds")
+    parser.add_argument("--seed", type=int, default=None, help="Random seed for arrivals and the endpoint mix")
+    parser.add_argument("--output", help="Path for the JSON report")
+    args = parser.parse_args()
+
+    images = encode_images(load_images())
+    if not images and args.mix.get("generate_character"):
+        print("[load] No images found; dropping generate_character from the mix.")
+        args.mix.pop("generate_character")
+        if not args.mix:
+            raise SystemExit(1)
+
+    print(f"[load] Using backend: {args.backend_url}")
+    report = asyncio.run(run_load(
+        args.backend_url, args.rate, args.concurrency, args.mix, args.warmup, args.duration, images, args.seed,
+    ))
+    print_report(report)
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"[load] JSON report written to {args.output}")
@@ -1,6 +1,6 @@
 'use client'
 
-import { useState } from 'react'
+import { useRef, useState } from 'react'
 import DrawingCanvas from '@/components/DrawingCanvas'
 import QuestBook from '@/components/QuestBook'
 
@@ -27,6 +27,8 @@ export default function Home() {
   const [error, setError] = useState<string>('')
   const [characterName, setCharacterName] = useState<string>('')
   const [customLesson, setCustomLesson] = useState<string>('')
+  // Run ID of the last failed quest request, so retrying it resumes the server's checkpoints
+  const failedQuestRun = useRef<{ key: string, runId: string } | null>(null)
 
   const handleCharacterDrawn = async (imageData: string, characterName: string) => {
     setIsGenerating(true)
@@ -35,8 +37,10 @@ export default function Home() {
     try {
       const apiUrl = process.env.NEXT_PUBLIC_API_URL || 'http://localhost:8080'
       
+      // Send the PNG as a binary file part (base64 drawing_data is 33% larger)
+      const drawingBlob = await (await fetch(imageData)).blob()
       const formData = new FormData()
-      formData.append('drawing_data', imageData)
+      formData.append('drawing', drawingBlob, 'drawing.png')
       formData.append('user_id', 'demo_user_' + Date.now())
       formData.append('character_name', characterName)
 
@@ -85,26 +89,55 @@ export default function Home() {
     try {
       const apiUrl = process.env.NEXT_PUBLIC_API_URL || 'http://localhost:8080'
       
+      const questRequest = {
+        character_description: characterAnalysis?.character_description || '',
+        character_name: characterAnalysis?.character_name || characterAnalysis?.character_type || 'Character',
+        character_image_uri: generatedCharacter,  // Pass the generated character image URI
+        colors_used: characterAnalysis?.colors_used || [],  // Palette for the consistency scorer
+        lesson: lessonId
+      }
+      const runKey = JSON.stringify([questRequest.character_description, questRequest.character_name, lessonId])
+      const runId = failedQuestRun.current?.key === runKey ? failedQuestRun.current.runId : undefined
+
       // Call API to create quest
-      const response = await fetch(`${apiUrl}/create-quest`, {
+      const response = await fetch(`${apiUrl}/create-quest?fields=-scenes.image_prompt`, {
         method: 'POST',
         headers: { 'Content-Type': 'application/json' },
-        body: JSON.stringify({
-          character_description: characterAnalysis?.character_description || '',
-          character_name: characterAnalysis?.character_name || characterAnalysis?.character_type || 'Character',
-          character_image_uri: generatedCharacter,  // Pass the generated character image URI
-          lesson: lessonId
-        })
+        body: JSON.stringify({ ...questRequest, run_id: runId })
       })
 
       if (!response.ok) {
+        const failedRunId = response.headers.get('X-Run-Id')
+        failedQuestRun.current = failedRunId ? { key: runKey, runId: failedRunId } : null
         throw new Error('Failed to create quest')
       }
+      failedQuestRun.current = null
 
       const data = await response.json()
       setQuestData(data)
       setActiveStep('quest')
-      
+
+      // Re-render scenes whose illustration failed; the quest is playable meanwhile
+      const failedScenes = (data.scenes || [])
+        .filter((scene: any) => !scene.image_uri)
+        .map((scene: any) => scene.scene_number)
+      if (data.quest_id && failedScenes.length > 0) {
+        fetch(`${apiUrl}/regenerate-scenes?fields=-scenes.image_prompt`, {
+          method: 'POST',
+          headers: { 'Content-Type': 'application/json' },
+          body: JSON.stringify({ quest_id: data.quest_id, scene_numbers: failedScenes })
+        })
+          .then(res => (res.ok ? res.json() : null))
+          .then(result => {
+            if (!result) return
+            const updated = new Map(result.scenes.map((scene: any) => [scene.scene_number, scene]))
+            setQuestData((current: any) => current && current.quest_id === data.quest_id
+              ? { ...current, scenes: current.scenes.map((scene: any) => updated.get(scene.scene_number) || scene) }
+              : current)
+          })
+          .catch(err => console.error('Error regenerating scenes:', err))
+      }
+
     } catch (err: any) {
       setError(err.message || 'Failed to create quest')
       console.error('Error creating quest:', err)
@@ -18,8 +18,13 @@ interface QuestScene {
     feedback: string
   }
   image_uri: string
+  image_srcset?: Record<string, string> // e.g. {"480w": url, "960w": url} (WebP/JPEG variants)
 }
 
+// {"480w": url, ...} -> "url 480w, ..." for <img srcSet>
+const toSrcSet = (variants?: Record<string, string>) =>
+  variants ? Object.entries(variants).map(([width, url]) => `${url} ${width}`).join(', ') : undefined
+
 interface QuestBookProps {
   questTitle: string
   characterName: string
@@ -50,6 +55,8 @@ export default function QuestBook({ questTitle, characterName, scenes, onQuestCo
       const nextScene = scenes[currentPage + 1]
       if (nextScene?.image_uri) {
         const img = new Image()
+        img.sizes = '100vw'
+        img.srcset = toSrcSet(nextScene.image_srcset) ?? ''
         img.src = nextScene.image_uri
       }
     }
@@ -273,6 +280,8 @@ export default function QuestBook({ questTitle, characterName, scenes, onQuestCo
                 <img 
                   key={`scene-${currentScene.scene_number}-${currentScene.image_uri}`}
                   src={currentScene.image_uri} 
+                  srcSet={toSrcSet(currentScene.image_srcset)}
+                  sizes="100vw"
                   alt={`Scene ${currentScene.scene_number}`}
                   className="w-full h-full object-cover transition-opacity duration-300 ease-in-out"
                   loading="eager"